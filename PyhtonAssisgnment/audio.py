@@ -0,0 +1,198 @@
+"""
+Alert sound engine.
+
+Sounds are decoded once into `pygame.mixer.Sound` buffers (kept in a small
+LRU cache keyed by path) instead of being loaded from disk on every alert,
+and are reloaded when the "sound_normal" / "sound_urgent" settings change.
+Each priority plays on its own reserved mixer channel, so a normal and an
+urgent alert mix instead of cutting each other off, while a second alert of
+the same priority arriving within COLLAPSE_WINDOW (or while a looping alert
+is playing) collapses into the sound already playing.
+
+Completion callbacks are driven by the channels' end events, read by one
+watcher thread, rather than by polling `get_busy()`. Only pygame's event
+queue is used, so SDL's video driver defaults to "dummy"; set
+SDL_AUDIODRIVER=dummy as well to run without a sound card (e.g. in tests).
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+import db
+
+PRIORITIES = ("normal", "urgent")
+SOUND_SETTINGS = {"normal": "sound_normal", "urgent": "sound_urgent"}
+DEFAULT_FILES = {"normal": "notify.wav", "urgent": "urgent.wav"}
+CACHE_SIZE = 8
+MIXER_CHANNELS = 8
+COLLAPSE_WINDOW = 1.0  # seconds
+EVENT_WAIT_MS = 500
+
+
+def sound_path(priority):
+    """The configured sound for `priority`, else the bundled default; None if neither exists."""
+    path = db.get_setting(SOUND_SETTINGS[priority], "")
+    if path and os.path.exists(path):
+        return path
+    default = os.path.join(os.path.dirname(__file__), DEFAULT_FILES[priority])
+    return default if os.path.exists(default) else None
+
+
+class AudioEngine:
+    def __init__(self, cache_size=CACHE_SIZE, collapse_window=COLLAPSE_WINDOW):
+        self.cache_size = cache_size
+        self.collapse_window = collapse_window
+        self._pygame = None
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()  # path -> Sound, least recently used first
+        self._channels = {}
+        self._events = {}  # end event type -> priority
+        # One entry per play() still to finish on each channel; every play
+        # (including one that replaces or is stopped) posts exactly one end event.
+        self._pending = {p: deque() for p in PRIORITIES}
+        self._playing = {p: None for p in PRIORITIES}  # (path, started, loop)
+        self._stop = threading.Event()
+        self._thread = None
+
+    # --- Setup ---
+    def start(self):
+        """Open the mixer, preload both sounds and start the end-event watcher. Safe to call twice."""
+        with self._lock:
+            if self._pygame is not None:
+                return
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+            os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+            import pygame
+            pygame.mixer.init()
+            pygame.display.init()  # only for the event queue; no window is created
+            pygame.mixer.set_num_channels(max(MIXER_CHANNELS, len(PRIORITIES)))
+            pygame.mixer.set_reserved(len(PRIORITIES))
+            for index, priority in enumerate(PRIORITIES):
+                channel = pygame.mixer.Channel(index)
+                channel.set_endevent(pygame.USEREVENT + index)
+                self._channels[priority] = channel
+                self._events[pygame.USEREVENT + index] = priority
+            pygame.event.set_blocked(None)
+            pygame.event.set_allowed(list(self._events))
+            self._pygame = pygame
+        db.subscribe_setting(self._on_setting_changed)
+        self.preload()
+        self._thread = threading.Thread(target=self._watch, name="audio", daemon=True)
+        self._thread.start()
+
+    @property
+    def ready(self):
+        return self._pygame is not None
+
+    def shutdown(self):
+        self._stop.set()
+        db.unsubscribe_setting(self._on_setting_changed)
+        self.stop()
+
+    # --- Sound cache ---
+    def _sound(self, path):
+        with self._lock:
+            sound = self._cache.get(path)
+            if sound is not None:
+                self._cache.move_to_end(path)
+                return sound
+        sound = self._pygame.mixer.Sound(path)  # decode outside the lock
+        with self._lock:
+            self._cache[path] = sound
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return sound
+
+    def preload(self):
+        for priority in PRIORITIES:
+            path = sound_path(priority)
+            if path:
+                try:
+                    self._sound(path)
+                except Exception as e:
+                    print(f"[sound] cannot load {path}: {e}")
+
+    def _on_setting_changed(self, key, value):
+        if key not in SOUND_SETTINGS.values():
+            return
+        with self._lock:
+            # Re-selecting the same path re-decodes it, in case the file was replaced
+            self._cache.pop(value, None)
+        threading.Thread(target=self._reload, daemon=True).start()
+
+    def _reload(self):
+        try:
+            self.preload()
+        finally:
+            db.close_conn()
+
+    # --- Playback ---
+    def play(self, priority="normal", loop=False, on_done=None):
+        """
+        Play the sound for `priority`; `on_done()` runs on the watcher thread
+        once it has finished or been stopped. Returns False if there is no
+        sound to play, which callers treat as "fall back to the bell".
+        """
+        path = sound_path(priority)
+        if path is None:
+            return False
+        if self._pygame is None:
+            self.start()
+        sound = self._sound(path)
+        with self._lock:
+            channel = self._channels[priority]
+            pending = self._pending[priority]
+            playing = self._playing[priority]
+            if channel.get_busy() and pending and playing and playing[0] == path and (
+                    playing[2] or time.monotonic() - playing[1] < self.collapse_window):
+                # Collapse into the alert already playing
+                if on_done is not None:
+                    pending[-1].append(on_done)
+                return True
+            pending.append([on_done] if on_done is not None else [])
+            self._playing[priority] = (path, time.monotonic(), loop)
+            channel.play(sound, loops=-1 if loop else 0)
+        return True
+
+    def is_busy(self, priority):
+        with self._lock:
+            return bool(self._pending[priority])
+
+    def stop(self, priority=None):
+        """Stop one priority's channel, or all of them; their callbacks still run."""
+        if self._pygame is None:
+            return
+        with self._lock:
+            for p in (priority,) if priority else PRIORITIES:
+                self._channels[p].stop()
+
+    def _watch(self):
+        pygame = self._pygame
+        while not self._stop.is_set():
+            event = pygame.event.wait(EVENT_WAIT_MS)
+            priority = self._events.get(event.type)
+            if priority is None:
+                continue
+            with self._lock:
+                pending = self._pending[priority]
+                callbacks = pending.popleft() if pending else []
+                if not pending:
+                    self._playing[priority] = None
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    print("[sound] callback error:", e)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Process-wide AudioEngine; call `.start()` (it is slow) off the Tk thread."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AudioEngine()
+        return _engine
@@ -0,0 +1 @@
+"""Reproducible performance benchmarks for TEND; run with `python -m benchmarks` (see __main__.py)."""
@@ -0,0 +1,86 @@
+"""
+Benchmark runner.
+
+    python -m benchmarks                          # every benchmark at its default sizes
+    python -m benchmarks insert queries --sizes 1k,1m
+    python -m benchmarks --save-baseline          # record this run as the baseline
+    python -m benchmarks --compare                # exit 1 if anything regressed
+
+Run from the directory containing db.py. Each benchmark seeds its own
+temporary database, so tend.db is never touched. Every run is appended to
+the history file; --compare checks it against the baseline file.
+"""
+import argparse
+import os
+import sys
+import time
+from benchmarks import compare, suite, workloads
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_HISTORY = os.path.join(HERE, "results", "history.json")
+DEFAULT_BASELINE = os.path.join(HERE, "results", "baseline.json")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="benchmarks", description="TEND performance benchmarks")
+    parser.add_argument("names", nargs="*", metavar="NAME",
+                        help=f"benchmarks to run (default: all of {', '.join(suite.BENCHMARKS)})")
+    parser.add_argument("--sizes", help="comma-separated workload sizes, e.g. 1k,100k,10m (default: per benchmark)")
+    parser.add_argument("--distribution", choices=workloads.DISTRIBUTIONS,
+                        help="due-time distribution (default: per benchmark)")
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="JSON file the run is appended to")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="compare with the baseline; exit 1 on regression")
+    parser.add_argument("--threshold", type=float, default=compare.DEFAULT_THRESHOLD,
+                        help="allowed slowdown before a metric counts as a regression (fraction, default 0.2)")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - set(suite.BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+    names = args.names or list(suite.BENCHMARKS)
+    results = {}
+    for name in names:
+        func, default_sizes = suite.BENCHMARKS[name]
+        sizes = args.sizes.split(",") if args.sizes else default_sizes
+        for size in sizes:
+            key = f"{name}/{size}"
+            kwargs = {"distribution": args.distribution} if args.distribution else {}
+            print(f"[bench] {key} ...", end=" ", flush=True)
+            start = time.perf_counter()
+            try:
+                metrics = func(workloads.parse_size(size), **kwargs)
+            except suite.Skip as e:
+                print(f"skipped ({e})")
+                continue
+            results[key] = metrics
+            print(f"{time.perf_counter() - start:.1f}s")
+            for metric, value in metrics.items():
+                print(f"    {metric:<20} {value:12.3f}")
+
+    run = compare.make_run(results)
+    compare.append_history(args.history, run)
+    print(f"[bench] appended to {args.history}")
+    if args.save_baseline:
+        compare.save(args.baseline, run)
+        print(f"[bench] saved baseline {args.baseline}")
+    if args.compare:
+        baseline = compare.load(args.baseline)
+        if baseline is None:
+            print(f"[bench] no baseline at {args.baseline}; run with --save-baseline first", file=sys.stderr)
+            return 2
+        rows = compare.compare(run, baseline, args.threshold)
+        print(f"[bench] compared with baseline from {baseline['timestamp']} ({baseline.get('commit') or '?'}):")
+        compare.report(rows)
+        if any(r[-1] for r in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""
+JSON result history and baseline comparison.
+
+A run is stored as
+
+    {"timestamp": ..., "commit": ..., "python": ..., "platform": ...,
+     "results": {"<benchmark>/<size>": {"<metric>": value, ...}, ...}}
+
+`history.json` is a list of runs (appended to on every run); the baseline
+is a single run saved with --save-baseline. A metric regresses when it is
+more than `threshold` (a fraction) worse than the baseline: lower for
+"_per_s" metrics, higher for "_ms" metrics.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+DEFAULT_THRESHOLD = 0.20
+# Differences below this many ms are noise whatever the ratio
+MIN_DELTA_MS = 0.5
+
+
+def make_run(results):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(__file__), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def load(path, default=None):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def save(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def append_history(path, run):
+    history = load(path, [])
+    history.append(run)
+    save(path, history)
+
+
+def compare(run, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Return a list of (key, metric, baseline value, new value, change, regressed)
+    for every metric present in both runs; `change` is the fractional change
+    in the "worse" direction (positive = worse).
+    """
+    rows = []
+    for key, metrics in sorted(run["results"].items()):
+        old_metrics = baseline["results"].get(key)
+        if not old_metrics:
+            continue
+        for metric, new in sorted(metrics.items()):
+            old = old_metrics.get(metric)
+            if old is None or not old:
+                continue
+            if metric.endswith("_per_s"):
+                change = (old - new) / old
+                regressed = change > threshold
+            else:
+                change = (new - old) / old
+                regressed = change > threshold and (new - old) > MIN_DELTA_MS
+            rows.append((key, metric, old, new, change, regressed))
+    return rows
+
+
+def report(rows, out=sys.stdout):
+    if not rows:
+        print("[bench] nothing to compare against the baseline", file=out)
+        return
+    width = max(len(f"{k} {m}") for k, m, *_ in rows)
+    print(f"  {'metric':<{width}}  {'baseline':>12}    {'now':>12}  change (+ is worse)", file=out)
+    for key, metric, old, new, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"  {f'{key} {metric}':<{width}}  {old:>12.3f} -> {new:>12.3f}  {change:+7.1%}{flag}", file=out)
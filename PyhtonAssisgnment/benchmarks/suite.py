@@ -0,0 +1,197 @@
+"""
+The benchmarks. Each takes the workload size and returns a dict of
+metrics; names ending in "_per_s" are better when higher, names ending
+in "_ms" are better when lower (see compare.py). A benchmark that cannot
+run here (e.g. no display for Tk) raises Skip.
+"""
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta
+import db
+from scheduler import Dispatcher
+from shards import ShardedDispatcher
+from benchmarks import workloads
+
+QUERY_REPEATS = 20
+REFRESH_REPEATS = 20
+DISPATCH_TIMEOUT = 120.0
+SHARD_COUNTS = (1, 2, 4)
+
+
+class Skip(Exception):
+    pass
+
+
+def percentiles(samples, prefix, scale=1000.0):
+    """p50/p95/p99/max of `samples` (seconds) as "<prefix>_p50_ms", ... entries."""
+    ordered = sorted(samples)
+    n = len(ordered)
+    result = {}
+    for name, q in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+        result[f"{prefix}_{name}_ms"] = ordered[min(n - 1, int(q * n))] * scale
+    result[f"{prefix}_max_ms"] = ordered[-1] * scale
+    return result
+
+
+def _time_calls(func, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+# ---------- STORAGE ----------
+def bench_insert(n, distribution="uniform"):
+    path = workloads.temp_db()
+    try:
+        start = time.perf_counter()
+        inserted, _ = db.add_notifications_bulk(workloads.rows(n, distribution))
+        elapsed = time.perf_counter() - start
+    finally:
+        workloads.remove_db(path)
+    return {"rows_per_s": inserted / elapsed, "total_ms": elapsed * 1000}
+
+
+def bench_queries(n, distribution="uniform"):
+    path, _ = workloads.seed(n, distribution)
+    try:
+        now = datetime.now()
+        result = {}
+        queries = {
+            "pending": db.get_pending_notifications,
+            "between_24h": lambda: db.get_notifications_between(now, now + timedelta(hours=24)),
+            "count_7d": lambda: db.notifications_count_last_n_days(7),
+            "count_30d": lambda: db.notifications_count_last_n_days(30),
+        }
+        for name, query in queries.items():
+            query()  # warm the page cache and statement cache
+            samples = _time_calls(query, QUERY_REPEATS)
+            result[f"{name}_p50_ms"] = statistics.median(samples) * 1000
+            result[f"{name}_max_ms"] = max(samples) * 1000
+    finally:
+        workloads.remove_db(path)
+    return result
+
+
+# ---------- DISPATCH ----------
+def bench_dispatch(n, distribution="burst"):
+    """
+    Seed `n` alerts due over the next couple of seconds, run a real
+    Dispatcher and measure lateness (delivery time minus due time).
+    """
+    # Start the burst after seeding, so large workloads are not overdue before the Dispatcher runs
+    now = time.time() + 1.0
+    path, seed_seconds = workloads.seed(n, distribution, now=now)
+    lateness = []
+    done = threading.Event()
+    expected = db.get_conn().execute("SELECT COUNT(*) FROM notifications WHERE delivered=0").fetchone()[0]
+
+    def deliver(title, message, urgent, source=None):
+        lateness.append(time.time() - source["due_ts"])
+        if len(lateness) >= expected:
+            done.set()
+
+    db.set_settings([("meeting_mode", "0"), ("catchup_policy", "all")])
+    stop = threading.Event()
+    dispatcher = Dispatcher(stop, deliver)
+    try:
+        dispatcher.start()
+        if not done.wait(DISPATCH_TIMEOUT + seed_seconds):
+            raise RuntimeError(f"only {len(lateness)} of {expected} alerts dispatched")
+    finally:
+        dispatcher.stop()
+        dispatcher.join(5)
+        workloads.remove_db(path)
+    # due_ts is whole seconds, so nothing should be early; clamp just in case
+    return percentiles([max(0.0, x) for x in lateness], "lateness")
+
+
+def bench_sharded(n, distribution="burst"):
+    """
+    Throughput of ShardedDispatcher with 1, 2 and 4 shards: insert `n`
+    overdue alerts spread over 1000 keys and time until all are delivered.
+    `distribution` is ignored; every alert is due at once.
+    """
+    path = workloads.temp_db()
+    due = datetime.fromtimestamp(time.time() - 60).strftime(db.TIME_FORMAT)
+    result = {}
+    try:
+        db.set_settings([("meeting_mode", "0"), ("catchup_policy", "all")])
+        for count in SHARD_COUNTS:
+            delivered = [0]
+            done = threading.Event()
+
+            def deliver(title, message, urgent, source=None):
+                delivered[0] += 1
+                if delivered[0] >= n:
+                    done.set()
+
+            stop = threading.Event()
+            dispatcher = ShardedDispatcher(stop, deliver, shards=count, base_path=f"{path[:-3]}-{count}.db")
+            try:
+                dispatcher.start()
+                start = time.perf_counter()
+                dispatcher.add_many((f"user{i % 1000}", f"Task {i % workloads.TITLES}", f"Synthetic reminder {i}",
+                                     due, False) for i in range(n))
+                inserted = time.perf_counter()
+                if not done.wait(DISPATCH_TIMEOUT):
+                    raise RuntimeError(f"{count} shards: only {delivered[0]} of {n} alerts dispatched")
+                finished = time.perf_counter()
+            finally:
+                dispatcher.stop()
+                dispatcher.join(10)
+                for shard_path in dispatcher.paths:
+                    workloads.remove_db(shard_path)
+            result[f"insert_{count}_shards_per_s"] = n / (inserted - start)
+            result[f"dispatch_{count}_shards_per_s"] = n / (finished - inserted)
+    finally:
+        workloads.remove_db(path)
+    return result
+
+
+# ---------- UI ----------
+def bench_refresh(n, distribution="skewed"):
+    """Time TendApp.refresh_next_24h against a hidden Tk root (no TendApp, tray or audio)."""
+    import tkinter as tk
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        raise Skip(f"no display: {e}")
+    path, _ = workloads.seed(n, distribution)
+    try:
+        root.withdraw()
+        import gui
+        from widgets import VirtualTreeview
+
+        class Host:
+            refresh_next_24h = gui.TendApp.refresh_next_24h
+
+        host = Host()
+        host.search_var = tk.StringVar(root, "")
+        host._search_limit = gui.SEARCH_PAGE_SIZE
+        host.tree = VirtualTreeview(root, columns=("time", "title", "urgent"), headings={}, widths={})
+        host.tree.pack(fill="both", expand=True)
+
+        def refresh():
+            host.refresh_next_24h()
+            root.update_idletasks()
+
+        refresh()
+        samples = _time_calls(refresh, REFRESH_REPEATS)
+    finally:
+        root.destroy()
+        workloads.remove_db(path)
+    return {"refresh_p50_ms": statistics.median(samples) * 1000, "refresh_max_ms": max(samples) * 1000}
+
+
+# name -> (function, default sizes); sizes can be overridden on the command line
+BENCHMARKS = {
+    "insert": (bench_insert, ("1k", "10k", "100k")),
+    "queries": (bench_queries, ("1k", "10k", "100k")),
+    "dispatch": (bench_dispatch, ("1k", "10k")),
+    "sharded": (bench_sharded, ("10k", "100k")),
+    "refresh": (bench_refresh, ("1k", "10k")),
+}
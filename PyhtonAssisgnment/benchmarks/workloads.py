@@ -0,0 +1,88 @@
+"""
+Synthetic workloads for the benchmarks.
+
+Every workload is generated from a seed, so two runs with the same size,
+distribution and seed insert exactly the same rows. Due times are spread
+around `now` according to a distribution:
+
+    uniform - evenly over SPAN_DAYS centred on now (half of them overdue)
+    skewed  - mostly within the next day, with a long tail (exponential)
+    burst   - everything due within BURST_SECONDS from now
+"""
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+import db
+
+DISTRIBUTIONS = ("uniform", "skewed", "burst")
+SPAN_DAYS = 30
+SKEW_MEAN_HOURS = 12
+BURST_SECONDS = 2.0
+URGENT_RATIO = 0.01
+TITLES = 1000  # distinct titles, so "latest per title" style queries have groups
+SUFFIXES = {"k": 1000, "m": 1000000}
+
+
+def parse_size(text):
+    """"10k" -> 10000, "1m" -> 1000000, "500" -> 500."""
+    text = text.strip().lower()
+    if text[-1:] in SUFFIXES:
+        return int(float(text[:-1]) * SUFFIXES[text[-1]])
+    return int(text)
+
+
+def due_times(n, distribution, now, seed=0):
+    """Yield `n` epoch due times for `distribution`."""
+    rng = random.Random(seed)
+    if distribution == "uniform":
+        half = SPAN_DAYS * 86400 / 2
+        for _ in range(n):
+            yield now + rng.uniform(-half, half)
+    elif distribution == "skewed":
+        mean = SKEW_MEAN_HOURS * 3600
+        for _ in range(n):
+            yield now + rng.expovariate(1 / mean)
+    elif distribution == "burst":
+        for _ in range(n):
+            yield now + rng.uniform(0, BURST_SECONDS)
+    else:
+        raise ValueError(f"unknown distribution: {distribution}")
+
+
+def rows(n, distribution, now=None, seed=0):
+    """Yield (title, message, time, urgent) tuples as accepted by db.add_notifications_bulk."""
+    now = time.time() if now is None else now
+    rng = random.Random(seed + 1)
+    for i, due in enumerate(due_times(n, distribution, now, seed)):
+        yield (f"Task {i % TITLES}", f"Synthetic reminder {i}",
+               datetime.fromtimestamp(due).strftime(db.TIME_FORMAT), rng.random() < URGENT_RATIO)
+
+
+def temp_db(directory=None):
+    """Point db.py at a fresh database file and create the schema. Returns its path."""
+    fd, path = tempfile.mkstemp(prefix="tend-bench-", suffix=".db", dir=directory)
+    os.close(fd)
+    os.unlink(path)
+    db.close_all()
+    db.DB_PATH = path
+    db.init_db()
+    return path
+
+
+def remove_db(path):
+    db.close_all()
+    for suffix in ("", "-wal", "-shm"):
+        try:
+            os.unlink(path + suffix)
+        except OSError:
+            pass
+
+
+def seed(n, distribution, now=None, seed=0, directory=None):
+    """Create a temporary database holding the workload. Returns (path, insert seconds)."""
+    path = temp_db(directory)
+    start = time.perf_counter()
+    db.add_notifications_bulk(rows(n, distribution, now, seed))
+    return path, time.perf_counter() - start
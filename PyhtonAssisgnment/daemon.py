@@ -0,0 +1,442 @@
+"""
+Headless TEND daemon.
+
+Runs the Dispatcher without Tk, pygame or pystray, delivers through the
+sinks named in the "daemon_sinks" setting (default: stdout) and serves a small
+JSON-lines API on a local socket, so other processes (and the GUI) can
+schedule reminders without opening SQLite themselves.
+
+Each request is one JSON object per line and gets one JSON reply:
+
+    {"op": "add", "title": "Stand-up", "message": "Room 4", "time": "2025-01-01 09:30:00"}
+    -> {"ok": true, "id": 42}
+
+An "add" with "repeat": "FREQ=DAILY" creates a recurring notification
+instead (see recurrence.py); "cancel" and "skip" take "rule": true / a time
+to cancel a rule or skip one of its occurrences. "tz": "Europe/Berlin" says
+which IANA zone "time" is in (default: the daemon's local zone); "channel"
+and "tags" are matched by the routing rules (see routing.py).
+
+"reschedule" (id, time), "snooze" (id, minutes; "rule": true for a recurring
+alert) and "shift" (seconds plus "ids", a full-text "query", a "channel"
+or a "tag") move pending
+notifications; "requeue" (ids) tells the Dispatcher about rows changed in
+SQLite directly.
+
+Ops: ping, add, bulk, cancel, reschedule, snooze, shift, requeue, skip, list,
+reload, subscribe. After "subscribe" the connection also receives
+{"event": "delivered", ...} and {"event": "batch"} lines whenever the daemon
+dispatches notifications.
+"""
+import asyncio
+import json
+import os
+import socket
+import threading
+import db
+import metrics
+import timezones
+from scheduler import Dispatcher
+from retention import RetentionService
+from delivery import DeliveryPipeline, build_sinks
+
+# "host:port" for TCP on localhost, or a filesystem path for a Unix socket
+DEFAULT_ADDRESS = os.environ.get("TEND_DAEMON", "127.0.0.1:47100")
+MAX_LINE = 16 * 1024 * 1024  # large enough for "bulk" payloads
+CONNECT_TIMEOUT = 0.5
+RECONNECT_DELAY = 3.0
+SUBSCRIBER_BUFFER_LIMIT = 1024 * 1024  # drop subscribers that stop reading
+
+
+def parse_address(address):
+    """Return a (host, port) tuple, or the path string for a Unix socket."""
+    if os.sep in address or address.endswith(".sock"):
+        return address
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def _open_socket(address, timeout):
+    addr = parse_address(address)
+    if isinstance(addr, str):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(addr)
+        return sock
+    return socket.create_connection(addr, timeout=timeout)
+
+
+# ---------- SERVER ----------
+class DaemonServer:
+    def __init__(self, address=DEFAULT_ADDRESS):
+        self.address = parse_address(address)
+        self.stop_event = threading.Event()
+        self.dispatcher = Dispatcher(self.stop_event, self._deliver, on_batch=self._on_batch)
+        self.retention = RetentionService(self.dispatcher)
+        self.pipeline = None
+        self.subscribers = set()
+        self.loop = None
+
+    # --- Dispatcher callbacks (run on the Dispatcher thread) ---
+    def _deliver(self, title, message, urgent, source=None):
+        self.pipeline.deliver(title, message, urgent, source)
+        source = source and {"id": source.get("id"), "recurring": source.get("recurring", False),
+                             "due_ts": source.get("due_ts")}
+        self._publish({"event": "delivered", "title": title, "message": message, "urgent": urgent,
+                       "source": source})
+
+    def _on_batch(self):
+        self._publish({"event": "batch"})
+
+    def _publish(self, event):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._broadcast, json.dumps(event).encode() + b"\n")
+
+    def _broadcast(self, line):
+        for writer in list(self.subscribers):
+            if writer.transport.get_write_buffer_size() > SUBSCRIBER_BUFFER_LIMIT:
+                print("[daemon] dropping slow subscriber")
+                self.subscribers.discard(writer)
+                writer.close()
+                continue
+            writer.write(line)
+
+    # --- Ops (run in the default executor; each worker thread has its own DB connection) ---
+    def op_ping(self, req):
+        return {"ok": True, "pid": os.getpid()}
+
+    def op_add(self, req):
+        tz = req.get("tz")
+        if tz and timezones.get_zone(tz) is None:
+            return {"ok": False, "error": f"unknown time zone: {tz}"}
+        parsed = db.normalize_time(req.get("time"), tz)
+        if parsed is None:
+            return {"ok": False, "error": "invalid time, expected YYYY-MM-DD HH:MM:SS"}
+        if req.get("repeat"):
+            rid = db.add_recurring(req.get("title") or "", req.get("message") or "", parsed[0], req["repeat"],
+                                   bool(req.get("urgent")), req.get("exclude") or (), tz=parsed[2],
+                                   channel=req.get("channel"), tags=req.get("tags"))
+            self.dispatcher.schedule_rule(rid)
+            return {"ok": True, "id": rid, "recurring": True}
+        nid = db.add_notification(req.get("title") or "", req.get("message") or "", parsed[0], bool(req.get("urgent")),
+                                  tz=parsed[2], channel=req.get("channel"), tags=req.get("tags"))
+        self.dispatcher.schedule(nid, parsed[1])
+        return {"ok": True, "id": nid}
+
+    def op_bulk(self, req):
+        inserted, skipped = db.add_notifications_bulk(req.get("items") or [])
+        self.dispatcher.reload()
+        return {"ok": True, "inserted": inserted, "skipped": skipped}
+
+    def op_cancel(self, req):
+        if req.get("rule"):
+            return {"ok": True, "cancelled": db.delete_recurring(int(req["id"]))}
+        cancelled = db.delete_notification(int(req["id"]))
+        self.dispatcher.requeue([int(req["id"])])
+        return {"ok": True, "cancelled": cancelled}
+
+    def op_reschedule(self, req):
+        nid = int(req["id"])
+        tz = db.get_conn().execute("SELECT tz FROM notifications WHERE id=?", (nid,)).fetchone()
+        parsed = db.normalize_time(req.get("time"), tz[0] if tz else None)
+        if parsed is None:
+            return {"ok": False, "error": "invalid time, expected YYYY-MM-DD HH:MM:SS"}
+        moved = db.reschedule_notifications([(nid, parsed[1])])
+        self.dispatcher.requeue(moved)
+        return {"ok": True, "rescheduled": bool(moved)}
+
+    def op_snooze(self, req):
+        nid = db.snooze_notification({"id": int(req["id"]), "recurring": bool(req.get("rule"))},
+                                     float(req.get("minutes", 10)) * 60)
+        if nid is not None:
+            self.dispatcher.requeue([nid])
+        return {"ok": True, "id": nid}
+
+    def op_shift(self, req):
+        ids = [int(x) for x in req["ids"]] if req.get("ids") is not None else None
+        if ids is None and not (req.get("query") or req.get("channel") or req.get("tag")):
+            return {"ok": False, "error": "shift needs ids, a query, a channel or a tag"}
+        moved = db.shift_notifications(int(req.get("seconds", 0)), ids=ids, query=req.get("query"),
+                                       channel=req.get("channel"), tag=req.get("tag"))
+        self.dispatcher.requeue(moved)
+        return {"ok": True, "moved": len(moved)}
+
+    def op_requeue(self, req):
+        self.dispatcher.requeue([int(x) for x in req.get("ids") or ()])
+        return {"ok": True}
+
+    def op_skip(self, req):
+        found = db.exclude_occurrence(int(req["id"]), req.get("time"))
+        if found:
+            self.dispatcher.schedule_rule(int(req["id"]))
+        return {"ok": True, "skipped": found}
+
+    def op_list(self, req):
+        return {"ok": True, "items": db.upcoming_events(int(req.get("limit", 50)))}
+
+    def op_reload(self, req):
+        self.dispatcher.reload()
+        return {"ok": True}
+
+    async def _handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    req = json.loads(line)
+                    op = req.get("op")
+                    if op == "subscribe":
+                        self.subscribers.add(writer)
+                        resp = {"ok": True}
+                    else:
+                        handler = getattr(self, f"op_{op}", None)
+                        if handler is None:
+                            resp = {"ok": False, "error": f"unknown op: {op}"}
+                        else:
+                            resp = await loop.run_in_executor(None, handler, req)
+                except Exception as e:
+                    resp = {"ok": False, "error": str(e)}
+                writer.write(json.dumps(resp).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self.subscribers.discard(writer)
+            writer.close()
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            server = await asyncio.start_unix_server(self._handle, path=self.address, limit=MAX_LINE)
+        else:
+            server = await asyncio.start_server(self._handle, *self.address, limit=MAX_LINE)
+        print(f"[daemon] listening on {self.address}", flush=True)
+        self.dispatcher.start()
+        self.retention.start()
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        db.init_db()
+        metrics.configure()
+        self.pipeline = DeliveryPipeline(build_sinks(db.get_setting("daemon_sinks", "stdout")))
+        try:
+            asyncio.run(self._serve())
+        except KeyboardInterrupt:
+            print("\n[daemon] stopped")
+        finally:
+            self.dispatcher.stop()
+            self.retention.stop()
+            self.pipeline.stop()
+            metrics.shutdown()
+            if isinstance(self.address, str) and os.path.exists(self.address):
+                os.unlink(self.address)
+            db.close_all()
+
+
+# ---------- CLIENT ----------
+class DaemonError(Exception):
+    pass
+
+
+class Client:
+    """Blocking JSON-lines client; one persistent connection guarded by a lock."""
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=10):
+        self.address = address
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = _open_socket(self.address, CONNECT_TIMEOUT)
+        self._sock.settimeout(self.timeout)
+        self._file = self._sock.makefile("rwb")
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        for obj in (self._file, self._sock):
+            try:
+                if obj:
+                    obj.close()
+            except OSError:
+                pass
+        self._sock = self._file = None
+
+    def request(self, op, **params):
+        payload = json.dumps(dict(params, op=op)).encode() + b"\n"
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._file.write(payload)
+                    self._file.flush()
+                    line = self._file.readline()
+                    if not line:
+                        raise ConnectionError("daemon closed the connection")
+                    break
+                except OSError:
+                    self._close()
+                    if attempt == 2:
+                        raise
+        resp = json.loads(line)
+        if not resp.get("ok"):
+            raise DaemonError(resp.get("error", "request failed"))
+        return resp
+
+    def add(self, title, message, time_str, urgent=False, repeat=None, tz=None, channel=None, tags=None):
+        params = {"repeat": repeat} if repeat else {}
+        if tz:
+            params["tz"] = tz
+        if channel:
+            params["channel"] = channel
+        if tags:
+            params["tags"] = tags
+        return self.request("add", title=title, message=message, time=time_str, urgent=urgent, **params)["id"]
+
+    def bulk(self, items):
+        resp = self.request("bulk", items=list(items))
+        return resp["inserted"], resp["skipped"]
+
+    def cancel(self, notification_id, rule=False):
+        return self.request("cancel", id=notification_id, rule=rule)["cancelled"]
+
+    def skip(self, rule_id, time_str):
+        return self.request("skip", id=rule_id, time=time_str)["skipped"]
+
+    def reschedule(self, notification_id, time_str):
+        return self.request("reschedule", id=notification_id, time=time_str)["rescheduled"]
+
+    def snooze(self, notification_id, minutes, rule=False):
+        return self.request("snooze", id=notification_id, minutes=minutes, rule=rule)["id"]
+
+    def shift(self, seconds, ids=None, query=None, channel=None, tag=None):
+        if ids is not None:
+            params = {"ids": list(ids)}
+        else:
+            params = {k: v for k, v in (("query", query), ("channel", channel), ("tag", tag)) if v}
+        return self.request("shift", seconds=seconds, **params)["moved"]
+
+    def list(self, limit=50):
+        return self.request("list", limit=limit)["items"]
+
+
+def is_running(address=DEFAULT_ADDRESS):
+    """True if a daemon answers a ping at `address`."""
+    client = Client(address, timeout=CONNECT_TIMEOUT)
+    try:
+        client.request("ping")
+        return True
+    except (OSError, ValueError, DaemonError):
+        return False
+    finally:
+        client.close()
+
+
+class DaemonSubscriber(threading.Thread):
+    """
+    Client-side stand-in for Dispatcher used when a daemon is already running:
+    delivery events from the daemon are forwarded to `deliver` / `on_batch`.
+    If the daemon goes away, an in-process Dispatcher (`local`) takes over
+    for the rest of the run, so reminders keep firing.
+    """
+
+    def __init__(self, stop_event, deliver, on_batch=None, address=DEFAULT_ADDRESS):
+        super().__init__(daemon=True)
+        self.stop_event = stop_event
+        self.deliver = deliver
+        self.on_batch = on_batch
+        self.address = address
+        self.client = Client(address)
+        self.local = None
+        self._sock = None
+
+    def schedule(self, nid, time_str, tz=None):
+        """The row is already in SQLite; ask the daemon to pick it up now."""
+        if self.local is not None:
+            self.local.schedule(nid, time_str, tz)
+        else:
+            self.reload()
+
+    def schedule_rule(self, rule_id):
+        if self.local is not None:
+            self.local.schedule_rule(rule_id)
+        else:
+            self.reload()
+
+    def requeue(self, nids):
+        if self.local is not None:
+            self.local.requeue(nids)
+            return
+        try:
+            self.client.request("requeue", ids=list(nids))
+        except (OSError, DaemonError) as e:
+            print("[daemon-client] requeue error:", e)
+
+    def reload(self):
+        if self.local is not None:
+            self.local.reload()
+            return
+        try:
+            self.client.request("reload")
+        except (OSError, DaemonError) as e:
+            print("[daemon-client] reload error:", e)
+
+    def stop(self):
+        self.stop_event.set()
+        if self.local is not None:
+            self.local.stop()
+        self.client.close()
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _listen(self):
+        self._sock = _open_socket(self.address, CONNECT_TIMEOUT)
+        self._sock.settimeout(None)
+        with self._sock, self._sock.makefile("rwb") as f:
+            f.write(b'{"op": "subscribe"}\n')
+            f.flush()
+            for line in f:
+                msg = json.loads(line)
+                event = msg.get("event")
+                if event == "delivered":
+                    try:
+                        self.deliver(msg["title"], msg["message"], msg["urgent"], msg.get("source"))
+                    except Exception as e:
+                        print("[daemon-client] deliver error:", e)
+                elif event == "batch" and self.on_batch:
+                    self.on_batch()
+
+    def _take_over(self):
+        # Claims are atomic, so a daemon that comes back later cannot deliver twice
+        print("[daemon-client] daemon not reachable; dispatching in this process")
+        local = Dispatcher(self.stop_event, self.deliver, on_batch=self.on_batch)
+        local.start()
+        self.local = local
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self._listen()
+            except (OSError, ValueError) as e:
+                if not self.stop_event.is_set():
+                    print("[daemon-client] connection lost:", e)
+            if self.stop_event.is_set():
+                break
+            if not is_running(self.address):
+                self._take_over()
+                return
+            self.stop_event.wait(RECONNECT_DELAY)
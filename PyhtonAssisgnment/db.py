@@ -1,23 +1,129 @@
 import sqlite3
+import re
+import heapq
+import time
 from datetime import datetime, timedelta
+from itertools import islice
 import os
+import threading
+import recurrence
+import metrics
+import timezones
 
 # Database file path (SQLite will auto-create)
 DB_PATH = os.path.join(os.path.dirname(__file__), "tend.db")
 
 
+# Connection tuning. WAL lets the Dispatcher, tray and Tk threads read while
+# another thread writes; NORMAL sync is durable across app crashes in WAL mode.
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 16384
+MMAP_SIZE = 256 * 1024 * 1024
+STATEMENT_CACHE_SIZE = 256
+
+# Rows per transaction for bulk inserts
+BULK_CHUNK_SIZE = 50000
+# Events per transaction for calendar imports
+CALENDAR_CHUNK_SIZE = 5000
+# Max bound parameters per IN (...) list (older SQLite builds cap at 999)
+SQL_PARAM_CHUNK = 500
+# How stale the in-memory settings may get before a read re-checks the DB
+SETTINGS_RECHECK_INTERVAL = 1.0
+# Delivery log records are buffered and written once this many are waiting
+# or the oldest has waited this long (checked whenever a record is added)
+DELIVERY_LOG_BATCH = 200
+DELIVERY_LOG_FLUSH_INTERVAL = 2.0
+
+_local = threading.local()
+_conns = set()
+_conns_lock = threading.Lock()
+
+
+metrics.describe("tend_db_query_seconds", "histogram", "Time spent in instrumented db.py functions.",
+                 metrics.LATENCY_BUCKETS)
+
+
 # ---------- DATABASE CONNECTION ----------
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=STATEMENT_CACHE_SIZE,
+                           check_same_thread=False)
+    if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+        # A new file: auto_vacuum only takes effect before the first page is
+        # written, and switching to WAL writes it. Older files are switched
+        # by compact() (one full VACUUM).
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
 def get_conn():
-    return sqlite3.connect(DB_PATH)
+    """
+    Return this thread's long-lived connection, opening it on first use.
+    Each thread gets its own connection, so callers must not close it;
+    use close_conn() when a worker thread exits.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == DB_PATH:
+        return conn
+    if conn is not None:
+        close_conn()
+    conn = _connect(DB_PATH)
+    _local.conn, _local.path = conn, DB_PATH
+    with _conns_lock:
+        _conns.add(conn)
+    return conn
 
 
-# ---------- INITIALIZE DATABASE ----------
-def init_db():
-    conn = get_conn()
-    cur = conn.cursor()
+def close_conn():
+    """Close the calling thread's connection, if any."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        return
+    _local.conn = None
+    with _conns_lock:
+        _conns.discard(conn)
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+
+def close_all():
+    """Flush the delivery log and close every pooled connection (used on application exit)."""
+    try:
+        flush_delivery_log()
+    except sqlite3.Error as e:
+        print("[delivery-log] flush error:", e)
+    with _conns_lock:
+        conns = list(_conns)
+        _conns.clear()
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+    _local.conn = None
+
+
+def data_version():
+    """
+    Return this connection's PRAGMA data_version; it changes whenever
+    another connection (or process) commits to the database.
+    """
+    return get_conn().execute("PRAGMA data_version").fetchone()[0]
 
+
+# ---------- SCHEMA MIGRATIONS ----------
+# Each migration upgrades the schema by one version; the current version is
+# stored in PRAGMA user_version so existing tend.db files upgrade in place.
+def _migrate_base_schema(conn):
     # Table for notifications (alerts/reminders)
-    cur.execute("""
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS notifications (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             title TEXT,
@@ -29,7 +135,7 @@ def init_db():
     """)
 
     # Table for global settings / preferences
-    cur.execute("""
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS settings (
             key TEXT PRIMARY KEY,
             value TEXT
@@ -37,7 +143,7 @@ def init_db():
     """)
 
     # Table for calendar events (future integration)
-    cur.execute("""
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS calendar_events (
             uid TEXT PRIMARY KEY,
             title TEXT,
@@ -47,110 +153,1630 @@ def init_db():
         )
     """)
 
-    conn.commit()
-    conn.close()
+
+def _migrate_due_epoch(conn):
+    # Integer epoch copy of `time` (local time) so range filters can use an index.
+    conn.execute("ALTER TABLE notifications ADD COLUMN due_ts INTEGER")
+    conn.execute("UPDATE notifications SET due_ts = CAST(strftime('%s', time, 'utc') AS INTEGER)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_due ON notifications(due_ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_pending_due ON notifications(due_ts) WHERE delivered=0")
+
+
+FTS_INSERT_TRIGGER = """
+    CREATE TRIGGER notifications_fts_ai AFTER INSERT ON notifications BEGIN
+        INSERT INTO notifications_fts(rowid, title, message) VALUES (new.id, new.title, new.message);
+    END
+"""
+
+FTS_CHUNK_SQL = "INSERT INTO notifications_fts(rowid, title, message) SELECT id, title, message FROM notifications WHERE id > ?"
+
+
+def _migrate_fulltext(conn):
+    # External-content FTS5 index over title/message, kept in sync by triggers
+    try:
+        conn.execute("""
+            CREATE VIRTUAL TABLE notifications_fts USING fts5(
+                title, message, content='notifications', content_rowid='id'
+            )
+        """)
+    except sqlite3.OperationalError as e:
+        print("[db] full-text search unavailable, falling back to LIKE:", e)
+        return
+    conn.execute(FTS_INSERT_TRIGGER)
+    conn.execute("""
+        CREATE TRIGGER notifications_fts_ad AFTER DELETE ON notifications BEGIN
+            INSERT INTO notifications_fts(notifications_fts, rowid, title, message)
+            VALUES ('delete', old.id, old.title, old.message);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER notifications_fts_au AFTER UPDATE OF title, message ON notifications BEGIN
+            INSERT INTO notifications_fts(notifications_fts, rowid, title, message)
+            VALUES ('delete', old.id, old.title, old.message);
+            INSERT INTO notifications_fts(rowid, title, message) VALUES (new.id, new.title, new.message);
+        END
+    """)
+    conn.execute("INSERT INTO notifications_fts(notifications_fts) VALUES ('rebuild')")
+
+
+_STATS_BUCKET = "date(new.due_ts, 'unixepoch', 'localtime'), CAST(strftime('%H', new.due_ts, 'unixepoch', 'localtime') AS INTEGER)"
+_STATS_OLD_BUCKET = _STATS_BUCKET.replace("new.", "old.")
+
+STATS_INSERT_TRIGGER = f"""
+    CREATE TRIGGER notifications_stats_ai AFTER INSERT ON notifications WHEN new.due_ts IS NOT NULL BEGIN
+        INSERT INTO notification_stats (day, hour, scheduled, delivered)
+        VALUES ({_STATS_BUCKET}, 1, new.delivered)
+        ON CONFLICT (day, hour) DO UPDATE SET scheduled = scheduled + 1, delivered = delivered + excluded.delivered;
+    END
+"""
+
+STATS_CHUNK_SQL = """
+    INSERT INTO notification_stats (day, hour, scheduled, delivered)
+    SELECT date(due_ts, 'unixepoch', 'localtime') AS d,
+           CAST(strftime('%H', due_ts, 'unixepoch', 'localtime') AS INTEGER) AS h,
+           COUNT(*), SUM(delivered)
+    FROM notifications WHERE id > ? AND due_ts IS NOT NULL GROUP BY d, h
+    ON CONFLICT (day, hour) DO UPDATE SET
+        scheduled = scheduled + excluded.scheduled, delivered = delivered + excluded.delivered
+"""
+
+
+def _migrate_stats(conn):
+    # Per local day/hour counters, maintained by triggers, so analytics never scan notifications
+    conn.execute("""
+        CREATE TABLE notification_stats (
+            day TEXT NOT NULL,
+            hour INTEGER NOT NULL,
+            scheduled INTEGER NOT NULL DEFAULT 0,
+            delivered INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, hour)
+        ) WITHOUT ROWID
+    """)
+    conn.execute(STATS_INSERT_TRIGGER)
+    conn.execute(f"""
+        CREATE TRIGGER notifications_stats_delivered AFTER UPDATE OF delivered ON notifications
+        WHEN new.due_ts IS NOT NULL AND new.delivered != old.delivered BEGIN
+            UPDATE notification_stats SET delivered = delivered + (new.delivered - old.delivered)
+            WHERE (day, hour) = ({_STATS_BUCKET});
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER notifications_stats_moved AFTER UPDATE OF due_ts ON notifications
+        WHEN new.due_ts IS NOT old.due_ts BEGIN
+            UPDATE notification_stats SET scheduled = scheduled - 1, delivered = delivered - old.delivered
+            WHERE old.due_ts IS NOT NULL AND (day, hour) = ({_STATS_OLD_BUCKET});
+            INSERT INTO notification_stats (day, hour, scheduled, delivered)
+            SELECT {_STATS_BUCKET}, 1, new.delivered WHERE new.due_ts IS NOT NULL
+            ON CONFLICT (day, hour) DO UPDATE SET scheduled = scheduled + 1, delivered = delivered + excluded.delivered;
+        END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER notifications_stats_ad AFTER DELETE ON notifications WHEN old.due_ts IS NOT NULL BEGIN
+            UPDATE notification_stats SET scheduled = scheduled - 1, delivered = delivered - old.delivered
+            WHERE (day, hour) = ({_STATS_OLD_BUCKET});
+        END
+    """)
+    conn.execute(STATS_CHUNK_SQL, (0,))
+
+
+def _migrate_recurring(conn):
+    # One row per recurrence rule; next_ts caches the next occurrence (NULL once the rule has ended)
+    conn.execute("""
+        CREATE TABLE recurring (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT,
+            message TEXT,
+            urgent INTEGER DEFAULT 0,
+            rule TEXT NOT NULL,
+            dtstart TEXT NOT NULL,
+            exdates TEXT NOT NULL DEFAULT '',
+            next_ts INTEGER
+        )
+    """)
+    conn.execute("CREATE INDEX idx_recurring_next ON recurring(next_ts) WHERE next_ts IS NOT NULL")
+
+
+def _migrate_calendar(conn):
+    # Rebuild calendar_events with an INTEGER PRIMARY KEY (VACUUM may renumber
+    # implicit rowids, which the R*Tree relies on) plus epoch bounds and the
+    # id of the reminder notification created for each event.
+    conn.execute("ALTER TABLE calendar_events RENAME TO calendar_events_old")
+    conn.execute("""
+        CREATE TABLE calendar_events (
+            id INTEGER PRIMARY KEY,
+            uid TEXT NOT NULL UNIQUE,
+            title TEXT,
+            description TEXT,
+            start TEXT,
+            end TEXT,
+            start_ts INTEGER,
+            end_ts INTEGER,
+            reminder_id INTEGER
+        )
+    """)
+    conn.execute("""
+        INSERT INTO calendar_events (uid, title, description, start, end, start_ts, end_ts)
+        SELECT uid, title, description, start, end, CAST(strftime('%s', start, 'utc') AS INTEGER),
+               CAST(strftime('%s', COALESCE(end, start), 'utc') AS INTEGER)
+        FROM calendar_events_old WHERE uid IS NOT NULL
+    """)
+    conn.execute("DROP TABLE calendar_events_old")
+    conn.execute("CREATE INDEX idx_calendar_start ON calendar_events(start_ts)")
+    # Interval index for overlap queries. The R*Tree stores 32-bit floats,
+    # rounded outwards, so queries re-check the exact bounds on the table.
+    try:
+        conn.execute("CREATE VIRTUAL TABLE calendar_events_rtree USING rtree(id, start_ts, end_ts)")
+    except sqlite3.OperationalError as e:
+        print("[db] R*Tree unavailable, calendar range queries use the start_ts index:", e)
+        return
+    conn.execute("""
+        CREATE TRIGGER calendar_rtree_ai AFTER INSERT ON calendar_events WHEN new.start_ts IS NOT NULL BEGIN
+            INSERT INTO calendar_events_rtree VALUES (new.id, new.start_ts, new.end_ts);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER calendar_rtree_au AFTER UPDATE OF start_ts, end_ts ON calendar_events
+        WHEN new.start_ts IS NOT old.start_ts OR new.end_ts IS NOT old.end_ts BEGIN
+            DELETE FROM calendar_events_rtree WHERE id = old.id;
+            INSERT INTO calendar_events_rtree SELECT new.id, new.start_ts, new.end_ts WHERE new.start_ts IS NOT NULL;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER calendar_rtree_ad AFTER DELETE ON calendar_events BEGIN
+            DELETE FROM calendar_events_rtree WHERE id = old.id;
+        END
+    """)
+    conn.execute("""
+        INSERT INTO calendar_events_rtree SELECT id, start_ts, end_ts FROM calendar_events WHERE start_ts IS NOT NULL
+    """)
+
+
+def _migrate_settings_version(conn):
+    # Bumped on every settings write by any connection, so a process can tell
+    # whether its in-memory settings are stale with a single-row read.
+    conn.execute("CREATE TABLE settings_version (id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL)")
+    conn.execute("INSERT INTO settings_version VALUES (0, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER settings_version_{event.lower()} AFTER {event} ON settings BEGIN
+                UPDATE settings_version SET version = version + 1;
+            END
+        """)
+
+
+def _migrate_delivery_log(conn):
+    # Append-only: one row per Dispatcher decision (sink IS NULL) and one per
+    # sink outcome. Rows may be deleted (retention) but never updated.
+    conn.execute("""
+        CREATE TABLE delivery_log (
+            id INTEGER PRIMARY KEY,
+            notification_id INTEGER,
+            rule_id INTEGER,
+            title TEXT,
+            due_ts INTEGER,
+            logged_ts REAL NOT NULL,
+            latency REAL,
+            sink TEXT,
+            outcome TEXT NOT NULL,
+            reason TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX idx_delivery_log_logged ON delivery_log(logged_ts)")
+    conn.execute("""
+        CREATE TRIGGER delivery_log_append_only BEFORE UPDATE ON delivery_log BEGIN
+            SELECT RAISE(ABORT, 'delivery_log is append-only');
+        END
+    """)
+
+
+def _migrate_timezone(conn):
+    # IANA zone the wall-clock `time` / `dtstart` was entered in; due_ts and
+    # next_ts stay the UTC epochs that are dispatched. Existing rows were
+    # entered in today's local zone. NULL means "whatever is local".
+    conn.execute("ALTER TABLE notifications ADD COLUMN tz TEXT")
+    conn.execute("ALTER TABLE recurring ADD COLUMN tz TEXT")
+    zone = timezones.local_zone_name()
+    conn.execute("UPDATE notifications SET tz=?", (zone,))
+    conn.execute("UPDATE recurring SET tz=?", (zone,))
+
+
+def _migrate_retention(conn):
+    # Per local day / sink / outcome totals of delivery_log rows removed by
+    # retention (see prune_delivery_log); sink and reason use '' for NULL
+    conn.execute("""
+        CREATE TABLE delivery_rollup (
+            day TEXT NOT NULL,
+            sink TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            reason TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            latency_sum REAL NOT NULL DEFAULT 0,
+            latency_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, sink, outcome, reason)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_delivered_due ON notifications(due_ts) WHERE delivered=1")
+
+
+def _migrate_routing(conn):
+    # A channel and comma-separated tags per notification and rule, and the
+    # routing rules (see routing.py). routing_version works like
+    # settings_version, so compiled rules are rebuilt only after a change.
+    for table in ("notifications", "recurring"):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN channel TEXT")
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN tags TEXT NOT NULL DEFAULT ''")
+    conn.execute("CREATE INDEX idx_notifications_pending_channel ON notifications(channel) "
+                 "WHERE delivered=0 AND channel IS NOT NULL")
+    # quiet_start / quiet_end are minutes after local midnight
+    conn.execute("""
+        CREATE TABLE routing_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            position INTEGER NOT NULL,
+            channel TEXT,
+            tag TEXT,
+            urgent INTEGER,
+            quiet_start INTEGER,
+            quiet_end INTEGER,
+            action TEXT NOT NULL,
+            digest_minutes INTEGER
+        )
+    """)
+    conn.execute("CREATE TABLE routing_version (id INTEGER PRIMARY KEY CHECK (id = 0), version INTEGER NOT NULL)")
+    conn.execute("INSERT INTO routing_version VALUES (0, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER routing_version_{event.lower()} AFTER {event} ON routing_rules BEGIN
+                UPDATE routing_version SET version = version + 1;
+            END
+        """)
+
+
+def _migrate_digest_holds(conn):
+    # Alerts held by a "digest" routing rule until the summary goes out, so a
+    # restart or crash neither loses nor forgets them. notification_id /
+    # rule_id as in delivery_log; shard is set for shards.ShardedDispatcher.
+    conn.execute("""
+        CREATE TABLE digest_holds (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            routing_rule_id INTEGER NOT NULL,
+            digest_ts INTEGER NOT NULL,
+            notification_id INTEGER,
+            rule_id INTEGER,
+            shard INTEGER,
+            title TEXT,
+            message TEXT,
+            due_ts INTEGER
+        )
+    """)
+
+
+# Insert triggers that add_notifications_bulk swaps for one statement per chunk:
+# (trigger name, CREATE TRIGGER sql, chunk sql taking the last id before the chunk)
+BULK_INSERT_TRIGGERS = [
+    ("notifications_fts_ai", FTS_INSERT_TRIGGER, FTS_CHUNK_SQL),
+    ("notifications_stats_ai", STATS_INSERT_TRIGGER, STATS_CHUNK_SQL),
+]
+
+
+MIGRATIONS = [
+    _migrate_base_schema,
+    _migrate_due_epoch,
+    _migrate_fulltext,
+    _migrate_stats,
+    _migrate_recurring,
+    _migrate_calendar,
+    _migrate_settings_version,
+    _migrate_delivery_log,
+    _migrate_timezone,
+    _migrate_retention,
+    _migrate_routing,
+    _migrate_digest_holds,
+]
+
+
+# ---------- INITIALIZE DATABASE ----------
+def init_db():
+    """Create the schema or upgrade an existing database to the latest version."""
+    conn = get_conn()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, migrate in enumerate(MIGRATIONS[version:], start=version + 1):
+        with conn:
+            conn.execute("BEGIN")
+            migrate(conn)
+            conn.execute(f"PRAGMA user_version={number}")
+    conn.execute("PRAGMA optimize")
+
+
+# ---------- TIME HELPERS ----------
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def time_to_epoch(time_str, tz=None):
+    """Convert a 'YYYY-MM-DD HH:MM:SS' wall-clock time in zone `tz` (default local) to epoch seconds, or None."""
+    parsed = timezones.parse(time_str, tz)
+    return parsed[1] if parsed else None
+
+
+def normalize_time(time_str, tz=None):
+    """
+    Parse an ISO-8601 style timestamp into the stored (text, epoch, zone)
+    form; see timezones.parse for the DST rules. Offset-aware inputs are
+    converted to zone `tz` (default local). Returns None if invalid.
+    """
+    return timezones.parse(time_str, tz)
 
 
 # ---------- SETTINGS (GENERIC) ----------
+def _read_settings_version(conn):
+    try:
+        return conn.execute("SELECT version FROM settings_version").fetchone()[0]
+    except sqlite3.OperationalError:
+        return None  # database not migrated yet; every check reloads
+
+
+def _as_stored(value):
+    # The settings column has TEXT affinity, so numbers come back as text
+    return value if value is None or isinstance(value, (str, bytes)) else str(value)
+
+
+class _SettingsCache:
+    """
+    In-memory copy of the settings table. Reads are dict lookups; writes go
+    to SQLite first and then update the copy (write-through). Writes from
+    other connections or processes bump settings_version, which check()
+    compares before reloading; reads call it at most every
+    SETTINGS_RECHECK_INTERVAL seconds, and the Dispatcher calls it whenever
+    the database changed under it.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._values = None
+        self._version = None
+        self._path = None
+        self._checked_at = 0.0
+        self._observers = []
+
+    def get(self, key, default=None):
+        if self._path != DB_PATH or time.monotonic() - self._checked_at >= SETTINGS_RECHECK_INTERVAL:
+            self.check()
+        return self._values.get(key, default)
+
+    def check(self):
+        """Reload if the table changed since it was loaded; subscribers hear about changed keys."""
+        conn = get_conn()
+        with self._lock:
+            self._checked_at = time.monotonic()
+            same_db = self._path == DB_PATH
+            version = _read_settings_version(conn)
+            if same_db and version is not None and version == self._version:
+                return
+            old = self._values if same_db else None
+            self._values = dict(conn.execute("SELECT key, value FROM settings"))
+            self._version, self._path = version, DB_PATH
+            new = self._values
+        if old is not None:
+            self._notify(old, new)
+
+    def set_many(self, items):
+        items = {key: _as_stored(value) for key, value in items}
+        conn = get_conn()
+        with self._lock:
+            if self._path != DB_PATH:
+                self.check()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                before = _read_settings_version(conn)
+                conn.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", items.items())
+                after = _read_settings_version(conn)
+            old = self._values
+            if before is None or before != self._version:
+                # Someone else wrote since our last load: take the whole table
+                self._values = dict(conn.execute("SELECT key, value FROM settings"))
+            else:
+                self._values = {**old, **items}
+            self._version = after
+            self._checked_at = time.monotonic()
+            new = self._values
+        self._notify(old, new)
+
+    def subscribe(self, callback, key=None):
+        with self._lock:
+            self._observers.append((key, callback))
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._observers = [o for o in self._observers if o[1] is not callback]
+
+    def _notify(self, old, new):
+        changed = [k for k in old.keys() | new.keys() if old.get(k) != new.get(k)]
+        if not changed:
+            return
+        for key, callback in list(self._observers):
+            for k in changed:
+                if key is None or key == k:
+                    try:
+                        callback(k, new.get(k))
+                    except Exception as e:
+                        print("[settings] observer error:", e)
+
+
+_settings = _SettingsCache()
+
+
 def get_setting(key, default=None):
     """Get stored setting by key, or default if not set."""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT value FROM settings WHERE key=?", (key,))
-    row = cur.fetchone()
-    conn.close()
-    return row[0] if row else default
+    return _settings.get(key, default)
 
 
 def set_setting(key, value):
     """Insert or update a setting key-value pair."""
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, value))
-    conn.commit()
-    conn.close()
+    _settings.set_many([(key, value)])
+
+
+def set_settings(items):
+    """Insert or update several settings in one transaction; `items` is a dict or (key, value) pairs."""
+    _settings.set_many(items.items() if isinstance(items, dict) else items)
+
+
+def subscribe_setting(callback, key=None):
+    """
+    Call `callback(key, value)` whenever `key` (any key if None) changes,
+    whether written by this process or another one. Callbacks run on the
+    thread that made or noticed the change; GUI code must hop to Tk itself.
+    """
+    _settings.subscribe(callback, key)
+
+
+def unsubscribe_setting(callback):
+    _settings.unsubscribe(callback)
+
+
+def check_settings():
+    """Pick up settings written by other processes now instead of on the next timed re-check."""
+    _settings.check()
+
+
+# ---------- CHANNELS & TAGS ----------
+def normalize_channel(channel):
+    """Stored form of a channel name: stripped and lower-case, None if empty."""
+    channel = (channel or "").strip().lower()
+    return channel or None
+
+
+def normalize_tags(tags):
+    """Stored form of tags ("a, B" or an iterable): lower-case, unique, sorted, comma-separated."""
+    if not tags:
+        return ""
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    return ",".join(sorted({t.strip().lower() for t in tags if t and t.strip()}))
 
 
 # ---------- NOTIFICATIONS ----------
-def add_notification(title, message, time_str, urgent=False):
-    """Add a new notification to DB."""
+@metrics.timed("tend_db_query_seconds", query="add_notification")
+def add_notification(title, message, time_str, urgent=False, tz=None, channel=None, tags=None):
+    """
+    Add a new notification to DB; `time_str` is wall-clock time in zone `tz`
+    (default local), stored in its normalized form like add_notifications_bulk
+    does. `channel` and `tags` are used by the routing rules.
+    """
+    parsed = normalize_time(time_str, tz)
+    # An unparseable time is kept as entered; the Dispatcher logs it as invalid_time
+    time_str, due_ts, tz = parsed if parsed else (time_str, None, tz)
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO notifications (title, message, time, urgent, delivered)
-        VALUES (?, ?, ?, ?, 0)
-    """, (title, message, time_str, int(urgent)))
-    conn.commit()
-    nid = cur.lastrowid
-    conn.close()
-    return nid
+    with conn:
+        cur = conn.execute("""
+            INSERT INTO notifications (title, message, time, due_ts, tz, urgent, channel, tags, delivered)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+        """, (title, message, time_str, due_ts, tz, int(urgent), normalize_channel(channel), normalize_tags(tags)))
+    return cur.lastrowid
 
 
+@metrics.timed("tend_db_query_seconds", query="get_pending_notifications")
 def get_pending_notifications():
     """Get all notifications not yet delivered."""
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT id, title, message, time, urgent FROM notifications WHERE delivered=0 ORDER BY time ASC")
+    cur.execute("SELECT id, title, message, time, urgent FROM notifications WHERE delivered=0 ORDER BY due_ts ASC")
     rows = cur.fetchall()
-    conn.close()
     return [
         {"id": r[0], "title": r[1], "message": r[2], "time": r[3], "urgent": bool(r[4])}
         for r in rows
     ]
 
 
+@metrics.timed("tend_db_query_seconds", query="add_notifications_bulk")
+def add_notifications_bulk(rows, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Insert many notifications with executemany, committing every `chunk_size`
+    rows. `rows` may yield (title, message, time, urgent) tuples or dicts with
+    those keys and optionally "tz" (default: the local zone), "channel" and
+    "tags". Rows with an unparseable time are skipped.
+    Returns (inserted, skipped).
+    """
+    conn = get_conn()
+    inserted = skipped = 0
+    batch = []
+
+    def flush():
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            _insert_notifications(conn, batch)
+
+    for row in rows:
+        tz = channel = None
+        tags = ""
+        if isinstance(row, dict):
+            title, message, time_str, urgent = row.get("title"), row.get("message"), row.get("time"), row.get("urgent")
+            tz = row.get("tz")
+            channel, tags = normalize_channel(row.get("channel")), normalize_tags(row.get("tags"))
+        else:
+            title, message, time_str, urgent = row
+        parsed = normalize_time(time_str, tz)
+        if parsed is None:
+            skipped += 1
+            continue
+        batch.append((title or "", message or "", parsed[0], parsed[1], parsed[2], int(bool(urgent)), channel, tags))
+        if len(batch) >= chunk_size:
+            flush()
+            inserted += len(batch)
+            batch = []
+    if batch:
+        flush()
+        inserted += len(batch)
+    return inserted, skipped
+
+
+def _insert_notifications(conn, rows):
+    """
+    executemany-insert (title, message, time, due_ts, tz, urgent, channel, tags)
+    rows inside the caller's write transaction. Returns the largest id before the insert;
+    the new rows are exactly those with a greater id.
+    """
+    present = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='trigger'")}
+    swapped = [t for t in BULK_INSERT_TRIGGERS if t[0] in present]
+    # Per-row insert triggers are several times slower than applying their
+    # effect to the whole chunk in one statement, so swap them out inside
+    # the same transaction.
+    for name, _, _ in swapped:
+        conn.execute(f"DROP TRIGGER {name}")
+    last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM notifications").fetchone()[0]
+    conn.executemany(
+        "INSERT INTO notifications (title, message, time, due_ts, tz, urgent, channel, tags, delivered) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)",
+        rows,
+    )
+    for _, create_sql, chunk_sql in swapped:
+        conn.execute(chunk_sql, (last_id,))
+        conn.execute(create_sql)
+    return last_id
+
+
+@metrics.timed("tend_db_query_seconds", query="get_pending_due_times")
+def get_pending_due_times(after_id=0):
+    """Return (id, due_ts) pairs for undelivered notifications with id > after_id."""
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT id, due_ts FROM notifications WHERE id>? AND delivered=0", (after_id,))
+    rows = cur.fetchall()
+    return rows
+
+
+def get_notification(notification_id):
+    """Get a single notification by id, or None if it does not exist."""
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT id, title, message, time, urgent, delivered FROM notifications WHERE id=?", (notification_id,))
+    r = cur.fetchone()
+    if not r:
+        return None
+    return {"id": r[0], "title": r[1], "message": r[2], "time": r[3], "urgent": bool(r[4]), "delivered": bool(r[5])}
+
+
 def mark_delivered(notification_id):
     """Mark notification as delivered."""
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("UPDATE notifications SET delivered=1 WHERE id=?", (notification_id,))
-    conn.commit()
-    conn.close()
+    with conn:
+        conn.execute("UPDATE notifications SET delivered=1 WHERE id=?", (notification_id,))
+
+
+def delete_notification(notification_id):
+    """Delete a notification. Returns True if a row was removed."""
+    conn = get_conn()
+    with conn:
+        cur = conn.execute("DELETE FROM notifications WHERE id=?", (notification_id,))
+    return cur.rowcount > 0
 
 
+def mark_delivered_many(notification_ids):
+    """Mark several notifications as delivered in one transaction."""
+    conn = get_conn()
+    with conn:
+        conn.executemany("UPDATE notifications SET delivered=1 WHERE id=?", [(nid,) for nid in notification_ids])
+
+
+@metrics.timed("tend_db_query_seconds", query="claim_due")
+def claim_due(notification_ids, now=None):
+    """
+    Atomically mark the given notifications as delivered and return the rows
+    that were still pending and due by `now`, so each one is dispatched at
+    most once and a row rescheduled after it was queued is not sent early.
+    """
+    ids = list(notification_ids)
+    now = int(time.time() if now is None else now)
+    claimed = []
+    conn = get_conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for i in range(0, len(ids), SQL_PARAM_CHUNK):
+            chunk = ids[i:i + SQL_PARAM_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT id, title, message, time, urgent, due_ts, channel, tags FROM notifications "
+                f"WHERE delivered=0 AND due_ts <= ? AND id IN ({marks})",
+                [now] + chunk,
+            ).fetchall()
+            conn.execute(f"UPDATE notifications SET delivered=1 WHERE delivered=0 AND due_ts <= ? AND id IN ({marks})",
+                         [now] + chunk)
+            claimed.extend(
+                {"id": r[0], "title": r[1], "message": r[2], "time": r[3], "urgent": bool(r[4]), "due_ts": r[5],
+                 "channel": r[6], "tags": r[7]}
+                for r in rows
+            )
+    return claimed
+
+
+# ---------- EDITING ----------
+# Every change is a primary-key update (plus the due_ts index entry); the
+# caller then passes the ids to Dispatcher.requeue().
+def get_due_times(notification_ids):
+    """{id: due_ts} for those of the given notifications that are still pending."""
+    ids = list(notification_ids)
+    due = {}
+    conn = get_conn()
+    for i in range(0, len(ids), SQL_PARAM_CHUNK):
+        chunk = ids[i:i + SQL_PARAM_CHUNK]
+        due.update(conn.execute(
+            f"SELECT id, due_ts FROM notifications WHERE delivered=0 AND id IN ({','.join('?' * len(chunk))})", chunk
+        ).fetchall())
+    return due
+
+
+@metrics.timed("tend_db_query_seconds", query="reschedule_notifications")
+def reschedule_notifications(changes):
+    """
+    Move pending notifications: `changes` is an iterable of (id, new epoch).
+    The stored wall-clock text is recomputed in each row's zone. Returns the
+    ids that were moved.
+    """
+    changes = dict(changes)
+    ids = list(changes)
+    moved = []
+    conn = get_conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for i in range(0, len(ids), SQL_PARAM_CHUNK):
+            chunk = ids[i:i + SQL_PARAM_CHUNK]
+            rows = conn.execute(
+                f"SELECT id, tz FROM notifications WHERE delivered=0 AND id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            updates = [(changes[nid], timezones.format_ts(changes[nid], zone_name=tz), nid) for nid, tz in rows]
+            conn.executemany("UPDATE notifications SET due_ts=?, time=? WHERE id=?", updates)
+            moved.extend(nid for nid, _ in rows)
+    return moved
+
+
+def _pending_matching(conn, query):
+    """(id, due_ts) of pending notifications matching a full-text query (LIKE without FTS5)."""
+    match = fts_query(query)
+    if not match:
+        return []
+    try:
+        return conn.execute(
+            "SELECT n.id, n.due_ts FROM notifications_fts JOIN notifications n ON n.id = notifications_fts.rowid "
+            "WHERE notifications_fts MATCH ? AND n.delivered=0 AND n.due_ts IS NOT NULL",
+            (match,),
+        ).fetchall()
+    except sqlite3.OperationalError:
+        like = f"%{query.strip()}%"
+        return conn.execute(
+            "SELECT id, due_ts FROM notifications WHERE delivered=0 AND due_ts IS NOT NULL "
+            "AND (title LIKE ? OR message LIKE ?)",
+            (like, like),
+        ).fetchall()
+
+
+def _pending_tagged(conn, channel=None, tag=None):
+    """(id, due_ts) of pending notifications in `channel` and/or carrying `tag`."""
+    where, params = ["delivered=0", "due_ts IS NOT NULL"], []
+    if channel:
+        where.append("channel=?")
+        params.append(normalize_channel(channel))
+    if tag:
+        where.append("(',' || tags || ',') LIKE ?")
+        params.append(f"%,{normalize_tags(tag)},%")
+    return conn.execute(f"SELECT id, due_ts FROM notifications WHERE {' AND '.join(where)}", params).fetchall()
+
+
+def shift_notifications(seconds, ids=None, query=None, channel=None, tag=None):
+    """
+    Shift pending notifications by `seconds` (negative = earlier): the given
+    `ids`, all that match the full-text `query`, or all in `channel` and/or
+    with `tag`. Returns the moved ids.
+    """
+    if ids is not None:
+        rows = get_due_times(ids).items()
+    elif query:
+        rows = _pending_matching(get_conn(), query)
+    elif channel or tag:
+        rows = _pending_tagged(get_conn(), channel, tag)
+    else:
+        raise ValueError("shift_notifications needs ids, a query, a channel or a tag")
+    return reschedule_notifications((nid, due + int(seconds)) for nid, due in rows if due is not None)
+
+
+def cancel_notifications(notification_ids):
+    """Delete pending notifications. Returns the number cancelled."""
+    ids = list(notification_ids)
+    cancelled = 0
+    conn = get_conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for i in range(0, len(ids), SQL_PARAM_CHUNK):
+            chunk = ids[i:i + SQL_PARAM_CHUNK]
+            cur = conn.execute(
+                f"DELETE FROM notifications WHERE delivered=0 AND id IN ({','.join('?' * len(chunk))})", chunk
+            )
+            cancelled += cur.rowcount
+    return cancelled
+
+
+@metrics.timed("tend_db_query_seconds", query="snooze_notification")
+def snooze_notification(source, seconds, now=None):
+    """
+    Deliver an alert again `seconds` from now. `source` is the alert's
+    source dict (id, recurring). A one-shot notification is re-armed in
+    place; a recurring occurrence gets a one-shot copy. Returns the id to
+    requeue, or None if the notification or rule no longer exists.
+    """
+    due = int(time.time() if now is None else now) + int(seconds)
+    conn = get_conn()
+    if source.get("recurring"):
+        r = conn.execute("SELECT title, message, urgent, tz, channel, tags FROM recurring WHERE id=?",
+                         (source["id"],)).fetchone()
+        if r is None:
+            return None
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO notifications (title, message, time, due_ts, tz, urgent, channel, tags, delivered) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                (r[0], r[1], timezones.format_ts(due, zone_name=r[3]), due, r[3], r[2], r[4], r[5]),
+            )
+        return cur.lastrowid
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        r = conn.execute("SELECT tz FROM notifications WHERE id=?", (source["id"],)).fetchone()
+        if r is None:
+            return None
+        # Two statements, so the stats triggers see "undelivered" and "moved" separately
+        conn.execute("UPDATE notifications SET delivered=0 WHERE id=?", (source["id"],))
+        conn.execute("UPDATE notifications SET due_ts=?, time=? WHERE id=?",
+                     (due, timezones.format_ts(due, zone_name=r[0]), source["id"]))
+    return source["id"]
+
+
+def move_occurrence(rule_id, ts, new_ts=None):
+    """
+    Skip the occurrence of a recurring rule at epoch `ts` and, if `new_ts` is
+    given, add a one-shot copy at that time instead. Returns the copy's id,
+    or None. Raises KeyError if the rule does not exist.
+    """
+    rule = get_recurring(rule_id)
+    if rule is None:
+        raise KeyError(rule_id)
+    exclude_occurrence(rule_id, timezones.format_ts(ts, zone_name=rule["tz"]))
+    if new_ts is None:
+        return None
+    return add_notification(rule["title"], rule["message"], timezones.format_ts(new_ts, zone_name=rule["tz"]),
+                            rule["urgent"], tz=rule["tz"], channel=rule["channel"], tags=rule["tags"])
+
+
+def _last_n_days(days):
+    today = datetime.now().date()
+    return [(today - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days - 1, -1, -1)]
+
+
+@metrics.timed("tend_db_query_seconds", query="notifications_count_last_n_days")
 def notifications_count_last_n_days(days=7):
-    """Return count of notifications created per day for last N days."""
+    """Return count of notifications scheduled per day for last N days."""
+    day_keys = _last_n_days(days)
+    data = dict.fromkeys(day_keys, 0)
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT day, SUM(scheduled) FROM notification_stats WHERE day BETWEEN ? AND ? GROUP BY day",
+        (day_keys[0], day_keys[-1])
+    )
+    for day, count in cur.fetchall():
+        data[day] = count
+    return data
+
+
+@metrics.timed("tend_db_query_seconds", query="notifications_hourly_last_n_days")
+def notifications_hourly_last_n_days(days=7):
+    """Return {day: [24 hourly counts]} of notifications scheduled over the last N days."""
+    day_keys = _last_n_days(days)
+    data = {day: [0] * 24 for day in day_keys}
     conn = get_conn()
     cur = conn.cursor()
-    data = {}
-    for i in range(days - 1, -1, -1):
-        date = (datetime.now() - timedelta(days=i)).strftime("%Y-%m-%d")
-        cur.execute("SELECT COUNT(*) FROM notifications WHERE date(time)=?", (date,))
-        data[date] = cur.fetchone()[0]
-    conn.close()
+    cur.execute(
+        "SELECT day, hour, scheduled FROM notification_stats WHERE day BETWEEN ? AND ?",
+        (day_keys[0], day_keys[-1])
+    )
+    for day, hour, count in cur.fetchall():
+        data[day][hour] = count
     return data
 
 
+def _display_time(due_ts, stored):
+    """Local display text for a row: its epoch in today's zone, or the stored text if it has none."""
+    return stored if due_ts is None else timezones.format_ts(due_ts)
+
+
+@metrics.timed("tend_db_query_seconds", query="upcoming_events")
 def upcoming_events(limit=50):
-    """List next N upcoming undelivered notifications."""
+    """List next N upcoming undelivered notifications, including occurrences of recurring ones."""
     conn = get_conn()
     cur = conn.cursor()
     cur.execute(
-        "SELECT title, time, urgent FROM notifications WHERE delivered=0 ORDER BY time ASC LIMIT ?",
+        "SELECT id, title, time, urgent, due_ts FROM notifications WHERE delivered=0 ORDER BY due_ts ASC LIMIT ?",
         (limit,),
     )
     rows = cur.fetchall()
-    conn.close()
-    return [{"title": r[0], "time": r[1], "urgent": bool(r[2])} for r in rows]
+    # NULL due_ts sorts first in SQLite; keep that order for the merge
+    one_shot = [(-1 if r[4] is None else r[4], {"id": r[0], "title": r[1], "time": _display_time(r[4], r[2]),
+                                                "urgent": bool(r[3])})
+                for r in rows]
+    merged = heapq.merge(one_shot, *_expand_recurring(), key=lambda e: e[0])
+    return [event for _, event in islice(merged, limit)]
 
 
+@metrics.timed("tend_db_query_seconds", query="get_notifications_between")
 def get_notifications_between(start_dt, end_dt):
-    """Get undelivered notifications within given datetime range."""
+    """Get undelivered notifications within given datetime range, expanding recurring ones."""
     conn = get_conn()
     cur = conn.cursor()
     cur.execute(
-        "SELECT id, title, message, time, urgent FROM notifications "
-        "WHERE delivered=0 AND datetime(time) BETWEEN ? AND ? ORDER BY time ASC",
-        (start_dt.strftime("%Y-%m-%d %H:%M:%S"), end_dt.strftime("%Y-%m-%d %H:%M:%S"))
+        "SELECT id, title, message, time, urgent, due_ts FROM notifications "
+        "WHERE delivered=0 AND due_ts BETWEEN ? AND ? ORDER BY due_ts ASC",
+        (timezones.to_epoch(start_dt), timezones.to_epoch(end_dt))
     )
     rows = cur.fetchall()
-    conn.close()
+    one_shot = [
+        (r[5], {"id": r[0], "title": r[1], "message": r[2], "time": _display_time(r[5], r[3]), "urgent": bool(r[4])})
+        for r in rows
+    ]
+    merged = heapq.merge(one_shot, *_expand_recurring(start_dt, end_dt), key=lambda e: e[0])
+    return [event for _, event in merged]
+
+
+# ---------- RECURRING NOTIFICATIONS ----------
+# Rules are stored once (see recurrence.py). Only `next_ts`, the next
+# occurrence, is indexed and dispatched; later occurrences are expanded on
+# the fly by the range queries above.
+RECURRING_COLUMNS = "id, title, message, urgent, rule, dtstart, exdates, next_ts, tz, channel, tags"
+
+# Fired occurrences have no notifications row, so they are counted here directly
+RECURRING_STATS_SQL = """
+    INSERT INTO notification_stats (day, hour, scheduled, delivered)
+    VALUES (date(:ts, 'unixepoch', 'localtime'), CAST(strftime('%H', :ts, 'unixepoch', 'localtime') AS INTEGER), 1, 1)
+    ON CONFLICT (day, hour) DO UPDATE SET scheduled = scheduled + 1, delivered = delivered + 1
+"""
+
+
+def _exdate_set(exdates):
+    return frozenset(datetime.fromisoformat(x) for x in exdates.split(",") if x)
+
+
+def _next_occurrence(rule, dtstart, exdates, start_ts, tz):
+    """
+    Epoch of the first occurrence at or after epoch `start_ts`, or None once
+    the rule has ended. Rules repeat in wall-clock time of their zone `tz`,
+    so "daily at 09:00" stays at 09:00 across DST changes.
+    """
+    start = timezones.wall_time(start_ts, tz)
+    dt = recurrence.parse_rule(rule, tz).next(datetime.fromisoformat(dtstart), start, _exdate_set(exdates))
+    return timezones.to_epoch(dt, tz) if dt else None
+
+
+def _recurring_row(r):
+    return {"id": r[0], "title": r[1], "message": r[2], "urgent": bool(r[3]), "rule": r[4], "dtstart": r[5],
+            "exdates": [x for x in r[6].split(",") if x], "next_ts": r[7], "tz": r[8], "channel": r[9],
+            "tags": r[10]}
+
+
+def add_recurring(title, message, dtstart, rule, urgent=False, exdates=(), tz=None, channel=None, tags=None):
+    """
+    Store a recurrence rule such as "FREQ=WEEKLY;BYDAY=MO,WE" starting at
+    `dtstart` (wall-clock time in zone `tz`, default local); occurrences in
+    `exdates` are skipped. Only occurrences from now on are scheduled.
+    Every occurrence carries `channel` and `tags`.
+    Raises ValueError for an invalid rule or time. Returns the rule id.
+    """
+    start = normalize_time(dtstart, tz)
+    if start is None:
+        raise ValueError("invalid start time, expected YYYY-MM-DD HH:MM:SS")
+    tz = start[2]
+    rule = str(recurrence.parse_rule(rule, tz))
+    excluded = set()
+    for x in exdates:
+        parsed = normalize_time(x, tz)
+        if parsed is None:
+            raise ValueError(f"invalid exclusion time: {x}")
+        excluded.add(parsed[0])
+    exdates = ",".join(sorted(excluded))
+    next_ts = _next_occurrence(rule, start[0], exdates, time.time(), tz)
+    conn = get_conn()
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO recurring (title, message, urgent, rule, dtstart, exdates, next_ts, tz, channel, tags) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (title, message, int(urgent), rule, start[0], exdates, next_ts, tz, normalize_channel(channel),
+             normalize_tags(tags)),
+        )
+    return cur.lastrowid
+
+
+def get_recurring(rule_id):
+    """Get a recurrence rule by id, or None if it does not exist."""
+    r = get_conn().execute(f"SELECT {RECURRING_COLUMNS} FROM recurring WHERE id=?", (rule_id,)).fetchone()
+    return _recurring_row(r) if r else None
+
+
+def list_recurring():
+    """All recurrence rules, those with the soonest next occurrence first (ended rules last)."""
+    rows = get_conn().execute(
+        f"SELECT {RECURRING_COLUMNS} FROM recurring ORDER BY next_ts IS NULL, next_ts"
+    ).fetchall()
+    return [_recurring_row(r) for r in rows]
+
+
+def delete_recurring(rule_id):
+    """Delete a recurrence rule and with it all future occurrences. Returns True if it existed."""
+    conn = get_conn()
+    with conn:
+        cur = conn.execute("DELETE FROM recurring WHERE id=?", (rule_id,))
+    return cur.rowcount > 0
+
+
+def exclude_occurrence(rule_id, time_str):
+    """
+    Skip a single occurrence of a rule (`time_str` is wall-clock time in the
+    rule's zone). Returns False if the rule does not exist.
+    """
+    if normalize_time(time_str) is None:
+        raise ValueError("invalid time, expected YYYY-MM-DD HH:MM:SS")
+    conn = get_conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        r = conn.execute("SELECT rule, dtstart, exdates, next_ts, tz FROM recurring WHERE id=?", (rule_id,)).fetchone()
+        if r is None:
+            return False
+        parsed = normalize_time(time_str, r[4])
+        exdates = ",".join(sorted({x for x in r[2].split(",") if x} | {parsed[0]}))
+        next_ts = r[3]
+        if next_ts is not None:
+            next_ts = _next_occurrence(r[0], r[1], exdates, next_ts, r[4])
+        conn.execute("UPDATE recurring SET exdates=?, next_ts=? WHERE id=?", (exdates, next_ts, rule_id))
+    return True
+
+
+def get_recurring_due_times(after_id=0):
+    """Return (id, next_ts) pairs for rules with occurrences left and id > after_id."""
+    return get_conn().execute(
+        "SELECT id, next_ts FROM recurring WHERE id>? AND next_ts IS NOT NULL", (after_id,)
+    ).fetchall()
+
+
+@metrics.timed("tend_db_query_seconds", query="claim_recurring_due")
+def claim_recurring_due(rule_ids, now=None):
+    """
+    Fire the due occurrence of each given rule and advance it to its next
+    occurrence after `now`, in one transaction. Occurrences missed while
+    the app was not running collapse into this one delivery.
+
+    Returns (claimed, upcoming): the fired occurrences as notification
+    dicts, and (next_ts, id) for every given rule that still has
+    occurrences left, so the caller can re-queue it.
+    """
+    now = int(time.time() if now is None else now)
+    ids = list(rule_ids)
+    claimed, upcoming, stats = [], [], []
+    conn = get_conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for i in range(0, len(ids), SQL_PARAM_CHUNK):
+            chunk = ids[i:i + SQL_PARAM_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT {RECURRING_COLUMNS} FROM recurring WHERE next_ts IS NOT NULL AND id IN ({marks})", chunk
+            ).fetchall()
+            updates = []
+            for rid, title, message, urgent, rule, dtstart, exdates, next_ts, tz, channel, tags in rows:
+                if next_ts <= now:
+                    claimed.append({"id": rid, "recurring": True, "title": title, "message": message,
+                                    "time": timezones.format_ts(next_ts), "urgent": bool(urgent),
+                                    "due_ts": next_ts, "channel": channel, "tags": tags})
+                    stats.append({"ts": next_ts})
+                    next_ts = _next_occurrence(rule, dtstart, exdates, now + 1, tz)
+                    updates.append((next_ts, rid))
+                if next_ts is not None:
+                    upcoming.append((next_ts, rid))
+            conn.executemany("UPDATE recurring SET next_ts=? WHERE id=?", updates)
+        conn.executemany(RECURRING_STATS_SQL, stats)
+    return claimed, upcoming
+
+
+def _expand_recurring(start=None, end=None):
+    """
+    One lazy, time-ordered iterator of (epoch, event) per active rule, for
+    occurrences from `start` (default: the rule's next occurrence) up to
+    and including `end` (default: unbounded).
+    """
+    conn = get_conn()
+    start_ts = None if start is None else timezones.to_epoch(start)
+    end_ts = None if end is None else timezones.to_epoch(end)
+    if end is None:
+        rows = conn.execute(f"SELECT {RECURRING_COLUMNS} FROM recurring WHERE next_ts IS NOT NULL").fetchall()
+    else:
+        rows = conn.execute(
+            f"SELECT {RECURRING_COLUMNS} FROM recurring WHERE next_ts IS NOT NULL AND next_ts <= ?",
+            (end_ts,),
+        ).fetchall()
+    return [_occurrence_events(r, start_ts, end_ts) for r in rows]
+
+
+def _occurrence_events(row, start_ts, end_ts):
+    rid, title, message, urgent, rule, dtstart, exdates, next_ts, tz = row[:9]
+    # Occurrences before next_ts have already fired
+    begin = timezones.wall_time(next_ts if start_ts is None else max(next_ts, start_ts), tz)
+    occurrences = recurrence.parse_rule(rule, tz).occurrences(datetime.fromisoformat(dtstart), begin,
+                                                              _exdate_set(exdates))
+    for dt in occurrences:
+        ts = timezones.to_epoch(dt, tz)
+        if end_ts is not None and ts > end_ts:
+            return
+        yield ts, {"id": f"r{rid}:{ts}", "rule_id": rid, "title": title, "message": message,
+                   "time": timezones.format_ts(ts), "urgent": bool(urgent)}
+
+
+# ---------- CALENDAR EVENTS ----------
+# Unchanged events are left alone, so re-importing the same export is cheap
+CALENDAR_UPSERT_SQL = """
+    INSERT INTO calendar_events (uid, title, description, start, end, start_ts, end_ts, reminder_id)
+    VALUES (:uid, :title, :description, :start, :end, :start_ts, :end_ts, :reminder_id)
+    ON CONFLICT (uid) DO UPDATE SET
+        title = excluded.title, description = excluded.description, start = excluded.start,
+        end = excluded.end, start_ts = excluded.start_ts, end_ts = excluded.end_ts,
+        reminder_id = COALESCE(excluded.reminder_id, reminder_id)
+    WHERE title IS NOT excluded.title OR description IS NOT excluded.description
+        OR start_ts IS NOT excluded.start_ts OR end_ts IS NOT excluded.end_ts OR excluded.reminder_id IS NOT NULL
+"""
+
+
+@metrics.timed("tend_db_query_seconds", query="upsert_calendar_events")
+def upsert_calendar_events(events, remind_minutes=None, chunk_size=CALENDAR_CHUNK_SIZE):
+    """
+    Insert or update calendar events (dicts as produced by ical.read_events)
+    by uid, one transaction per `chunk_size` events. Cancelled events are
+    deleted. If `remind_minutes` is set, each event gets a reminder
+    notification that many minutes before it starts; reminders whose event
+    moved are replaced, and none are created for times already past.
+    Returns (upserted, cancelled, reminders_created).
+    """
+    conn = get_conn()
+    totals = [0, 0, 0]
+    batch = {}
+
+    def flush():
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for i, n in enumerate(_write_calendar_chunk(conn, list(batch.values()), remind_minutes)):
+                totals[i] += n
+        batch.clear()
+
+    for event in events:
+        batch[event["uid"]] = event  # a uid repeated within a chunk: the last copy wins
+        if len(batch) >= chunk_size:
+            flush()
+    if batch:
+        flush()
+    return tuple(totals)
+
+
+def _write_calendar_chunk(conn, events, remind_minutes):
+    uids = [e["uid"] for e in events]
+    existing = {}
+    for i in range(0, len(uids), SQL_PARAM_CHUNK):
+        chunk = uids[i:i + SQL_PARAM_CHUNK]
+        marks = ",".join("?" * len(chunk))
+        for uid, start_ts, reminder_id, delivered in conn.execute(
+            "SELECT c.uid, c.start_ts, c.reminder_id, n.delivered FROM calendar_events c "
+            f"LEFT JOIN notifications n ON n.id = c.reminder_id WHERE c.uid IN ({marks})",
+            chunk,
+        ):
+            existing[uid] = (start_ts, reminder_id if delivered is not None else None, delivered == 0)
+
+    now = time.time()
+    zone = timezones.local_zone_name()
+    upserts, cancelled, stale_reminders, new_reminders = [], [], [], []
+    for e in events:
+        start_ts, reminder_id, pending = existing.get(e["uid"], (None, None, False))
+        if e.get("cancelled"):
+            if e["uid"] in existing:
+                cancelled.append((e["uid"],))
+                if pending:
+                    stale_reminders.append(reminder_id)
+            continue
+        e = dict(e, reminder_id=None)
+        upserts.append(e)
+        if remind_minutes is None:
+            continue
+        moved = start_ts != e["start_ts"]
+        if pending and moved:
+            stale_reminders.append(reminder_id)
+        elif reminder_id is not None and not moved:
+            continue  # reminder already scheduled (or delivered) for this start time
+        remind_ts = e["start_ts"] - remind_minutes * 60
+        if remind_ts > now:
+            remind_at = timezones.format_ts(remind_ts)
+            message = f"Starts at {e['start'][11:16]}" + (f" — {e['description']}" if e["description"] else "")
+            new_reminders.append((e, (e["title"], message[:500], remind_at, remind_ts, zone, 0, "calendar", "")))
+
+    if stale_reminders:
+        conn.executemany("DELETE FROM notifications WHERE id=? AND delivered=0", [(r,) for r in stale_reminders])
+    if cancelled:
+        conn.executemany("DELETE FROM calendar_events WHERE uid=?", cancelled)
+    if new_reminders:
+        # New reminders get new ids, which the Dispatcher picks up incrementally
+        last_id = _insert_notifications(conn, [row for _, row in new_reminders])
+        ids = conn.execute("SELECT id FROM notifications WHERE id > ? ORDER BY id", (last_id,))
+        for (e, _), (nid,) in zip(new_reminders, ids):
+            e["reminder_id"] = nid
+    conn.executemany(CALENDAR_UPSERT_SQL, upserts)
+    return len(upserts), len(cancelled), len(new_reminders)
+
+
+@metrics.timed("tend_db_query_seconds", query="calendar_events_between")
+def calendar_events_between(start_dt, end_dt):
+    """Calendar events overlapping [start_dt, end_dt], earliest first."""
+    params = {"start": timezones.to_epoch(start_dt), "end": timezones.to_epoch(end_dt)}
+    conn = get_conn()
+    try:
+        rows = conn.execute(
+            "SELECT c.id, c.uid, c.title, c.description, c.start, c.end FROM calendar_events_rtree r "
+            "JOIN calendar_events c ON c.id = r.id "
+            "WHERE r.start_ts <= :end AND r.end_ts >= :start AND c.start_ts <= :end AND c.end_ts >= :start "
+            "ORDER BY c.start_ts",
+            params,
+        ).fetchall()
+    except sqlite3.OperationalError:
+        # No R*Tree in this SQLite build
+        rows = conn.execute(
+            "SELECT id, uid, title, description, start, end FROM calendar_events "
+            "WHERE start_ts <= :end AND end_ts >= :start ORDER BY start_ts",
+            params,
+        ).fetchall()
     return [
-        {"id": r[0], "title": r[1], "message": r[2], "time": r[3], "urgent": bool(r[4])}
+        {"id": r[0], "uid": r[1], "title": r[2], "description": r[3], "start": r[4], "end": r[5]}
+        for r in rows
+    ]
+
+
+# ---------- DELIVERY LOG ----------
+DELIVERY_LOG_INSERT_SQL = """
+    INSERT INTO delivery_log (notification_id, rule_id, title, due_ts, logged_ts, latency, sink, outcome, reason)
+    VALUES (:notification_id, :rule_id, :title, :due_ts, :logged_ts, :latency, :sink, :outcome, :reason)
+"""
+_log_buffer = []
+_log_lock = threading.Lock()
+_log_oldest = 0.0
+
+
+def delivery_record(n, outcome, sink=None, reason=None, now=None):
+    """
+    Build a delivery_log record for a notification dict as returned by
+    claim_due / claim_recurring_due (id, due_ts, "recurring" flag, title).
+    """
+    now = time.time() if now is None else now
+    due = n.get("due_ts")
+    recurring = n.get("recurring", False)
+    return {
+        "notification_id": None if recurring else n.get("id"),
+        "rule_id": n.get("id") if recurring else None,
+        "title": n.get("title"),
+        "due_ts": due,
+        "logged_ts": now,
+        "latency": None if due is None else now - due,
+        "sink": sink,
+        "outcome": outcome,
+        "reason": reason,
+    }
+
+
+def log_deliveries(records):
+    """Queue delivery_log records; they are written in batches (see DELIVERY_LOG_BATCH)."""
+    global _log_oldest
+    with _log_lock:
+        if not _log_buffer:
+            _log_oldest = time.monotonic()
+        _log_buffer.extend(records)
+        due = (len(_log_buffer) >= DELIVERY_LOG_BATCH
+               or time.monotonic() - _log_oldest >= DELIVERY_LOG_FLUSH_INTERVAL)
+    if due:
+        flush_delivery_log()
+
+
+@metrics.timed("tend_db_query_seconds", query="flush_delivery_log")
+def flush_delivery_log(max_age=None):
+    """
+    Write buffered records in one transaction. With `max_age`, only flush if
+    the oldest record has waited at least that long (for periodic callers).
+    If the write fails the records go back to the buffer and the error is raised.
+    """
+    global _log_buffer, _log_oldest
+    with _log_lock:
+        if not _log_buffer or (max_age is not None and time.monotonic() - _log_oldest < max_age):
+            return
+        records, _log_buffer = _log_buffer, []
+        oldest = _log_oldest
+    try:
+        conn = get_conn()
+        with conn:
+            conn.executemany(DELIVERY_LOG_INSERT_SQL, records)
+    except Exception:
+        with _log_lock:
+            _log_buffer[:0] = records
+            _log_oldest = oldest
+        raise
+
+
+def delivery_lateness(since=None):
+    """
+    Dispatch lateness (seconds between due time and the Dispatcher handing
+    the alert on) over records logged since the epoch `since`: a dict with
+    count, mean, p50, p95, p99 and max, or None if nothing was dispatched.
+    """
+    flush_delivery_log()
+    rows = get_conn().execute(
+        "SELECT latency FROM delivery_log WHERE sink IS NULL AND outcome='dispatched' "
+        "AND latency IS NOT NULL AND logged_ts >= ? ORDER BY latency",
+        (since or 0,),
+    ).fetchall()
+    if not rows:
+        return None
+    values = [r[0] for r in rows]
+    n = len(values)
+    stats = {"count": n, "mean": sum(values) / n, "max": values[-1]}
+    for name, q in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+        stats[name] = values[min(n - 1, int(q * n))]
+    return stats
+
+
+# ---------- RETENTION ----------
+# Delivered notifications past the retention period move to a separate
+# archive file, so tend.db only holds the working set. Both steps of a
+# batch are separate transactions (WAL does not make multi-file commits
+# atomic): the copy is committed first and is idempotent, so a crash in
+# between only means the batch is copied again.
+ARCHIVE_COLUMNS = "id, title, message, time, urgent, due_ts, tz"
+
+ARCHIVE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS archive.notifications (
+        id INTEGER PRIMARY KEY,
+        title TEXT,
+        message TEXT,
+        time TEXT,
+        urgent INTEGER,
+        due_ts INTEGER,
+        tz TEXT,
+        archived_ts INTEGER NOT NULL
+    )
+"""
+
+# Pre-counts the batch so notifications_stats_ad's decrement nets out:
+# analytics keep counting archived notifications
+STATS_KEEP_SQL = """
+    INSERT INTO notification_stats (day, hour, scheduled, delivered)
+    SELECT date(due_ts, 'unixepoch', 'localtime') AS d,
+           CAST(strftime('%H', due_ts, 'unixepoch', 'localtime') AS INTEGER) AS h,
+           COUNT(*), SUM(delivered)
+    FROM notifications WHERE id IN ({marks}) AND delivered=1 AND due_ts IS NOT NULL GROUP BY d, h
+    ON CONFLICT (day, hour) DO UPDATE SET
+        scheduled = scheduled + excluded.scheduled, delivered = delivered + excluded.delivered
+"""
+
+DELIVERY_ROLLUP_SQL = """
+    INSERT INTO delivery_rollup (day, sink, outcome, reason, count, latency_sum, latency_count)
+    SELECT date(logged_ts, 'unixepoch', 'localtime') AS d, COALESCE(sink, '') AS s, outcome,
+           COALESCE(reason, '') AS r, COUNT(*), COALESCE(SUM(latency), 0), COUNT(latency)
+    FROM delivery_log WHERE id <= :last AND logged_ts < :before GROUP BY d, s, outcome, r
+    ON CONFLICT (day, sink, outcome, reason) DO UPDATE SET
+        count = count + excluded.count, latency_sum = latency_sum + excluded.latency_sum,
+        latency_count = latency_count + excluded.latency_count
+"""
+
+
+def archive_path(base_path=None):
+    """The archive file for a database: tend.db -> tend.archive.db."""
+    root, ext = os.path.splitext(base_path or DB_PATH)
+    return f"{root}.archive{ext or '.db'}"
+
+
+@metrics.timed("tend_db_query_seconds", query="archive_delivered")
+def archive_delivered(before_ts, limit, path=None):
+    """
+    Move up to `limit` notifications delivered and due before `before_ts`
+    into the archive file (default: archive_path()). Returns the number moved.
+    """
+    conn = get_conn()
+    conn.execute("ATTACH DATABASE ? AS archive", (path or archive_path(),))
+    try:
+        ids = [r[0] for r in conn.execute(
+            "SELECT id FROM main.notifications WHERE delivered=1 AND due_ts < ? ORDER BY due_ts LIMIT ?",
+            (before_ts, limit),
+        )]
+        if not ids:
+            return 0
+        now = int(time.time())
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(ARCHIVE_SCHEMA)
+            for i in range(0, len(ids), SQL_PARAM_CHUNK):
+                chunk = ids[i:i + SQL_PARAM_CHUNK]
+                conn.execute(
+                    f"INSERT OR IGNORE INTO archive.notifications ({ARCHIVE_COLUMNS}, archived_ts) "
+                    f"SELECT {ARCHIVE_COLUMNS}, ? FROM main.notifications "
+                    f"WHERE id IN ({','.join('?' * len(chunk))}) AND delivered=1",
+                    [now] + chunk,
+                )
+        moved = 0
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for i in range(0, len(ids), SQL_PARAM_CHUNK):
+                chunk = ids[i:i + SQL_PARAM_CHUNK]
+                marks = ",".join("?" * len(chunk))
+                conn.execute(STATS_KEEP_SQL.format(marks=marks), chunk)
+                # Only rows that made it into the archive (and are still delivered)
+                cur = conn.execute(
+                    f"DELETE FROM main.notifications WHERE id IN ({marks}) AND delivered=1 "
+                    f"AND id IN (SELECT id FROM archive.notifications WHERE id IN ({marks}))",
+                    chunk + chunk,
+                )
+                moved += cur.rowcount
+        return moved
+    finally:
+        conn.execute("DETACH DATABASE archive")
+
+
+@metrics.timed("tend_db_query_seconds", query="prune_delivery_log")
+def prune_delivery_log(before_ts, limit):
+    """
+    Roll up and delete up to `limit` delivery_log rows logged before
+    `before_ts` (oldest first). Returns the number deleted.
+    """
+    flush_delivery_log()
+    conn = get_conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        last = conn.execute(
+            "SELECT MAX(id) FROM (SELECT id FROM delivery_log WHERE logged_ts < ? ORDER BY id LIMIT ?)",
+            (before_ts, limit),
+        ).fetchone()[0]
+        if last is None:
+            return 0
+        params = {"last": last, "before": before_ts}
+        conn.execute(DELIVERY_ROLLUP_SQL, params)
+        cur = conn.execute("DELETE FROM delivery_log WHERE id <= :last AND logged_ts < :before", params)
+    return cur.rowcount
+
+
+@metrics.timed("tend_db_query_seconds", query="delivery_outcomes_last_n_days")
+def delivery_outcomes_last_n_days(days=7):
+    """{day: {outcome: count}} of Dispatcher decisions, from the rollup plus the live log."""
+    flush_delivery_log()
+    day_keys = _last_n_days(days)
+    data = {day: {} for day in day_keys}
+    conn = get_conn()
+    rows = conn.execute(
+        "SELECT day, outcome, SUM(count) FROM delivery_rollup WHERE sink='' AND day BETWEEN ? AND ? "
+        "GROUP BY day, outcome",
+        (day_keys[0], day_keys[-1]),
+    ).fetchall()
+    rows += conn.execute(
+        "SELECT date(logged_ts, 'unixepoch', 'localtime') AS d, outcome, COUNT(*) FROM delivery_log "
+        "WHERE sink IS NULL AND logged_ts >= ? GROUP BY d, outcome",
+        (timezones.to_epoch(datetime.fromisoformat(day_keys[0])),),
+    ).fetchall()
+    for day, outcome, count in rows:
+        if day in data:
+            data[day][outcome] = data[day].get(outcome, 0) + count
+    return data
+
+
+def compact(pages):
+    """
+    Return up to `pages` free pages to the file system. A database created
+    before auto_vacuum was enabled is converted first with one full VACUUM.
+    Returns the number of pages freed (all of them after a full VACUUM).
+    """
+    conn = get_conn()
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+        return free
+    if free:
+        # executescript steps the pragma to completion; execute() frees only one page
+        conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+    return free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+def optimize():
+    """PRAGMA optimize: refresh planner statistics where they are out of date (cheap when nothing is)."""
+    get_conn().execute("PRAGMA optimize")
+
+
+# ---------- SEARCH ----------
+_FTS_SYNTAX = re.compile(r'"|\*|\b(AND|OR|NOT|NEAR)\b')
+
+
+def fts_query(text):
+    """
+    Turn search-box text into an FTS5 query. Plain words become prefix terms
+    that must all match ("stand up" -> '"stand"* "up"*'); input that already
+    uses FTS5 syntax (quotes, *, AND/OR/NOT/NEAR) is passed through as-is.
+    """
+    text = text.strip()
+    if _FTS_SYNTAX.search(text):
+        return text
+    return " ".join(f'"{term}"*' for term in re.findall(r"\w+", text))
+
+
+@metrics.timed("tend_db_query_seconds", query="search_notifications")
+def search_notifications(query, limit=50, offset=0):
+    """Full-text search over pending and delivered (not yet archived) notifications, best matches first."""
+    match = fts_query(query)
+    if not match:
+        return []
+    conn = get_conn()
+    try:
+        rows = conn.execute(
+            "SELECT n.id, n.title, n.message, n.time, n.urgent, n.delivered, n.due_ts "
+            "FROM notifications_fts JOIN notifications n ON n.id = notifications_fts.rowid "
+            "WHERE notifications_fts MATCH ? ORDER BY notifications_fts.rank LIMIT ? OFFSET ?",
+            (match, limit, offset),
+        ).fetchall()
+    except sqlite3.OperationalError:
+        # No FTS5 in this SQLite build, or the query is not valid FTS5 syntax
+        like = f"%{query.strip()}%"
+        rows = conn.execute(
+            "SELECT id, title, message, time, urgent, delivered, due_ts FROM notifications "
+            "WHERE title LIKE ? OR message LIKE ? ORDER BY due_ts DESC LIMIT ? OFFSET ?",
+            (like, like, limit, offset),
+        ).fetchall()
+    return [
+        {"id": r[0], "title": r[1], "message": r[2], "time": _display_time(r[6], r[3]), "urgent": bool(r[4]),
+         "delivered": bool(r[5])}
         for r in rows
     ]
 
 
+# ---------- ROUTING RULES ----------
+ROUTING_COLUMNS = "id, channel, tag, urgent, quiet_start, quiet_end, action, digest_minutes"
+
+
+def routing_version():
+    """Bumped by every write to routing_rules (from any connection)."""
+    try:
+        return get_conn().execute("SELECT version FROM routing_version").fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+
+def get_routing_rules():
+    """All routing rules in evaluation order, as tuples of ROUTING_COLUMNS."""
+    return get_conn().execute(f"SELECT {ROUTING_COLUMNS} FROM routing_rules ORDER BY position, id").fetchall()
+
+
+def add_routing_rule(action, channel=None, tag=None, urgent=None, quiet_start=None, quiet_end=None,
+                     digest_minutes=None, position=None):
+    """
+    Store a routing rule (see routing.py); `position` defaults to after the
+    last rule, and a rule at an occupied position goes before the rule
+    there. Returns the rule id.
+    """
+    conn = get_conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        if position is None:
+            position = conn.execute("SELECT COALESCE(MAX(position), 0) + 1 FROM routing_rules").fetchone()[0]
+        else:
+            conn.execute("UPDATE routing_rules SET position = position + 1 WHERE position >= ?", (position,))
+        cur = conn.execute(
+            "INSERT INTO routing_rules (position, channel, tag, urgent, quiet_start, quiet_end, action, digest_minutes) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (position, normalize_channel(channel), normalize_tags(tag) or None,
+             None if urgent is None else int(urgent), quiet_start, quiet_end, action, digest_minutes),
+        )
+    return cur.lastrowid
+
+
+def delete_routing_rule(rule_id):
+    """Delete a routing rule. Returns True if it existed."""
+    conn = get_conn()
+    with conn:
+        cur = conn.execute("DELETE FROM routing_rules WHERE id=?", (rule_id,))
+    return cur.rowcount > 0
+
+
+# ---------- DIGEST HOLDS ----------
+def hold_for_digest(alerts, now=None):
+    """
+    Persist alerts routed to a digest (with "digest_rule" and "digest_at",
+    see routing.Router.route) and log them as "held", in one transaction.
+    Sets each alert's "hold_id".
+    """
+    alerts = list(alerts)
+    records = [delivery_record(n, "held", reason=f"rule {n['digest_rule']}", now=now) for n in alerts]
+    conn = get_conn()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        for n in alerts:
+            recurring = n.get("recurring", False)
+            cur = conn.execute(
+                "INSERT INTO digest_holds (routing_rule_id, digest_ts, notification_id, rule_id, shard, title, "
+                "message, due_ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (n["digest_rule"], int(n["digest_at"]), None if recurring else n.get("id"),
+                 n.get("id") if recurring else None, n.get("shard"), n.get("title"), n.get("message"),
+                 n.get("due_ts")),
+            )
+            n["hold_id"] = cur.lastrowid
+        conn.executemany(DELIVERY_LOG_INSERT_SQL, records)
+
+
+def get_digest_holds(sharded=False):
+    """
+    Held alerts (of shards.ShardedDispatcher if `sharded`), oldest first, as
+    alert dicts with "hold_id", "digest_rule" and "digest_at".
+    """
+    rows = get_conn().execute(
+        "SELECT id, routing_rule_id, digest_ts, notification_id, rule_id, shard, title, message, due_ts "
+        f"FROM digest_holds WHERE shard IS {'NOT ' if sharded else ''}NULL ORDER BY id"
+    ).fetchall()
+    alerts = []
+    for hid, routing_rule, digest_ts, nid, rule_id, shard, title, message, due_ts in rows:
+        n = {"id": rule_id if rule_id is not None else nid, "title": title, "message": message,
+             "urgent": False, "due_ts": due_ts, "hold_id": hid, "digest_rule": routing_rule, "digest_at": digest_ts}
+        if rule_id is not None:
+            n["recurring"] = True
+        if shard is not None:
+            n["shard"] = shard
+        alerts.append(n)
+    return alerts
+
+
+def delete_digest_holds(hold_ids):
+    """Forget holds whose digest has been delivered."""
+    ids = list(hold_ids)
+    conn = get_conn()
+    with conn:
+        for i in range(0, len(ids), SQL_PARAM_CHUNK):
+            chunk = ids[i:i + SQL_PARAM_CHUNK]
+            conn.execute(f"DELETE FROM digest_holds WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+
+
 # ---------- MEETING MODE ----------
 def get_meeting_mode():
     """Return True if meeting mode is ON, else False."""
@@ -166,13 +1792,11 @@ def set_meeting_mode(val: bool):
 def save_weather_cache(city, temp, condition):
     """Save last known weather info for offline use."""
     try:
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", ("weather_cache_city", city or "Unknown"))
-        cur.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", ("weather_cache_temp", str(temp) if temp is not None else "N/A"))
-        cur.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", ("weather_cache_condition", condition or "Unknown"))
-        conn.commit()
-        conn.close()
+        set_settings({
+            "weather_cache_city": city or "Unknown",
+            "weather_cache_temp": str(temp) if temp is not None else "N/A",
+            "weather_cache_condition": condition or "Unknown",
+        })
     except Exception as e:
         print("[weather-cache] save error:", e)
 
@@ -180,15 +1804,10 @@ def save_weather_cache(city, temp, condition):
 def load_weather_cache():
     """Return cached weather info tuple (city, temp, condition)."""
     try:
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT key, value FROM settings WHERE key LIKE 'weather_cache_%'")
-        data = dict(cur.fetchall())
-        conn.close()
         return (
-            data.get("weather_cache_city", "Offline Mode"),
-            data.get("weather_cache_temp", "N/A"),
-            data.get("weather_cache_condition", "Unknown")
+            get_setting("weather_cache_city", "Offline Mode"),
+            get_setting("weather_cache_temp", "N/A"),
+            get_setting("weather_cache_condition", "Unknown")
         )
     except Exception as e:
         print("[weather-cache] load error:", e)
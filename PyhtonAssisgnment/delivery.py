@@ -0,0 +1,499 @@
+"""
+Delivery pipeline: the Dispatcher hands alerts to `DeliveryPipeline.deliver`,
+which fans them out to pluggable sinks. Every sink owns a bounded queue and a
+fixed number of worker threads, so a slow or hung sink only backs up its own
+queue and never the Dispatcher loop.
+
+When a sink's queue is full the sink's overflow policy applies:
+  "drop"     - discard the new alert (counted in stats["dropped"])
+  "collapse" - count it and later send one "N more notifications" summary
+Urgent alerts may overshoot the bound up to URGENT_HEADROOM times
+queue_size; past that they are collapsed into one urgent summary. A sink
+with a `rate` (alerts per second) collapses non-urgent alerts over that
+rate the same way.
+
+Every `send` runs on the sink's own call threads and is abandoned after
+the sink's `timeout` (counted as a failed attempt, then retried). A call
+that never returns keeps its thread; once all of a sink's call threads
+are stuck, the sink is stalled and its alerts fail immediately with
+"sink stalled" until one of the calls returns.
+
+Before fan-out, non-urgent alerts are coalesced: the first one opens a
+window of `coalesce_window` seconds (setting "coalesce_window") and
+everything due within it is sent as a single digest alert whose "items"
+hold the originals. Sinks that can present a digest (popup, desktop) show
+one; the others receive the items one by one. Urgent alerts skip the
+window and are always delivered individually.
+
+Each sink's outcome for an alert that came from the Dispatcher (sent,
+failed, dropped, collapsed) is recorded in the database's delivery log.
+"""
+import json
+import queue
+import sys
+import threading
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import Future, TimeoutError as CallTimeout
+from datetime import datetime
+import db
+import metrics
+
+DEFAULT_SINKS = "desktop,popup"
+COALESCE_WINDOW = 1.0  # seconds
+DESKTOP_RATE_LIMIT = 1.0  # desktop notifications per second
+DIGEST_PREVIEW = 5  # item titles listed in a digest's message
+URGENT_HEADROOM = 2  # urgent alerts may fill a queue up to this many times queue_size
+
+
+# ---------- SINKS ----------
+class Sink:
+    """
+    Base class; subclasses implement send(alert) and may raise on failure.
+    A send that takes longer than `timeout` seconds counts as failed.
+    Sinks with `digest = True` are handed digest alerts (see module docstring)
+    as they are; the others get each item separately.
+    """
+    name = "sink"
+    digest = False
+
+    def __init__(self, concurrency=1, timeout=5.0, retries=0, backoff=0.5, queue_size=100, overflow="collapse",
+                 rate=None):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.rate = rate
+
+    def send(self, alert):
+        raise NotImplementedError
+
+
+class StdoutSink(Sink):
+    name = "stdout"
+
+    def send(self, alert):
+        tag = "[URGENT] " if alert["urgent"] else ""
+        print(f"[{alert['delivered_at']}] {tag}{alert['title']}: {alert['message']}", flush=True)
+
+
+class LogFileSink(Sink):
+    name = "log"
+
+    def __init__(self, path, **kw):
+        kw.setdefault("queue_size", 10000)
+        kw.setdefault("overflow", "drop")
+        super().__init__(**kw)
+        self.path = path
+
+    def send(self, alert):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(alert) + "\n")
+
+
+class DesktopSink(Sink):
+    """
+    OS notification via plyer; some backends block, so it gets two workers
+    and a call timeout (which is also how long the toast stays up). Rate
+    limited so a burst cannot flood the desktop.
+    """
+    name = "desktop"
+    digest = True
+
+    def __init__(self, **kw):
+        kw.setdefault("concurrency", 2)
+        kw.setdefault("retries", 1)
+        kw.setdefault("timeout", 6)
+        kw.setdefault("rate", DESKTOP_RATE_LIMIT)
+        super().__init__(**kw)
+
+    def send(self, alert):
+        from plyer import notification
+        notification.notify(
+            title=("[URGENT] " + alert["title"]) if alert["urgent"] else alert["title"],
+            message=alert["message"],
+            app_name="TEND",
+            timeout=int(self.timeout)
+        )
+
+
+class PopupSink(Sink):
+    """
+    In-app popup. `show(title, message, urgent, source)` and `show_digest(items)`
+    must be safe to call from a worker thread (the GUI passes functions that
+    hop onto the Tk thread).
+    """
+    name = "popup"
+
+    def __init__(self, show, show_digest=None, **kw):
+        kw.setdefault("queue_size", 20)
+        super().__init__(**kw)
+        self.show = show
+        self.show_digest = show_digest
+        self.digest = show_digest is not None
+
+    def send(self, alert):
+        if "items" in alert:
+            self.show_digest(alert["items"])
+        else:
+            self.show(alert["title"], alert["message"], alert["urgent"], alert.get("source"))
+
+
+class WebhookSink(Sink):
+    """POSTs each alert as JSON to `url`."""
+    name = "webhook"
+
+    def __init__(self, url, **kw):
+        kw.setdefault("concurrency", 4)
+        kw.setdefault("retries", 3)
+        kw.setdefault("queue_size", 1000)
+        super().__init__(**kw)
+        self.url = url
+
+    def send(self, alert):
+        req = urllib.request.Request(
+            self.url, data=json.dumps(alert).encode(), headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            if resp.status >= 300:
+                raise OSError(f"webhook returned HTTP {resp.status}")
+
+
+# ---------- PIPELINE ----------
+class RateLimiter:
+    """Token bucket: `rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class _CallThreads:
+    """
+    Daemon threads that run sink.send calls. Unlike ThreadPoolExecutor's
+    threads they are not joined at interpreter exit, so a hung call cannot
+    keep the process alive.
+    """
+
+    def __init__(self, count, name):
+        self._calls = queue.SimpleQueue()
+        self.count = count
+        for i in range(count):
+            threading.Thread(target=self._run, name=f"{name}-{i}", daemon=True).start()
+
+    def submit(self, func, *args):
+        future = Future()
+        self._calls.put((future, func, args))
+        return future
+
+    def _run(self):
+        while True:
+            call = self._calls.get()
+            if call is None:
+                return
+            future, func, args = call
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def shutdown(self):
+        for _ in range(self.count):
+            self._calls.put(None)
+
+
+class _SinkRunner:
+    """Bounded queue plus worker threads for a single sink."""
+
+    def __init__(self, sink, stop_event):
+        self.sink = sink
+        self.stop_event = stop_event
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.collapsed = 0
+        self.collapsed_urgent = 0
+        self.limiter = RateLimiter(sink.rate) if sink.rate else None
+        self.stats = {"sent": 0, "failed": 0, "retried": 0, "dropped": 0, "collapsed": 0, "timed_out": 0}
+        # Calls to sink.send run here so a hung call can be abandoned; `stuck`
+        # counts abandoned calls that have not returned yet
+        self.calls = _CallThreads(sink.concurrency, f"sink-{sink.name}-call")
+        self.stuck = 0
+        self.workers = [
+            threading.Thread(target=self._work, name=f"sink-{sink.name}-{i}", daemon=True)
+            for i in range(sink.concurrency)
+        ]
+        for w in self.workers:
+            w.start()
+        metrics.gauge_function("tend_sink_queue_depth", self.queue.__len__, "Alerts waiting in a sink's queue.",
+                               sink=sink.name)
+
+    def put(self, alert):
+        if "items" in alert and not self.sink.digest:
+            for item in alert["items"]:
+                self.put(item)
+            return
+        with self.cond:
+            if not alert["urgent"] and self.limiter is not None and not self.limiter.take():
+                count = len(alert.get("items", ())) or 1
+                self.collapsed += count
+                self.stats["collapsed"] += count
+                self.cond.notify()
+                outcome, reason = "collapsed", "rate_limit"
+            elif alert["urgent"] and len(self.queue) >= self.sink.queue_size * URGENT_HEADROOM:
+                self.collapsed_urgent += 1
+                self.stats["collapsed"] += 1
+                self.cond.notify()
+                outcome, reason = "collapsed", "queue_full"
+            elif len(self.queue) >= self.sink.queue_size and not alert["urgent"]:
+                if self.sink.overflow == "collapse":
+                    self.collapsed += 1
+                    self.stats["collapsed"] += 1
+                    self.cond.notify()
+                    outcome, reason = "collapsed", "queue_full"
+                else:
+                    self.stats["dropped"] += 1
+                    outcome, reason = "dropped", "queue_full"
+            else:
+                self.queue.append(alert)
+                self.cond.notify()
+                return
+        _log_outcome(alert, self.sink.name, outcome, reason)
+
+    def _next(self):
+        with self.cond:
+            while True:
+                if self.collapsed_urgent:
+                    count, self.collapsed_urgent = self.collapsed_urgent, 0
+                    return _make_alert("TEND", f"{count} more urgent notifications were collapsed", True)
+                if self.queue:
+                    return self.queue.popleft()
+                # The summary itself waits for the rate limit
+                if self.collapsed and (self.limiter is None or self.limiter.take()):
+                    count, self.collapsed = self.collapsed, 0
+                    return _make_alert("TEND", f"{count} more notifications were collapsed", False)
+                if self.stop_event.is_set():
+                    return None
+                self.cond.wait(0.5)
+
+    def _work(self):
+        # Runs until stopped with an empty queue, so alerts flushed on stop still go out
+        try:
+            while True:
+                alert = self._next()
+                if alert is None:
+                    return
+                self._send(alert)
+        finally:
+            db.close_conn()  # opened by _log_outcome
+
+    def _send(self, alert):
+        for attempt in range(self.sink.retries + 1):
+            if self.stalled():
+                self._count("failed")
+                _log_outcome(alert, self.sink.name, "failed", "sink stalled")
+                break
+            try:
+                with metrics.timer("tend_sink_send_seconds", sink=self.sink.name):
+                    self._call(alert)
+                self._count("sent")
+                _log_outcome(alert, self.sink.name, "sent")
+                break
+            except Exception as e:
+                if attempt == self.sink.retries:
+                    self._count("failed")
+                    print(f"[delivery] {self.sink.name} failed:", e)
+                    _log_outcome(alert, self.sink.name, "failed", str(e))
+                else:
+                    self._count("retried")
+                    time.sleep(self.sink.backoff * (2 ** attempt))
+
+    def stalled(self):
+        """True while every call thread is stuck in a send that timed out."""
+        return self.stuck >= self.sink.concurrency
+
+    def _call(self, alert):
+        future = self.calls.submit(self.sink.send, alert)
+        try:
+            future.result(timeout=self.sink.timeout)
+        except CallTimeout:
+            if future.cancel():  # never started: a thread is free again
+                raise TimeoutError(f"{self.sink.name} send still queued after {self.sink.timeout:g}s")
+            with self.cond:
+                self.stuck += 1
+                self.stats["timed_out"] += 1
+                stalled = self.stalled()
+            if stalled:
+                print(f"[delivery] {self.sink.name} stalled: every call is stuck; failing its alerts until one returns")
+            future.add_done_callback(self._unstuck)
+            raise TimeoutError(f"{self.sink.name} send timed out after {self.sink.timeout:g}s") from None
+
+    def _unstuck(self, future):
+        with self.cond:
+            was_stalled = self.stalled()
+            self.stuck -= 1
+        if was_stalled:
+            print(f"[delivery] {self.sink.name} recovered")
+
+    def _count(self, key):
+        with self.cond:
+            self.stats[key] += 1
+
+
+def _make_alert(title, message, urgent, source=None):
+    alert = {
+        "title": title,
+        "message": message,
+        "urgent": bool(urgent),
+        "delivered_at": datetime.now().strftime(db.TIME_FORMAT),
+    }
+    if source is not None:
+        # Just what the delivery log needs (see db.delivery_record)
+        alert["source"] = {"id": source.get("id"), "recurring": source.get("recurring", False),
+                           "due_ts": source.get("due_ts"), "title": title}
+    return alert
+
+
+def _log_outcome(alert, sink, outcome, reason=None):
+    records = [db.delivery_record(a["source"], outcome, sink=sink, reason=reason)
+               for a in alert.get("items", (alert,)) if "source" in a]
+    if metrics.enabled():
+        metrics.inc("tend_sink_outcomes_total", len(alert.get("items", ())) or 1, sink=sink, outcome=outcome)
+        if outcome == "sent":
+            for r in records:
+                if r["latency"] is not None:
+                    metrics.observe("tend_delivery_latency_seconds", r["latency"], metrics.LATENESS_BUCKETS,
+                                    sink=sink)
+    if records:
+        try:
+            db.log_deliveries(records)
+        except Exception as e:
+            print("[delivery] log error:", e)
+
+
+def _make_digest(alerts):
+    titles = [a["title"] or "(untitled)" for a in alerts[:DIGEST_PREVIEW]]
+    if len(alerts) > DIGEST_PREVIEW:
+        titles.append(f"and {len(alerts) - DIGEST_PREVIEW} more")
+    digest = _make_alert(f"{len(alerts)} notifications", "\n".join(titles), False)
+    digest["items"] = alerts
+    return digest
+
+
+class DeliveryPipeline:
+    def __init__(self, sinks, coalesce_window=None):
+        """`coalesce_window` defaults to the "coalesce_window" setting; 0 disables coalescing."""
+        if coalesce_window is None:
+            try:
+                coalesce_window = float(db.get_setting("coalesce_window", str(COALESCE_WINDOW)))
+            except ValueError:
+                coalesce_window = COALESCE_WINDOW
+        self.coalesce_window = coalesce_window
+        self.stop_event = threading.Event()
+        self.runners = [_SinkRunner(sink, self.stop_event) for sink in sinks]
+        self._pending = []
+        self._timer = None
+        self._lock = threading.Lock()
+        metrics.gauge_function("tend_coalesce_pending", self._pending_count, "Alerts held in the coalescing window.")
+
+    def deliver(self, title, message, urgent=False, source=None):
+        """Non-blocking; matches the Dispatcher `deliver` callback signature."""
+        alert = _make_alert(title, message, urgent, source)
+        if urgent or self.coalesce_window <= 0:
+            self._fan_out(alert)
+            return
+        with self._lock:
+            self._pending.append(alert)
+            if self._timer is None:
+                self._timer = threading.Timer(self.coalesce_window, self._flush_window)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Send the alerts collected in the current window: one as is, several as a digest."""
+        with self._lock:
+            alerts, self._pending = self._pending, []
+            self._timer = None
+        if len(alerts) == 1:
+            self._fan_out(alerts[0])
+        elif alerts:
+            self._fan_out(_make_digest(alerts))
+
+    def _flush_window(self):
+        # Timer thread: one per window, so close the connection _log_outcome may have opened
+        try:
+            self.flush()
+        finally:
+            db.close_conn()
+
+    def _pending_count(self):
+        return len(self._pending)
+
+    def _fan_out(self, alert):
+        for runner in self.runners:
+            runner.put(alert)
+
+    def stats(self):
+        return {r.sink.name: dict(r.stats, queued=len(r.queue)) for r in self.runners}
+
+    def stop(self):
+        """Send what is left in the coalescing window (already claimed), then stop the sinks."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+        self.flush()
+        self.stop_event.set()
+        for r in self.runners:
+            with r.cond:
+                r.cond.notify_all()
+            r.calls.shutdown()
+
+
+def build_sinks(names=None, show_popup=None, show_digest=None):
+    """
+    Create sinks from a comma-separated list such as "desktop,popup,log".
+    Defaults to the "delivery_sinks" setting; "log" uses the "delivery_log_path"
+    setting, "webhook" uses "webhook_url" and "desktop" is limited to
+    "desktop_rate_limit" notifications per second.
+    """
+    if names is None:
+        names = db.get_setting("delivery_sinks", DEFAULT_SINKS)
+    sinks = []
+    for name in (n.strip() for n in names.split(",")):
+        if name == "stdout":
+            sinks.append(StdoutSink())
+        elif name == "desktop":
+            try:
+                rate = float(db.get_setting("desktop_rate_limit", str(DESKTOP_RATE_LIMIT)))
+            except ValueError:
+                print("[delivery] invalid desktop_rate_limit; using the default", file=sys.stderr)
+                rate = DESKTOP_RATE_LIMIT
+            sinks.append(DesktopSink(rate=rate or None))
+        elif name == "popup" and show_popup is not None:
+            sinks.append(PopupSink(show_popup, show_digest))
+        elif name == "log":
+            sinks.append(LogFileSink(db.get_setting("delivery_log_path", "tend_deliveries.log")))
+        elif name == "webhook":
+            url = db.get_setting("webhook_url", "")
+            if url:
+                sinks.append(WebhookSink(url))
+            else:
+                print("[delivery] webhook sink enabled but 'webhook_url' is not set", file=sys.stderr)
+        elif name:
+            print(f"[delivery] unknown or unavailable sink: {name}", file=sys.stderr)
+    return sinks
@@ -1,89 +1,95 @@
 import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 import tkinter as tk
-from tkinter import messagebox, filedialog
+from tkinter import messagebox, filedialog, simpledialog
 from datetime import datetime, timedelta
 import threading, time, os, sys
-from plyer import notification
-import pygame
-import pystray
-from PIL import Image, ImageDraw, ImageFont
-from matplotlib.figure import Figure
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+import contextlib
 import db
-import tzlocal
+from scheduler import Dispatcher
+from retention import RetentionService
+import daemon
+from delivery import DeliveryPipeline, build_sinks
+from widgets import VirtualTreeview, sync_listbox, sync_treeview
+import timezones
 import webbrowser
-import requests, geocoder  # For weather lookup
+import weather
+import ical
+import audio
+import metrics
 
-CHECK_INTERVAL = 1.5
 AUTO_REFRESH_INTERVAL = 60000  # 60 sec
-WEATHER_REFRESH_INTERVAL = 900000  # 15 min
+REFRESH_FRAME_MS = 16  # refresh requests within one frame are coalesced
+SEARCH_DEBOUNCE_MS = 200
+# Analytics ranges: label -> (days, heatmap?)
+ANALYTICS_VIEWS = {
+    "Last 7 days": (7, False),
+    "Last 30 days": (30, False),
+    "Last 365 days": (365, False),
+    "Hourly heatmap (7 days)": (7, True),
+    "Hourly heatmap (30 days)": (30, True),
+}
+SEARCH_PAGE_SIZE = 200
+# Snooze buttons on popups and the Next 24 Hours tab: label -> minutes
+SNOOZE_CHOICES = (("5 min", 5), ("10 min", 10), ("1 hour", 60))
+DIAGNOSTICS_REFRESH_MS = 2000
+# Repeat choices in the add form -> recurrence rule (see recurrence.py)
+REPEAT_RULES = {
+    "Once": None,
+    "Hourly": "FREQ=HOURLY",
+    "Daily": "FREQ=DAILY",
+    "Weekdays": "FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR",
+    "Weekly": "FREQ=WEEKLY",
+    "Monthly": "FREQ=MONTHLY",
+}
 
-pygame.mixer.init()
-is_playing = {"normal": False, "urgent": False}
 
 
 # ---------------- SOUND HELPERS ----------------
-def get_sound_path(urgent=False):
-    key = 'sound_urgent' if urgent else 'sound_normal'
-    path = db.get_setting(key, "")
-    if path and os.path.exists(path):
-        return path
-    default = os.path.join(os.path.dirname(__file__), "urgent.wav" if urgent else "notify.wav")
-    return default if os.path.exists(default) else None
-
-
-def play_sound(urgent=False, loop=False):
+def play_sound(urgent=False, loop=False, on_done=None):
     try:
-        path = get_sound_path(urgent)
-        if path and os.path.exists(path):
-            pygame.mixer.music.load(path)
-            pygame.mixer.music.play(-1 if loop or urgent else 0)
-            is_playing["urgent" if urgent else "normal"] = True
-        else:
-            root = tk._default_root
-            if root:
-                root.bell()
+        if audio.get_engine().play("urgent" if urgent else "normal", loop, on_done):
+            return
     except Exception as e:
         print("[sound] play error:", e)
+    root = tk._default_root
+    if root:
+        root.bell()
+    if on_done:
+        on_done()
 
 
-def stop_sound():
+def stop_sound(priority=None):
     try:
-        pygame.mixer.music.stop()
+        audio.get_engine().stop(priority)
     except Exception:
         pass
-    is_playing["normal"] = False
-    is_playing["urgent"] = False
 
 
 def toggle_test_sound(urgent, btn):
     tag = "urgent" if urgent else "normal"
-    if is_playing[tag]:
-        stop_sound()
-        btn.config(text=f"Test {tag.capitalize()} Sound", bootstyle=INFO)
+    engine = audio.get_engine()
+    if engine.is_busy(tag):
+        engine.stop(tag)
         return
-    path = get_sound_path(urgent)
-    if not path or not os.path.exists(path):
+    if audio.sound_path(tag) is None:
         messagebox.showerror("Error", f"No {tag.capitalize()} sound set. Use 'Set {tag.capitalize()} Sound'.")
         return
-    play_sound(urgent)
-    btn.config(text=f"Stop {tag.capitalize()} Sound", bootstyle=DANGER)
 
-    def monitor():
-        while pygame.mixer.music.get_busy():
-            time.sleep(0.1)
-        is_playing[tag] = False
+    def reset():
         btn.config(text=f"Test {tag.capitalize()} Sound", bootstyle=INFO)
 
-    threading.Thread(target=monitor, daemon=True).start()
+    # The end-event callback runs on the audio thread; hop back to Tk
+    play_sound(urgent, on_done=lambda: btn.after(0, reset))
+    btn.config(text=f"Stop {tag.capitalize()} Sound", bootstyle=DANGER)
 
 
 # ---------------- NOTIFICATIONS ----------------
-def popup_alert(title, message, urgent=False):
+def popup_alert(title, message, urgent=False, on_snooze=None, on_cancel=None):
+    """`on_snooze(minutes)` / `on_cancel()` add Snooze and "Stop Repeating" buttons."""
     win = tk.Toplevel()
     win.title("TEND Notification")
-    win.geometry("420x220")
+    win.geometry("520x240" if on_snooze else "420x220")
     win.attributes("-topmost", True)
     frame = ttk.Frame(win, padding=16)
     frame.pack(fill="both", expand=True)
@@ -100,28 +106,60 @@ def popup_alert(title, message, urgent=False):
         except Exception:
             pass
 
-    ttk.Button(frame, text="Stop Alert", bootstyle=(DANGER if urgent else INFO, OUTLINE), command=stop_all).pack(pady=6)
+    buttons = ttk.Frame(frame)
+    buttons.pack(pady=6)
+    ttk.Button(buttons, text="Stop Alert", bootstyle=(DANGER if urgent else INFO, OUTLINE), command=stop_all).pack(side="left", padx=3)
+    if on_snooze is not None:
+        for label, minutes in SNOOZE_CHOICES:
+            ttk.Button(buttons, text=label, bootstyle=(SECONDARY, OUTLINE),
+                       command=lambda m=minutes: (on_snooze(m), stop_all())).pack(side="left", padx=3)
+    if on_cancel is not None:
+        ttk.Button(buttons, text="Stop Repeating", bootstyle=(WARNING, OUTLINE),
+                   command=lambda: (on_cancel(), stop_all())).pack(side="left", padx=3)
     play_sound(urgent, loop=urgent)
     win.protocol("WM_DELETE_WINDOW", stop_all)
 
 
-def notify_desktop(title, message, urgent=False):
-    try:
-        notification.notify(
-            title=("[URGENT] " + title) if urgent else title,
-            message=message,
-            app_name="TEND",
-            timeout=6
-        )
-    except Exception:
-        print("[notify] fallback:", title, message)
-    threading.Thread(target=lambda: popup_alert(title, message, urgent), daemon=True).start()
+def digest_popup(items):
+    """One window (and one sound) for a burst of non-urgent alerts; see delivery.py."""
+    win = tk.Toplevel()
+    win.title("TEND Notifications")
+    win.geometry("480x360")
+    win.attributes("-topmost", True)
+    frame = ttk.Frame(win, padding=16)
+    frame.pack(fill="both", expand=True)
+
+    ttk.Label(frame, text=f"{len(items)} notifications", font=("Segoe UI", 14, "bold")).pack(pady=(2, 8))
+    body = ttk.Frame(frame)
+    body.pack(fill="both", expand=True)
+    scroll = ttk.Scrollbar(body, orient="vertical")
+    listbox = tk.Listbox(body, yscrollcommand=scroll.set, activestyle="none")
+    scroll.config(command=listbox.yview)
+    scroll.pack(side="right", fill="y")
+    listbox.pack(side="left", fill="both", expand=True)
+    for item in items:
+        line = item["title"] or "(untitled)"
+        if item["message"]:
+            line += f" - {item['message']}"
+        listbox.insert("end", line)
+
+    def dismiss():
+        stop_sound("normal")  # leave any urgent alert's sound running
+        try:
+            win.destroy()
+        except Exception:
+            pass
+
+    ttk.Button(frame, text="Dismiss", bootstyle=(INFO, OUTLINE), command=dismiss).pack(pady=(8, 0))
+    play_sound(False)
+    win.protocol("WM_DELETE_WINDOW", dismiss)
 
 
 # ---------------- TRAY ICON ----------------
 def generate_tray_icon(path="tray_icon.png"):
     if os.path.exists(path):
         return path
+    from PIL import Image, ImageDraw, ImageFont
     size = 128
     img = Image.new("RGBA", (size, size), (0, 0, 0, 0))
     draw = ImageDraw.Draw(img)
@@ -139,14 +177,17 @@ class TrayThread(threading.Thread):
 
     def run(self):
         try:
+            import pystray
+            from PIL import Image
             path = generate_tray_icon("tray_icon.png")
             image = Image.open(path)
             menu = pystray.Menu(
                 pystray.MenuItem("Show", self.on_show),
-                pystray.MenuItem("Toggle Meeting Mode", self.on_toggle),
+                pystray.MenuItem("Meeting Mode", self.on_toggle, checked=lambda item: db.get_meeting_mode()),
                 pystray.MenuItem("Exit", self.on_exit)
             )
             self.icon = pystray.Icon("TEND", image, "TEND", menu)
+            db.subscribe_setting(self.on_setting_changed, "meeting_mode")
             self.icon.run()
         except Exception as e:
             print("[tray] error:", e)
@@ -157,6 +198,11 @@ class TrayThread(threading.Thread):
     def on_toggle(self, icon, item):
         self.gui.root.after(0, self.gui.toggle_meeting_mode)
 
+    def on_setting_changed(self, key, value):
+        # Redraws the menu so the Meeting Mode check mark follows the setting
+        if self.icon:
+            self.icon.update_menu()
+
     def on_exit(self, icon, item):
         self.gui.root.after(0, self.gui.on_close)
 
@@ -168,67 +214,19 @@ class TrayThread(threading.Thread):
                 pass
 
 
-# ---------------- DISPATCHER ----------------
-class Dispatcher(threading.Thread):
-    def __init__(self, stop_event, gui_ref):
-        super().__init__(daemon=True)
-        self.stop_event = stop_event
-        self.gui_ref = gui_ref
-
-    def run(self):
-        while not self.stop_event.is_set():
-            try:
-                now = datetime.now()
-                pending = db.get_pending_notifications()
-                meeting = db.get_meeting_mode()
-                for n in pending:
-                    try:
-                        target = datetime.strptime(n['time'], "%Y-%m-%d %H:%M:%S")
-                    except Exception:
-                        db.mark_delivered(n['id'])
-                        continue
-                    if now >= target:
-                        if (not meeting) or n['urgent']:
-                            notify_desktop(n['title'], n['message'], urgent=n['urgent'])
-                        db.mark_delivered(n['id'])
-                        self.gui_ref.safe_refresh()
-            except Exception as e:
-                print("[Dispatcher] error:", e)
-            self.stop_event.wait(CHECK_INTERVAL)
-
-
-# ---------------- WEATHER ----------------
-def get_weather_data():
-    try:
-        g = geocoder.ip('me')
-        latlon = getattr(g, "latlng", None)
-        if not latlon:
-            raise ValueError("No coordinates")
-        lat, lon = latlon
-        city = g.city or "Your Location"
-        url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true"
-        r = requests.get(url, timeout=5)
-        if r.status_code == 200:
-            cw = r.json().get("current_weather", {})
-            temp = cw.get("temperature")
-            condition = "Clear" if cw.get("weathercode", 0) == 0 else "Cloudy"
-            db.save_weather_cache(city, temp, condition)
-            return city, temp, condition
-    except Exception:
-        return db.load_weather_cache()
-    return "Offline", "N/A", "Unknown"
-
-
 # ---------------- MAIN GUI ----------------
 class TendApp:
-    def __init__(self, root):
+    def __init__(self, root, profile=None):
         self.root = root
+        self.profile = profile
         self.style = ttk.Style("darkly")
         self.root.title("TEND — Temporal Event Notification Dispatcher")
         self.root.geometry("1100x720")
         self.root.minsize(760, 520)
         self.stop_event = threading.Event()
         self.is_fullscreen = False
+        self._refresh_lock = threading.Lock()
+        self._refresh_pending = False
 
         # Header
         header = ttk.Frame(self.root, padding=(12, 8))
@@ -245,18 +243,31 @@ class TendApp:
         right.pack(side='right', padx=10)
         self.time_label = ttk.Label(right, font=("Segoe UI", 11))
         self.weather_label = ttk.Label(right, font=("Segoe UI", 10), bootstyle=INFO)
+        self.meeting_label = ttk.Label(right, font=("Segoe UI", 10), bootstyle=WARNING)
         self.time_label.pack(anchor='e')
         self.weather_label.pack(anchor='e')
+        self.meeting_label.pack(anchor='e')
+        # Follows the setting whether it is toggled here, from the tray or by another process
+        self.show_meeting_mode()
+        db.subscribe_setting(lambda key, value: self.root.after(0, self.show_meeting_mode), "meeting_mode")
         self.update_time()
-        self.update_weather()
+        # Weather is fetched in the background; the label only reads the cache
+        self.weather = weather.get_service()
+        self.weather.subscribe(lambda *data: self.root.after(0, self.show_weather, *data))
+        self.show_weather(*self.weather.current())
+        self.weather.start()
 
         # --- Tabs ---
         notebook = ttk.Notebook(self.root)
         notebook.pack(fill='both', expand=True, padx=10, pady=6)
         dashboard_tab = ttk.Frame(notebook)
         upcoming_tab = ttk.Frame(notebook)
+        diagnostics_tab = ttk.Frame(notebook)
         notebook.add(dashboard_tab, text="Dashboard")
         notebook.add(upcoming_tab, text="Next 24 Hours")
+        notebook.add(diagnostics_tab, text="Diagnostics")
+        self.notebook = notebook
+        self.diagnostics_tab = diagnostics_tab
 
         # --- Controls ---
         ctrl = ttk.Frame(dashboard_tab, padding=10)
@@ -283,6 +294,18 @@ class TendApp:
         self.msg_entry.grid(row=0, column=1, padx=6, pady=6)
         self.time_entry.grid(row=0, column=2, padx=6, pady=6)
         ttk.Checkbutton(ctrl, text="Urgent (bypass DND)", variable=self.urgent_var).grid(row=0, column=3, padx=6)
+        self.repeat_var = tk.StringVar(value="Once")
+        ttk.Combobox(ctrl, textvariable=self.repeat_var, values=list(REPEAT_RULES), state="readonly",
+                     width=10).grid(row=0, column=4, padx=6)
+        # Channel and tags are matched by the routing rules (python -m tend rules)
+        self.channel_var = tk.StringVar()
+        self.tags_var = tk.StringVar()
+        routing_row = ttk.Frame(ctrl)
+        routing_row.grid(row=1, column=0, columnspan=5, sticky='w')
+        ttk.Label(routing_row, text="Channel").pack(side='left', padx=6)
+        ttk.Entry(routing_row, textvariable=self.channel_var, width=16).pack(side='left')
+        ttk.Label(routing_row, text="Tags (comma-separated)").pack(side='left', padx=(12, 6))
+        ttk.Entry(routing_row, textvariable=self.tags_var, width=30).pack(side='left')
 
         # --- Action buttons ---
         actions = ttk.Frame(dashboard_tab, padding=(12, 6))
@@ -299,6 +322,7 @@ class TendApp:
         ttk.Button(actions, text="Set Urgent Sound", bootstyle=DANGER, command=lambda: self.set_sound(True)).pack(side='left', padx=6)
         self.test_normal_btn.pack(side='left', padx=6)
         self.test_urgent_btn.pack(side='left', padx=6)
+        ttk.Button(actions, text="Import Calendar", bootstyle=SECONDARY, command=self.import_calendar).pack(side='left', padx=6)
         ttk.Button(actions, text="Toggle Fullscreen", bootstyle=LIGHT, command=self.toggle_fullscreen).pack(side='left', padx=6)
 
         # --- Dashboard ---
@@ -306,44 +330,95 @@ class TendApp:
         main.pack(fill='both', expand=True, padx=12, pady=8)
         main.columnconfigure(0, weight=1)
         main.columnconfigure(1, weight=1)
-        left = ttk.Labelframe(main, text="Analytics (last 7 days)")
+        left = ttk.Labelframe(main, text="Analytics")
         left.grid(row=0, column=0, sticky='nsew', padx=6, pady=6)
-        self.fig = Figure(figsize=(6, 3), dpi=100)
-        self.ax = self.fig.add_subplot(111)
-        self.canvas = FigureCanvasTkAgg(self.fig, master=left)
-        self.canvas.get_tk_widget().pack(fill='both', expand=True, padx=6, pady=6)
+        self.analytics_view = tk.StringVar(value="Last 7 days")
+        view_box = ttk.Combobox(left, textvariable=self.analytics_view, values=list(ANALYTICS_VIEWS),
+                                state="readonly", width=26)
+        view_box.pack(anchor='w', padx=6, pady=(6, 0))
+        view_box.bind("<<ComboboxSelected>>", lambda e: self.refresh_dashboard())
+        # matplotlib is imported in the background; see _load_deferred / _init_chart
+        self._chart_frame = left
+        self._chart_placeholder = ttk.Label(left, text="Loading chart...", anchor='center')
+        self._chart_placeholder.pack(fill='both', expand=True, padx=6, pady=6)
+        self.fig = self.ax = self.canvas = None
+        self._pending_stats = None
+        self._chart_kind = None  # ("bars", n) or ("heatmap", n) for the artists currently drawn
+        self._bars = None
+        self._heatmap = None
+        self._stats_loading = False
+        self._stats_dirty = False
 
         right = ttk.Labelframe(main, text="Upcoming Notifications")
         right.grid(row=0, column=1, sticky='nsew', padx=6, pady=6)
         self.up_list = tk.Listbox(right, font=("Consolas", 10))
         self.up_list.pack(fill='both', expand=True, padx=6, pady=6)
+        self._up_lines = []
 
         # --- Next 24h Tab ---
         search_frame = ttk.Frame(upcoming_tab, padding=6)
         search_frame.pack(fill='x')
-        ttk.Label(search_frame, text="Search:", font=("Segoe UI", 10)).pack(side="left", padx=4)
+        ttk.Label(search_frame, text="Search all:", font=("Segoe UI", 10)).pack(side="left", padx=4)
         self.search_var = tk.StringVar()
         self.search_entry = ttk.Entry(search_frame, textvariable=self.search_var, width=50)
         self.search_entry.pack(side="left", padx=4)
-        ttk.Button(search_frame, text="Search", bootstyle=INFO, command=self.refresh_next_24h).pack(side="left", padx=4)
-        ttk.Button(search_frame, text="Clear", bootstyle=SECONDARY, command=lambda: (self.search_var.set(""), self.refresh_next_24h())).pack(side="left")
-        self.tree = ttk.Treeview(upcoming_tab, columns=("time", "title", "urgent"), show="headings", height=15)
-        self.tree.heading("time", text="Time")
-        self.tree.heading("title", text="Title / Message")
-        self.tree.heading("urgent", text="Urgent")
-        self.tree.column("time", width=220)
-        self.tree.column("title", width=700)
-        self.tree.column("urgent", width=80, anchor="center")
-        self.tree.pack(fill='both', expand=True, padx=10, pady=10)
-        vsb = ttk.Scrollbar(upcoming_tab, orient="vertical", command=self.tree.yview)
-        vsb.pack(side="right", fill="y")
-        self.tree.configure(yscrollcommand=vsb.set)
+        self._search_job = None
+        self._search_limit = SEARCH_PAGE_SIZE
+        self.search_var.trace_add("write", lambda *_: self._schedule_search())
+        ttk.Button(search_frame, text="Search", bootstyle=INFO, command=self._run_search).pack(side="left", padx=4)
+        ttk.Button(search_frame, text="More Results", bootstyle=INFO, command=self._more_results).pack(side="left", padx=4)
+        ttk.Button(search_frame, text="Clear", bootstyle=SECONDARY, command=lambda: self.search_var.set("")).pack(side="left")
+        # Only the visible rows exist as Treeview items; see widgets.VirtualTreeview
+        self.tree = VirtualTreeview(
+            upcoming_tab,
+            columns=("time", "title", "urgent"),
+            headings={"time": "Time", "title": "Title / Message", "urgent": "Urgent"},
+            widths={"time": 220, "title": 700, "urgent": 80},
+            anchors={"urgent": "center"},
+        )
+        self.tree.pack(fill='both', expand=True, padx=10, pady=(10, 4))
+        edit_bar = ttk.Frame(upcoming_tab, padding=(10, 0, 10, 8))
+        edit_bar.pack(fill='x')
+        ttk.Label(edit_bar, text="Selected:", font=("Segoe UI", 10)).pack(side="left", padx=4)
+        for label, minutes in SNOOZE_CHOICES:
+            ttk.Button(edit_bar, text=f"+{label}", bootstyle=(SECONDARY, OUTLINE),
+                       command=lambda m=minutes: self.snooze_selected(m)).pack(side="left", padx=2)
+        ttk.Button(edit_bar, text="Reschedule...", bootstyle=INFO, command=self.reschedule_selected).pack(side="left", padx=4)
+        ttk.Button(edit_bar, text="Cancel", bootstyle=DANGER, command=self.cancel_selected).pack(side="left", padx=2)
+        ttk.Button(edit_bar, text="Shift All Matches...", bootstyle=(INFO, OUTLINE),
+                   command=self.shift_matches).pack(side="right", padx=4)
+
+        # --- Diagnostics Tab ---
+        diag_bar = ttk.Frame(diagnostics_tab, padding=6)
+        diag_bar.pack(fill='x')
+        self.metrics_label = ttk.Label(diag_bar, font=("Segoe UI", 10))
+        self.metrics_label.pack(side="left", padx=4)
+        self.metrics_btn = ttk.Button(diag_bar, bootstyle=INFO, command=self.toggle_metrics)
+        self.metrics_btn.pack(side="left", padx=4)
+        ttk.Button(diag_bar, text="Reset", bootstyle=SECONDARY, command=metrics.reset).pack(side="left")
+        self.metrics_tree = ttk.Treeview(diagnostics_tab, columns=("name", "labels", "value"), show="headings")
+        for col, text, width in (("name", "Metric", 300), ("labels", "Labels", 260), ("value", "Value", 420)):
+            self.metrics_tree.heading(col, text=text)
+            self.metrics_tree.column(col, width=width, anchor="w")
+        self.metrics_tree.pack(fill='both', expand=True, padx=10, pady=10)
+        metrics.configure()
+        self.refresh_diagnostics()
 
         # --- Threads ---
-        self.dispatcher = Dispatcher(self.stop_event, self)
+        self.delivery = DeliveryPipeline(build_sinks(show_popup=self.show_popup, show_digest=self.show_digest))
+        # If a headless daemon is already dispatching, act as its client instead
+        self.retention = None
+        if daemon.is_running():
+            self.dispatcher = daemon.DaemonSubscriber(self.stop_event, self.delivery.deliver, on_batch=self.safe_refresh)
+        else:
+            self.dispatcher = Dispatcher(self.stop_event, self.delivery.deliver, on_batch=self.safe_refresh)
+            # The daemon does its own maintenance; only the process that dispatches archives
+            self.retention = RetentionService(self.dispatcher)
+            self.retention.start()
         self.dispatcher.start()
         self.tray = TrayThread(self)
         self.tray.start()
+        threading.Thread(target=self._load_deferred, name="deferred-imports", daemon=True).start()
 
         # --- Initial Refresh ---
         self.refresh_dashboard()
@@ -388,24 +463,56 @@ class TendApp:
         self.root.bind("<Escape>", lambda e: self._exit_fullscreen_if_needed())
         self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
+    # --- Deferred startup ---
+    def _stage(self, name):
+        return self.profile.stage(name) if self.profile else contextlib.nullcontext()
+
+    def _load_deferred(self):
+        """Runs after the window is up: import matplotlib and start the audio engine off the Tk thread."""
+        try:
+            with self._stage("import matplotlib"):
+                import matplotlib.figure  # noqa: F401
+                import matplotlib.backends.backend_tkagg  # noqa: F401
+            self.root.after(0, self._init_chart)
+        except Exception as e:
+            print("[startup] matplotlib unavailable:", e)
+        try:
+            with self._stage("init audio"):
+                audio.get_engine().start()
+        except Exception as e:
+            print("[startup] audio unavailable:", e)
+
+    def _init_chart(self):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        with self._stage("create chart"):
+            self._chart_placeholder.destroy()
+            self.fig = Figure(figsize=(6, 3), dpi=100)
+            self.ax = self.fig.add_subplot(111)
+            self.canvas = FigureCanvasTkAgg(self.fig, master=self._chart_frame)
+            self.canvas.get_tk_widget().pack(fill='both', expand=True, padx=6, pady=6)
+            if self._pending_stats:
+                heatmap, data = self._pending_stats
+                self._pending_stats = None
+                if heatmap:
+                    self._draw_heatmap(data)
+                else:
+                    self._draw_bars(data)
+
     # --- Live clock ---
     def update_time(self):
-        try:
-            tz_name = tzlocal.get_localzone_name()
-        except Exception:
-            tz_name = "Local"
-        now = datetime.now().strftime("%Y-%m-%d  %H:%M:%S")
+        # Zone name is cached in timezones (re-checked once a minute), not looked up every tick
+        tz_name = timezones.local_zone_name() or "Local"
+        now = time.strftime("%Y-%m-%d  %H:%M:%S")
         self.time_label.config(text=f"{now}  ({tz_name})")
         self.root.after(1000, self.update_time)
 
     # --- Weather update ---
-    def update_weather(self):
-        try:
-            city, temp, cond = get_weather_data()
-            self.weather_label.config(text=f"{city}: {temp}°C, {cond}")
-        except Exception:
-            self.weather_label.config(text="Offline Weather")
-        self.root.after(WEATHER_REFRESH_INTERVAL, self.update_weather)
+    def show_weather(self, city, temp, cond):
+        self.weather_label.config(text=f"{city}: {temp}°C, {cond}")
+
+    def show_meeting_mode(self):
+        self.meeting_label.config(text="Meeting Mode: ON (non-urgent alerts muted)" if db.get_meeting_mode() else "")
 
     # --- Refreshers / Helpers ---
     def auto_refresh(self):
@@ -413,41 +520,177 @@ class TendApp:
         self.root.after(AUTO_REFRESH_INTERVAL, self.auto_refresh)
 
     def safe_refresh(self):
-        self.root.after(0, lambda: (self.refresh_dashboard(), self.refresh_upcoming(), self.refresh_next_24h()))
+        # Thread-safe; any number of calls before the next frame trigger one refresh.
+        with self._refresh_lock:
+            if self._refresh_pending:
+                return
+            self._refresh_pending = True
+        self.root.after(REFRESH_FRAME_MS, self._run_refresh)
+
+    @metrics.timed("tend_gui_refresh_seconds", view="all")
+    def _run_refresh(self):
+        with self._refresh_lock:
+            self._refresh_pending = False
+        self.refresh_dashboard()
+        self.refresh_upcoming()
+        self.refresh_next_24h()
 
     def refresh_dashboard(self):
-        data = db.notifications_count_last_n_days(7)
-        self.ax.clear()
-        self.ax.bar(list(data.keys()), list(data.values()), color="#4cc3f8")
-        self.ax.set_ylabel("Count")
-        self.ax.tick_params(axis='x', rotation=45)
-        self.fig.tight_layout()
-        self.canvas.draw()
+        # Aggregates are read on a worker thread; drawing happens back on the Tk thread
+        if self._stats_loading:
+            self._stats_dirty = True
+            return
+        self._stats_loading = True
+        days, heatmap = ANALYTICS_VIEWS.get(self.analytics_view.get(), (7, False))
+
+        def work():
+            try:
+                if heatmap:
+                    data = db.notifications_hourly_last_n_days(days)
+                else:
+                    data = db.notifications_count_last_n_days(days)
+            except Exception as e:
+                print("[analytics] query error:", e)
+                data = None
+            finally:
+                db.close_conn()
+            self.root.after(0, lambda: self._apply_stats(heatmap, data))
+
+        threading.Thread(target=work, daemon=True).start()
+
+    def _apply_stats(self, heatmap, data):
+        self._stats_loading = False
+        if data:
+            if self.canvas is None:
+                # Chart not created yet; _init_chart draws the latest data
+                self._pending_stats = (heatmap, data)
+            elif heatmap:
+                self._draw_heatmap(data)
+            else:
+                self._draw_bars(data)
+        if self._stats_dirty:
+            self._stats_dirty = False
+            self.refresh_dashboard()
+
+    def _draw_bars(self, data):
+        labels, values = list(data.keys()), list(data.values())
+        kind = ("bars", len(values))
+        if self._chart_kind != kind:
+            # Only a different range needs new artists; otherwise heights are updated in place
+            self.ax.clear()
+            self._heatmap = None
+            self._bars = self.ax.bar(range(len(values)), values, color="#4cc3f8")
+            self.ax.set_ylabel("Count")
+            self._chart_kind = kind
+            step = max(1, len(labels) // 10)
+            self.ax.set_xticks(range(0, len(labels), step))
+            self.ax.tick_params(axis='x', rotation=45)
+            self._set_bar_labels(labels, step)
+            self.fig.tight_layout()
+        else:
+            for bar, value in zip(self._bars, values):
+                bar.set_height(value)
+            if labels != self._bar_labels:
+                self._set_bar_labels(labels, max(1, len(labels) // 10))
+        self.ax.set_ylim(0, max(values + [1]) * 1.1)
+        self.canvas.draw_idle()
+
+    def _set_bar_labels(self, labels, step):
+        self._bar_labels = labels
+        self.ax.set_xticklabels(labels[::step])
+
+    def _draw_heatmap(self, data):
+        days = list(data.keys())
+        matrix = [data[d] for d in days]
+        kind = ("heatmap", len(days))
+        if self._chart_kind != kind:
+            self.ax.clear()
+            self._bars = None
+            self._heatmap = self.ax.imshow(matrix, aspect="auto", cmap="Blues", interpolation="nearest")
+            self.ax.set_xlabel("Hour")
+            self.ax.set_xticks(range(0, 24, 3))
+            step = max(1, len(days) // 10)
+            self.ax.set_yticks(range(0, len(days), step))
+            self._chart_kind = kind
+            self._set_heatmap_labels(days, step)
+            self.fig.tight_layout()
+        else:
+            self._heatmap.set_data(matrix)
+            if days != self._heatmap_days:
+                self._set_heatmap_labels(days, max(1, len(days) // 10))
+        self._heatmap.set_clim(0, max(max(row) for row in matrix) or 1)
+        self.canvas.draw_idle()
 
+    def _set_heatmap_labels(self, days, step):
+        self._heatmap_days = days
+        self.ax.set_yticklabels(days[::step])
+
+    @metrics.timed("tend_gui_refresh_seconds", view="upcoming")
     def refresh_upcoming(self):
-        self.up_list.delete(0, tk.END)
         events = db.upcoming_events(50)
         if not events:
-            self.up_list.insert(tk.END, "No upcoming notifications")
+            lines = ["No upcoming notifications"]
         else:
-            for e in events:
-                tag = "[URGENT] " if e['urgent'] else ""
-                self.up_list.insert(tk.END, f"{e['time']}  {tag}{e['title']}")
+            lines = [f"{e['time']}  {'[URGENT] ' if e['urgent'] else ''}{e['title']}" for e in events]
+        self._up_lines = sync_listbox(self.up_list, self._up_lines, lines)
 
+    @metrics.timed("tend_gui_refresh_seconds", view="next_24h")
     def refresh_next_24h(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
         now = datetime.now()
         next_24h = now + timedelta(hours=24)
-        events = db.get_notifications_between(now, next_24h)
-        q = (self.search_var.get() or "").lower().strip()
+        q = (self.search_var.get() or "").strip()
         if q:
-            events = [e for e in events if q in e['title'].lower() or q in e['message'].lower()]
-        if not events:
-            self.tree.insert("", "end", values=("—", "No matching notifications", "—"))
+            # Ranked full-text search across all notifications, not just the next 24h
+            events = db.search_notifications(q, limit=self._search_limit)
+        else:
+            events = db.get_notifications_between(now, next_24h)
+        rows = [
+            (e["id"], (e["time"], e["title"] + (" (delivered)" if e.get("delivered") else ""), "Yes" if e["urgent"] else "No"))
+            for e in events
+        ]
+        if not q:
+            # Calendar events overlapping the window (interval index lookup)
+            rows.extend((f"c{c['id']}", (c["start"], f"[Calendar] {c['title']}", "—"))
+                        for c in db.calendar_events_between(now, next_24h))
+            rows.sort(key=lambda row: row[1][0])
+        if not rows:
+            self.tree.set_rows([("empty", ("—", "No matching notifications", "—"))])
             return
-        for e in events:
-            self.tree.insert("", "end", values=(e["time"], e["title"], "Yes" if e["urgent"] else "No"))
+        self.tree.set_rows(rows)
+
+    def refresh_diagnostics(self):
+        # Only rebuilds the table while the Diagnostics tab is showing
+        self._show_metrics_state()
+        if self.notebook.select() == str(self.diagnostics_tab):
+            rows = metrics.snapshot()
+            sync_treeview(self.metrics_tree, [(f"{name}|{labels}", (name, labels, value))
+                                              for name, labels, value in rows])
+        self.root.after(DIAGNOSTICS_REFRESH_MS, self.refresh_diagnostics)
+
+    def _show_metrics_state(self):
+        on = metrics.enabled()
+        self.metrics_label.config(text="Instrumentation: ON" if on else
+                                  "Instrumentation: OFF (set 'metrics_address' or TEND_METRICS to enable at startup)")
+        self.metrics_btn.config(text="Disable" if on else "Enable")
+
+    def toggle_metrics(self):
+        metrics.enable(not metrics.enabled())
+        self._show_metrics_state()
+
+    # --- Search-as-you-type ---
+    def _schedule_search(self):
+        if self._search_job is not None:
+            self.root.after_cancel(self._search_job)
+        self._search_job = self.root.after(SEARCH_DEBOUNCE_MS, self._run_search)
+
+    def _run_search(self):
+        self._search_job = None
+        self._search_limit = SEARCH_PAGE_SIZE
+        self.refresh_next_24h()
+
+    def _more_results(self):
+        self._search_limit += SEARCH_PAGE_SIZE
+        self.refresh_next_24h()
 
     # --- Actions ---
     def add_notification(self):
@@ -471,13 +714,134 @@ class TendApp:
         if errors:
             messagebox.showerror("Missing or Invalid Fields", "Please fill correctly:\n- " + "\n- ".join(errors))
             return
-        db.add_notification(title, msg, dt.strftime("%Y-%m-%d %H:%M:%S"), bool(self.urgent_var.get()))
-        messagebox.showinfo("Scheduled", f"Notification set for {dt.strftime('%Y-%m-%d %H:%M:%S')}")
+        time_str = dt.strftime("%Y-%m-%d %H:%M:%S")
+        repeat = self.repeat_var.get()
+        rule = REPEAT_RULES.get(repeat)
+        if rule:
+            rid = db.add_recurring(title, msg, time_str, rule, bool(self.urgent_var.get()),
+                                   channel=self.channel_var.get(), tags=self.tags_var.get())
+            self.dispatcher.schedule_rule(rid)
+            messagebox.showinfo("Scheduled", f"Notification repeats {repeat.lower()} from {time_str}")
+        else:
+            nid = db.add_notification(title, msg, time_str, bool(self.urgent_var.get()),
+                                      channel=self.channel_var.get(), tags=self.tags_var.get())
+            self.dispatcher.schedule(nid, time_str)
+            messagebox.showinfo("Scheduled", f"Notification set for {dt.strftime('%Y-%m-%d %H:%M:%S')}")
         self.clear_fields()
         self.safe_refresh()
 
+    # --- Edit actions (Next 24 Hours tab) ---
+    def _selected(self):
+        """Selected rows as (notification ids, [(rule id, occurrence epoch)]); calendar rows are read-only."""
+        ids, occurrences = [], []
+        for key in self.tree.selection_keys():
+            if key.isdigit():
+                ids.append(int(key))
+            elif key.startswith("r") and ":" in key:
+                rid, ts = key[1:].split(":")
+                occurrences.append((int(rid), int(ts)))
+        return ids, occurrences
+
+    def _move_occurrences(self, occurrences, delta=None, new_ts=None):
+        """Skip each occurrence, re-adding it as a one-shot at +delta / new_ts. Returns the new ids."""
+        added = []
+        for rid, ts in occurrences:
+            target = new_ts if new_ts is not None else (ts + delta if delta is not None else None)
+            try:
+                nid = db.move_occurrence(rid, ts, target)
+            except KeyError:
+                continue
+            if nid is not None:
+                added.append(nid)
+            self.dispatcher.schedule_rule(rid)
+        return added
+
+    def snooze_selected(self, minutes):
+        ids, occurrences = self._selected()
+        moved = db.shift_notifications(minutes * 60, ids=ids) if ids else []
+        moved += self._move_occurrences(occurrences, delta=minutes * 60)
+        if moved:
+            self.dispatcher.requeue(moved)
+        self.safe_refresh()
+
+    def reschedule_selected(self):
+        ids, occurrences = self._selected()
+        if not ids and not occurrences:
+            messagebox.showinfo("Reschedule", "Select one or more notifications first.")
+            return
+        values = {str(key): row for key, row in self.tree.rows}
+        current = values.get(self.tree.selection_keys()[0], ("",))[0]
+        text = simpledialog.askstring("Reschedule", "New time (YYYY-MM-DD HH:MM:SS):", initialvalue=current,
+                                      parent=self.root)
+        if not text:
+            return
+        parsed = db.normalize_time(text)
+        if parsed is None:
+            messagebox.showerror("Reschedule", "Invalid time, expected YYYY-MM-DD HH:MM:SS")
+            return
+        moved = db.reschedule_notifications((nid, parsed[1]) for nid in ids) if ids else []
+        moved += self._move_occurrences(occurrences, new_ts=parsed[1])
+        self.dispatcher.requeue(moved)
+        self.safe_refresh()
+
+    def cancel_selected(self):
+        ids, occurrences = self._selected()
+        if not ids and not occurrences:
+            return
+        if not messagebox.askyesno("Cancel", f"Cancel {len(ids) + len(occurrences)} selected notification(s)?"):
+            return
+        if ids:
+            db.cancel_notifications(ids)
+            self.dispatcher.requeue(ids)
+        self._move_occurrences(occurrences)
+        self.safe_refresh()
+
+    def shift_matches(self):
+        q = (self.search_var.get() or "").strip()
+        if not q:
+            messagebox.showinfo("Shift", "Search first: every pending notification matching the search is shifted.")
+            return
+        text = simpledialog.askstring("Shift", f'Shift all pending matches of "{q}" by minutes (e.g. 60 or -15):',
+                                      parent=self.root)
+        if not text:
+            return
+        try:
+            seconds = round(float(text) * 60)
+        except ValueError:
+            messagebox.showerror("Shift", "Enter a number of minutes")
+            return
+        moved = db.shift_notifications(seconds, query=q)
+        self.dispatcher.requeue(moved)
+        self.safe_refresh()
+        messagebox.showinfo("Shift", f"Shifted {len(moved)} notification(s)")
+
+    def import_calendar(self):
+        path = filedialog.askopenfilename(title="Import Calendar",
+                                          filetypes=[("iCalendar", "*.ics"), ("All Files", "*.*")])
+        if not path:
+            return
+        remind = int(db.get_setting("calendar_reminder_minutes", "10"))
+
+        def work():
+            try:
+                with open(path, encoding="utf-8", errors="replace") as fh:
+                    upserted, _, reminders = db.upsert_calendar_events(
+                        ical.read_events(fh), remind_minutes=remind if remind >= 0 else None)
+                text = f"Imported {upserted:,} events and scheduled {reminders:,} reminders."
+                self.root.after(0, lambda: messagebox.showinfo("Calendar Imported", text))
+            except Exception as e:
+                print("[calendar] import error:", e)
+                self.root.after(0, lambda: messagebox.showerror("Import Failed", str(e)))
+            finally:
+                db.close_conn()
+            self.dispatcher.reload()
+            self.safe_refresh()
+
+        threading.Thread(target=work, daemon=True).start()
+
     def clear_fields(self):
-        self.title_var.set(""); self.msg_var.set(""); self.time_var.set(""); self.urgent_var.set(0)
+        self.title_var.set(""); self.msg_var.set(""); self.time_var.set(""); self.urgent_var.set(0); self.repeat_var.set("Once")
+        self.channel_var.set(""); self.tags_var.set("")
         self.title_entry.delete(0, tk.END); self.msg_entry.delete(0, tk.END); self.time_entry.delete(0, tk.END)
         self.title_entry.insert(0, "Enter Title..."); self.msg_entry.insert(0, "Enter Message..."); self.time_entry.insert(0, "YYYY-MM-DD HH:MM:SS")
 
@@ -497,9 +861,9 @@ class TendApp:
         messagebox.showinfo("Saved", f"{'Urgent' if urgent else 'Normal'} sound set!\n{path}")
 
     def toggle_meeting_mode(self):
-        db.set_meeting_mode(not db.get_meeting_mode())
-        messagebox.showinfo("Meeting Mode", f"Meeting Mode: {'ON' if db.get_meeting_mode() else 'OFF'}")
-        self.safe_refresh()
+        mode = not db.get_meeting_mode()
+        db.set_meeting_mode(mode)
+        messagebox.showinfo("Meeting Mode", f"Meeting Mode: {'ON' if mode else 'OFF'}")
 
     def toggle_fullscreen(self):
         self.is_fullscreen = not self.is_fullscreen
@@ -510,16 +874,44 @@ class TendApp:
             self.is_fullscreen = False
             self.root.attributes("-fullscreen", False)
 
+    def show_popup(self, title, message, urgent=False, source=None):
+        # Called from delivery worker threads; Tk widgets must be built on the Tk thread
+        on_snooze = on_cancel = None
+        if source and source.get("id") is not None:
+            on_snooze = lambda minutes: self.snooze_alert(source, minutes)
+            if source.get("recurring"):
+                on_cancel = lambda: self.stop_repeating(source["id"])
+        self.root.after(0, popup_alert, title, message, urgent, on_snooze, on_cancel)
+
+    def snooze_alert(self, source, minutes):
+        nid = db.snooze_notification(source, minutes * 60)
+        if nid is not None:
+            self.dispatcher.requeue([nid])
+        self.safe_refresh()
+
+    def stop_repeating(self, rule_id):
+        db.delete_recurring(rule_id)
+        self.safe_refresh()
+
+    def show_digest(self, items):
+        self.root.after(0, digest_popup, items)
+
     def show_window(self):
         self.root.deiconify(); self.root.lift(); self.root.focus_force()
 
     def on_close(self):
-        self.stop_event.set()
-        stop_sound()
+        self.dispatcher.stop()
+        if self.retention is not None:
+            self.retention.stop()
+        self.delivery.stop()
+        self.weather.stop()
+        metrics.shutdown()
+        audio.get_engine().shutdown()
         try:
             self.tray.stop()
         except Exception:
             pass
+        db.close_all()
         try:
             self.root.quit()
             self.root.destroy()
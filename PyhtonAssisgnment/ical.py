@@ -0,0 +1,179 @@
+"""
+Streaming iCalendar (.ics) reader.
+
+`read_events(fh)` walks the file line by line and yields one dict per
+VEVENT as soon as its END:VEVENT is seen, so memory use does not grow
+with the size of the export. Only the properties TEND stores are parsed:
+UID, SUMMARY, DESCRIPTION, DTSTART, DTEND / DURATION and STATUS.
+Times are converted to naive local time, like the rest of the database.
+"""
+import hashlib
+import re
+from datetime import datetime, timedelta, timezone
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9
+    ZoneInfo = None
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Properties read from each VEVENT; all others are skipped without parsing
+PROPERTIES = frozenset({"UID", "SUMMARY", "DESCRIPTION", "DTSTART", "DTEND", "DURATION", "STATUS"})
+_DURATION = re.compile(r"([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?")
+_UNESCAPE = re.compile(r"\\([\\;,nN])")
+_NAME = re.compile(r"[^;:]*")
+_zones = {}
+
+
+def unfold(lines):
+    """Join folded content lines (continuations start with a space or tab)."""
+    current = None
+    for raw in lines:
+        line = raw.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def parse_line(line):
+    """Split 'NAME;PARAM=x;PARAM="a:b":value' into (NAME, {PARAM: value}, value)."""
+    if '"' not in line:
+        head, sep, value = line.partition(":")
+        if not sep:
+            return None
+    else:
+        # Quoted parameter values may contain ':'
+        quoted = False
+        for i, ch in enumerate(line):
+            if ch == '"':
+                quoted = not quoted
+            elif ch == ":" and not quoted:
+                head, value = line[:i], line[i + 1:]
+                break
+        else:
+            return None
+    name, *params = head.split(";")
+    parsed = {}
+    for param in params:
+        key, _, val = param.partition("=")
+        parsed[key.upper()] = val.strip('"')
+    return name.upper(), parsed, value
+
+
+def _unescape(text):
+    if "\\" not in text:
+        return text
+    return _UNESCAPE.sub(lambda m: "\n" if m.group(1) in "nN" else m.group(1), text)
+
+
+def _zone(tzid):
+    if tzid not in _zones:
+        try:
+            _zones[tzid] = ZoneInfo(tzid) if ZoneInfo else None
+        except Exception:
+            _zones[tzid] = None  # e.g. Windows zone names; treat as floating local time
+    return _zones[tzid]
+
+
+def parse_datetime(value, params):
+    """Return (naive local datetime, all_day) for a DTSTART/DTEND value."""
+    value = value.strip()
+    # Fixed-width basic format; slicing is much faster than strptime on large imports
+    if len(value) < 15 or value[8] != "T":
+        if len(value) != 8 or not value.isdigit():
+            raise ValueError(f"invalid date: {value}")
+        return datetime(int(value[:4]), int(value[4:6]), int(value[6:8])), True
+    if params.get("VALUE") == "DATE":
+        raise ValueError(f"invalid date: {value}")
+    dt = datetime(int(value[:4]), int(value[4:6]), int(value[6:8]),
+                  int(value[9:11]), int(value[11:13]), int(value[13:15]))
+    if value.endswith("Z"):
+        dt = dt.replace(tzinfo=timezone.utc)
+    elif "TZID" in params:
+        zone = _zone(params["TZID"])
+        if zone is not None:
+            dt = dt.replace(tzinfo=zone)
+    if dt.tzinfo is not None:
+        # fromtimestamp() is several times cheaper than astimezone() with no argument
+        dt = datetime.fromtimestamp(dt.timestamp())
+    return dt, False
+
+
+def parse_duration(value):
+    m = _DURATION.fullmatch(value.strip())
+    if not m:
+        raise ValueError(f"invalid DURATION: {value}")
+    weeks, days, hours, minutes, seconds = (int(g or 0) for g in m.groups()[1:])
+    delta = timedelta(weeks=weeks, days=days, hours=hours, minutes=minutes, seconds=seconds)
+    return -delta if m.group(1) == "-" else delta
+
+
+def _make_event(props):
+    if "DTSTART" not in props:
+        return None
+    start, all_day = parse_datetime(props["DTSTART"][1], props["DTSTART"][0])
+    if "DTEND" in props:
+        end, _ = parse_datetime(props["DTEND"][1], props["DTEND"][0])
+    elif "DURATION" in props:
+        end = start + parse_duration(props["DURATION"][1])
+    else:
+        end = start + timedelta(days=1) if all_day else start
+    end = max(end, start)
+    title = _unescape(props.get("SUMMARY", ({}, ""))[1])
+    uid = props.get("UID", ({}, ""))[1].strip()
+    if not uid:
+        # No UID: derive a stable one so re-imports still upsert
+        uid = hashlib.sha1(f"{props['DTSTART'][1]}|{title}".encode()).hexdigest() + "@tend"
+    return {
+        "uid": uid,
+        "title": title,
+        "description": _unescape(props.get("DESCRIPTION", ({}, ""))[1]),
+        # isoformat gives TIME_FORMAT (no microseconds here) and is much cheaper than strftime
+        "start": start.isoformat(" "),
+        "end": end.isoformat(" "),
+        "start_ts": int(start.timestamp()),
+        "end_ts": int(end.timestamp()),
+        "cancelled": props.get("STATUS", ({}, ""))[1].strip().upper() == "CANCELLED",
+    }
+
+
+def read_events(fh, errors=None):
+    """
+    Yield event dicts from an open .ics file. Malformed events are skipped;
+    if `errors` is a list, a message for each is appended to it.
+    """
+    props = None
+    nested = 0
+    for line in unfold(fh):
+        if line[:4].upper() not in ("BEGI", "END:"):
+            if props is not None and nested == 0:
+                name = _NAME.match(line).group().upper()
+                if name in PROPERTIES and name not in props:
+                    parsed = parse_line(line)
+                    if parsed:
+                        props[name] = (parsed[1], parsed[2])
+            continue
+        upper = line.upper()
+        if upper == "BEGIN:VEVENT":
+            props, nested = {}, 0
+        elif props is None:
+            continue
+        elif upper == "END:VEVENT":
+            try:
+                event = _make_event(props)
+            except (ValueError, OverflowError) as e:
+                event = None
+                if errors is not None:
+                    errors.append(f"{props.get('UID', ({}, '?'))[1]}: {e}")
+            if event:
+                yield event
+            props = None
+        elif upper.startswith("BEGIN:"):
+            nested += 1  # VALARM etc.; their properties are not the event's
+        elif upper.startswith("END:"):
+            nested -= 1
@@ -1,13 +1,42 @@
-import importlib.util
+import time
+_START = time.perf_counter()
+
+import argparse
+import contextlib
+import importlib
 import sys
 import os
 import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 from tkinter import PhotoImage
 import threading
-import time
-from gui import TendApp, get_weather_data
 import db
+import weather
+
+
+# ---------- Startup Profiling ----------
+class StartupProfile:
+    """Prints per-stage timings when --profile-startup is given; a no-op otherwise."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+
+    def mark(self, name):
+        if self.enabled:
+            print(f"[startup] {name} at {(time.perf_counter() - _START) * 1000:.0f} ms", flush=True)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            took = (time.perf_counter() - t0) * 1000
+            print(f"[startup] {name}: {took:.1f} ms (done at {(time.perf_counter() - _START) * 1000:.0f} ms)",
+                  flush=True)
 
 
 # ---------- Splash Screen ----------
@@ -53,93 +82,95 @@ class SplashScreen:
         self.status_label = ttk.Label(frame, text="Initializing...", font=("Segoe UI", 10))
         self.status_label.pack(pady=4)
 
-    # Start splash animation and preload tasks
-    def start(self, on_complete, preload_fn=None, preload_timeout=8):
-        def animate_and_preload():
+    # Run the startup stages on a worker thread; progress follows the stages, not a timer
+    def start(self, stages, on_complete, profile=None):
+        profile = profile or StartupProfile()
+
+        def set_progress(value, text):
             try:
-                for i in range(101):
-                    time.sleep(0.02)
-                    self.progress["value"] = i
-                    self.status_label.config(text=f"Loading... {i}%")
-                    try:
-                        self.splash.update_idletasks()
-                    except Exception:
-                        pass
-                time.sleep(0.15)
-
-                # Run preload function if provided
-                if preload_fn:
-                    finished = threading.Event()
-
-                    def run_preload():
-                        try:
-                            preload_fn()
-                        except Exception as e:
-                            print("[preload] error:", e)
-                        finally:
-                            finished.set()
-
-                    t = threading.Thread(target=run_preload, daemon=True)
-                    t.start()
-                    t.join(preload_timeout)
-                    if not finished.is_set():
-                        print(f"[preload] timed out after {preload_timeout}s")
+                self.progress["value"] = value
+                self.status_label.config(text=text)
+            except Exception:
+                pass
 
+        def finish():
+            try:
+                self.splash.destroy()
+            except Exception:
+                pass
+            try:
+                on_complete()
             except Exception as e:
-                print("[SplashScreen] Error:", e)
+                print("[SplashScreen] on_complete error:", e)
 
-            finally:
-                try:
-                    self.splash.destroy()
-                except Exception:
-                    pass
+        def run_stages():
+            for i, (label, fn) in enumerate(stages):
+                self.splash.after(0, set_progress, i * 100 / len(stages), label + "...")
                 try:
-                    on_complete()
+                    with profile.stage(label):
+                        fn()
                 except Exception as e:
-                    print("[SplashScreen] on_complete error:", e)
+                    print(f"[SplashScreen] {label} failed:", e)
+            db.close_conn()
+            self.splash.after(0, set_progress, 100, "Ready")
+            self.splash.after(0, finish)
 
-        threading.Thread(target=animate_and_preload, daemon=True).start()
+        threading.Thread(target=run_stages, name="startup", daemon=True).start()
 
 
 # ---------- Launch Main GUI ----------
-def launch_main_gui(root):
+def launch_main_gui(root, profile):
     try:
-        app = TendApp(root)
-        root.deiconify()
-        root.focus_force()
+        from gui import TendApp
+        with profile.stage("build main window"):
+            app = TendApp(root, profile=profile)
+            root.deiconify()
+            root.focus_force()
+            root.update_idletasks()
+        profile.mark("main window shown")
     except Exception as e:
         print("❌ Error launching main GUI:", e)
         import traceback
         traceback.print_exc()
 
 
-# ---------- Main Function ----------
-def main():
-    # Initialize database
+# ---------- Startup Stages ----------
+def init_database():
     try:
         db.init_db()
         print("✅ Database initialized successfully at:", os.path.abspath(db.DB_PATH))
     except Exception as e:
         print("❌ Database initialization failed:", e)
 
+
+def start_weather():
+    # Serves the cached value immediately; a stale cache is refreshed in the background
+    weather.get_service().start()
+
+
+STARTUP_STAGES = [
+    ("Opening database", init_database),
+    ("Starting weather service", start_weather),
+    ("Loading interface", lambda: importlib.import_module("gui")),
+]
+
+
+# ---------- Main Function ----------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TEND — Temporal Event Notification Dispatcher")
+    parser.add_argument("--profile-startup", action="store_true", help="print per-stage startup timings")
+    args = parser.parse_args(argv)
+    profile = StartupProfile(args.profile_startup)
+    profile.mark("modules imported")
+
     # Create hidden root window
-    root = ttk.Window(themename="darkly")
-    root.withdraw()
+    with profile.stage("create root window"):
+        root = ttk.Window(themename="darkly")
+        root.withdraw()
 
-    # Show splash screen
+    # Show splash screen while the stages run; heavy modules load after the main window is up
     splash = SplashScreen(root)
-
-    # Preload weather data
-    def preload_weather():
-        try:
-            print("[preload] fetching weather for splash...")
-            get_weather_data()
-            print("[preload] weather fetched/cached")
-        except Exception as e:
-            print("[preload] weather error:", e)
-
-    # Start splash and launch main window
-    splash.start(lambda: launch_main_gui(root), preload_fn=preload_weather, preload_timeout=8)
+    splash.start(STARTUP_STAGES, lambda: launch_main_gui(root, profile), profile=profile)
 
     # Run main loop
     try:
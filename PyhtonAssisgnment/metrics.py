@@ -0,0 +1,303 @@
+"""
+In-process instrumentation: counters, gauges and latency histograms.
+
+Hot paths call `inc()`, `observe()`, `timer()` or are wrapped with
+`@timed(...)`. While instrumentation is disabled (the default) each of
+these is a single module-global check, so the cost is negligible. It is
+turned on with `enable()`, which `configure()` does when the
+"metrics_address" setting or the TEND_METRICS environment variable is set;
+an address of the form "host:port" then also serves the Prometheus text
+format (any other value, e.g. TEND_METRICS=1, only enables recording):
+
+    curl http://127.0.0.1:9464/metrics
+
+The GUI's Diagnostics tab reads the same registry through `snapshot()`.
+"""
+import bisect
+import os
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency buckets in seconds (upper bounds); +Inf is implicit
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Dispatch lateness can be minutes or hours after downtime
+LATENESS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 15.0, 60.0, 300.0, 3600.0, 86400.0)
+
+_enabled = False
+_lock = threading.Lock()
+_metrics = {}  # name -> _Metric
+_server = None
+
+
+class _Metric:
+    def __init__(self, name, kind, help_text="", buckets=None):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.buckets = buckets
+        self.values = {}  # label tuple -> float, or [bucket counts..., sum, count] for histograms
+        self.functions = {}  # label tuple -> callable, for gauges read at collection time
+
+
+def _metric(name, kind, help_text="", buckets=None):
+    m = _metrics.get(name)
+    if m is None:
+        with _lock:
+            m = _metrics.setdefault(name, _Metric(name, kind, help_text, buckets))
+    return m
+
+
+def describe(name, kind, help_text, buckets=None):
+    """Register a metric up front so it is exported (with HELP) before its first sample."""
+    m = _metric(name, kind, help_text, buckets)
+    m.help = help_text
+    return m
+
+
+# ---------- RECORDING ----------
+def enabled():
+    return _enabled
+
+
+def enable(on=True):
+    global _enabled
+    _enabled = on
+
+
+def inc(name, amount=1, **labels):
+    if not _enabled:
+        return
+    m = _metric(name, "counter")
+    key = tuple(sorted(labels.items()))
+    with _lock:
+        m.values[key] = m.values.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    if not _enabled:
+        return
+    m = _metric(name, "gauge")
+    with _lock:
+        m.values[tuple(sorted(labels.items()))] = value
+
+
+def gauge_function(name, func, help_text="", **labels):
+    """Register a gauge whose value is `func()` at collection time (e.g. a queue length)."""
+    m = _metric(name, "gauge", help_text)
+    with _lock:
+        m.functions[tuple(sorted(labels.items()))] = func
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    if not _enabled:
+        return
+    m = _metric(name, "histogram", buckets=buckets)
+    key = tuple(sorted(labels.items()))
+    index = bisect.bisect_left(m.buckets, value)
+    with _lock:
+        counts = m.values.get(key)
+        if counts is None:
+            counts = m.values[key] = [0] * (len(m.buckets) + 3)
+        counts[index] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+
+class _Timer:
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name, **labels):
+    """`with metrics.timer("tend_x_seconds"):` observes the block's duration."""
+    return _Timer(name, labels) if _enabled else _NULL_TIMER
+
+
+def timed(name, **labels):
+    """Decorator form of `timer`."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kw):
+            if not _enabled:
+                return func(*args, **kw)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kw)
+            finally:
+                observe(name, time.perf_counter() - start, **labels)
+        return wrapper
+    return decorate
+
+
+# ---------- EXPORT ----------
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _collect():
+    """Consistent copy of every metric: [(metric, {labels: value})]."""
+    with _lock:
+        metrics = sorted(_metrics.values(), key=lambda m: m.name)
+        values = [(m, {k: list(v) if isinstance(v, list) else v for k, v in m.values.items()},
+                   dict(m.functions)) for m in metrics]
+    result = []
+    for m, vals, functions in values:
+        for key, func in functions.items():
+            try:
+                vals[key] = func()
+            except Exception:
+                continue
+        result.append((m, vals))
+    return result
+
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for m, vals in _collect():
+        if m.help:
+            lines.append(f"# HELP {m.name} {m.help}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        for key, value in sorted(vals.items()):
+            if m.kind != "histogram":
+                lines.append(f"{m.name}{_format_labels(key)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(m.buckets + ("+Inf",), value):
+                cumulative += count
+                lines.append(f"{m.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{m.name}_sum{_format_labels(key)} {value[-2]}")
+            lines.append(f"{m.name}_count{_format_labels(key)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def quantile(buckets, counts, q):
+    """Estimate a quantile from histogram bucket counts (linear within a bucket)."""
+    total = sum(counts[:-2])
+    if not total:
+        return None
+    rank, seen, lower = q * total, 0, 0.0
+    for bound, count in zip(buckets + (float("inf"),), counts):
+        if seen + count >= rank and count:
+            if bound == float("inf"):
+                return lower
+            return lower + (bound - lower) * (rank - seen) / count
+        seen += count
+        lower = bound if bound != float("inf") else lower
+    return lower
+
+
+def snapshot():
+    """
+    Rows for display: (name, labels text, value text). Histograms show
+    count, mean and estimated p50 / p95.
+    """
+    rows = []
+    for m, vals in _collect():
+        for key, value in sorted(vals.items()):
+            labels = ", ".join(f"{k}={v}" for k, v in key)
+            if m.kind != "histogram":
+                rows.append((m.name, labels, f"{value:g}" if isinstance(value, (int, float)) else str(value)))
+                continue
+            count = value[-1]
+            if not count:
+                continue
+            p50 = quantile(m.buckets, value, 0.5)
+            p95 = quantile(m.buckets, value, 0.95)
+            rows.append((m.name, labels, f"n={count} mean={value[-2] / count * 1000:.2f}ms "
+                                         f"p50={p50 * 1000:.2f}ms p95={p95 * 1000:.2f}ms"))
+    return rows
+
+
+def reset():
+    with _lock:
+        for m in _metrics.values():
+            m.values.clear()
+
+
+# ---------- HTTP ENDPOINT ----------
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(address):
+    """Serve /metrics on "host:port" from a daemon thread. Returns the server."""
+    global _server
+    host, _, port = address.rpartition(":")
+    _server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), _Handler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="metrics-http", daemon=True).start()
+    print(f"[metrics] serving on http://{host or '127.0.0.1'}:{_server.server_address[1]}/metrics")
+    return _server
+
+
+def configure(address=None):
+    """
+    Enable instrumentation if `address` (default: the TEND_METRICS environment
+    variable, then the "metrics_address" setting) is set, and serve it there.
+    Returns True if metrics are on.
+    """
+    if address is None:
+        address = os.environ.get("TEND_METRICS")
+    if address is None:
+        import db
+        address = db.get_setting("metrics_address", "")
+    if not address:
+        return False
+    enable()
+    if _server is None and ":" in address:
+        try:
+            serve(address)
+        except OSError as e:
+            print(f"[metrics] cannot listen on {address}: {e}")
+    return True
+
+
+def shutdown():
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
@@ -0,0 +1,211 @@
+"""
+Recurrence rules for repeating notifications.
+
+Supports a subset of RFC 5545 RRULE:
+
+    FREQ=HOURLY|DAILY|WEEKLY|MONTHLY   (required)
+    INTERVAL=n                          every n-th hour / day / week / month
+    BYDAY=MO,WE,FR                      weekdays; MONTHLY also accepts 1MO, -1FR, ...
+    COUNT=n  or  UNTIL=<time>           stop after n occurrences / after a time
+                                        (wall-clock time in the rule's zone, or
+                                        UTC with a trailing Z, e.g. 20251231T230000Z)
+
+A rule is stored once, next to its DTSTART, and expanded lazily: the
+`occurrences()` generator starts at the period that contains `start`, so
+finding the next occurrence does not walk through every occurrence since
+DTSTART. Times are naive wall-clock datetimes in the rule's zone (db.py
+converts them to UTC epochs with timezones.py).
+"""
+import calendar
+import re
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import timezones
+
+FREQUENCIES = ("HOURLY", "DAILY", "WEEKLY", "MONTHLY")
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+# Give up after this many consecutive periods without an occurrence, so a
+# rule that can never match again (e.g. "5th Friday" on a long interval
+# that never lands on one) cannot loop forever.
+MAX_EMPTY_PERIODS = 1000
+
+_BYDAY = re.compile(r"([+-]?[1-5])?(MO|TU|WE|TH|FR|SA|SU)")
+_UNTIL_FORMATS = ("%Y%m%dT%H%M%S", "%Y%m%d", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d")
+
+
+def _parse_until(value, tz=None):
+    """
+    (wall-clock UNTIL in zone `tz`, the UTC datetime or None). A UTC value
+    ("...Z") is converted to the rule's zone, not the machine's.
+    """
+    utc = value.endswith("Z")
+    value = value.rstrip("Z")
+    for fmt in _UNTIL_FORMATS:
+        try:
+            dt = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if len(value) <= 10:
+            dt = dt.replace(hour=23, minute=59, second=59)
+        if utc:
+            return timezones.wall_time(dt.replace(tzinfo=timezone.utc).timestamp(), tz), dt
+        return dt, None
+    raise ValueError(f"invalid UNTIL: {value}")
+
+
+class RecurrenceRule:
+    def __init__(self, freq, interval=1, byday=(), count=None, until=None, until_utc=None):
+        """
+        `byday` is a sequence of (ordinal or None, weekday 0=Monday) pairs;
+        `until` is wall-clock time in the rule's zone and `until_utc` the
+        naive UTC time it came from, if it was given in UTC.
+        """
+        if freq not in FREQUENCIES:
+            raise ValueError(f"unsupported FREQ: {freq}")
+        if interval < 1:
+            raise ValueError("INTERVAL must be at least 1")
+        if count is not None and count < 1:
+            raise ValueError("COUNT must be at least 1")
+        if count is not None and until is not None:
+            raise ValueError("COUNT and UNTIL are mutually exclusive")
+        if freq != "MONTHLY" and any(n is not None for n, _ in byday):
+            raise ValueError("BYDAY ordinals (e.g. 1MO) are only valid with FREQ=MONTHLY")
+        self.freq = freq
+        self.interval = interval
+        self.byday = tuple(sorted(set(byday), key=lambda d: (d[1], d[0] or 0)))
+        self.weekdays = frozenset(wd for _, wd in self.byday)
+        self.count = count
+        self.until = until
+        self.until_utc = until_utc
+
+    @classmethod
+    def parse(cls, text, tz=None):
+        """
+        Parse "FREQ=WEEKLY;BYDAY=MO,WE" (an "RRULE:" prefix is allowed) for a
+        rule in IANA zone `tz` (default: local). Raises ValueError.
+        """
+        text = (text or "").strip()
+        if text.upper().startswith("RRULE:"):
+            text = text[6:]
+        parts = {}
+        for part in filter(None, text.upper().split(";")):
+            key, sep, value = part.partition("=")
+            if not sep or not value:
+                raise ValueError(f"invalid rule part: {part}")
+            parts[key.strip()] = value.strip()
+        unknown = set(parts) - {"FREQ", "INTERVAL", "BYDAY", "COUNT", "UNTIL"}
+        if unknown:
+            raise ValueError(f"unsupported rule parts: {', '.join(sorted(unknown))}")
+        if "FREQ" not in parts:
+            raise ValueError("rule needs a FREQ")
+        byday = []
+        for day in filter(None, parts.get("BYDAY", "").split(",")):
+            m = _BYDAY.fullmatch(day)
+            if not m:
+                raise ValueError(f"invalid BYDAY: {day}")
+            byday.append((int(m.group(1)) if m.group(1) else None, WEEKDAYS.index(m.group(2))))
+        try:
+            interval = int(parts.get("INTERVAL", 1))
+            count = int(parts["COUNT"]) if "COUNT" in parts else None
+        except ValueError:
+            raise ValueError("INTERVAL and COUNT must be integers") from None
+        until, until_utc = _parse_until(parts["UNTIL"], tz) if "UNTIL" in parts else (None, None)
+        return cls(parts["FREQ"], interval, byday, count, until, until_utc)
+
+    def __str__(self):
+        parts = [f"FREQ={self.freq}"]
+        if self.interval != 1:
+            parts.append(f"INTERVAL={self.interval}")
+        if self.byday:
+            parts.append("BYDAY=" + ",".join(f"{n or ''}{WEEKDAYS[wd]}" for n, wd in self.byday))
+        if self.count is not None:
+            parts.append(f"COUNT={self.count}")
+        if self.until_utc is not None:
+            # Kept in UTC, so the stored rule does not depend on the zone it was parsed in
+            parts.append(f"UNTIL={self.until_utc.strftime('%Y%m%dT%H%M%SZ')}")
+        elif self.until is not None:
+            parts.append(f"UNTIL={self.until.strftime('%Y%m%dT%H%M%S')}")
+        return ";".join(parts)
+
+    # --- Expansion ---
+    def _one_per_period(self):
+        return self.freq != "MONTHLY" and not self.byday
+
+    def _period_index(self, dtstart, moment):
+        """Index of the period containing `moment` (never past it)."""
+        if self.freq == "HOURLY":
+            return int((moment - dtstart).total_seconds() // 3600) // self.interval
+        if self.freq == "DAILY":
+            return (moment.date() - dtstart.date()).days // self.interval
+        if self.freq == "WEEKLY":
+            week0 = dtstart.date() - timedelta(days=dtstart.weekday())
+            return (moment.date() - week0).days // 7 // self.interval
+        return ((moment.year - dtstart.year) * 12 + moment.month - dtstart.month) // self.interval
+
+    def _period(self, dtstart, k):
+        """Candidate datetimes of period `k`, in order (may include times before DTSTART)."""
+        if self.freq in ("HOURLY", "DAILY"):
+            step = timedelta(hours=k * self.interval) if self.freq == "HOURLY" else timedelta(days=k * self.interval)
+            dt = dtstart + step
+            return [dt] if not self.weekdays or dt.weekday() in self.weekdays else []
+        if self.freq == "WEEKLY":
+            week = dtstart - timedelta(days=dtstart.weekday()) + timedelta(weeks=k * self.interval)
+            days = sorted(self.weekdays) if self.weekdays else [dtstart.weekday()]
+            return [week + timedelta(days=d) for d in days]
+        m = dtstart.month - 1 + k * self.interval
+        year, month = dtstart.year + m // 12, m % 12 + 1
+        first_weekday, ndays = calendar.monthrange(year, month)
+        if not self.byday:
+            days = [dtstart.day] if dtstart.day <= ndays else []
+        else:
+            days = set()
+            for n, wd in self.byday:
+                matches = list(range((wd - first_weekday) % 7 + 1, ndays + 1, 7))
+                if n is None:
+                    days.update(matches)
+                elif -len(matches) <= (n - 1 if n > 0 else n) < len(matches):
+                    days.add(matches[n - 1 if n > 0 else n])
+            days = sorted(days)
+        return [dtstart.replace(year=year, month=month, day=d) for d in days]
+
+    def occurrences(self, dtstart, start=None, exdates=()):
+        """
+        Yield occurrence datetimes in order, beginning with the first at or
+        after `start` (default: DTSTART). Dates in `exdates` are skipped but
+        still count towards COUNT, as in RFC 5545.
+        """
+        k = seen = 0
+        if start is not None and start > dtstart and (self.count is None or self._one_per_period()):
+            k = self._period_index(dtstart, start)
+            seen = k
+        empty = 0
+        while empty < MAX_EMPTY_PERIODS:
+            try:
+                candidates = self._period(dtstart, k)
+            except (OverflowError, ValueError):
+                return  # ran past datetime.max
+            found = False
+            for dt in candidates:
+                if dt < dtstart:
+                    continue
+                found = True
+                if self.until is not None and dt > self.until:
+                    return
+                if self.count is not None:
+                    if seen >= self.count:
+                        return
+                    seen += 1
+                if (start is None or dt >= start) and dt not in exdates:
+                    yield dt
+            empty = 0 if found else empty + 1
+            k += 1
+
+    def next(self, dtstart, start, exdates=()):
+        """The first occurrence at or after `start`, or None if the rule has ended."""
+        return next(self.occurrences(dtstart, start, exdates), None)
+
+
+@lru_cache(maxsize=1024)
+def parse_rule(text, tz=None):
+    """Cached RecurrenceRule.parse; rules are never mutated, so instances are shared."""
+    return RecurrenceRule.parse(text, tz)
@@ -0,0 +1,110 @@
+"""
+Retention, archival and compaction.
+
+Delivered notifications older than the "retention_days" setting (default
+30, 0 keeps everything) move in batches from tend.db into tend.archive.db,
+so the hot table only holds the working set. notification_stats keeps
+counting them, so the analytics do not change. delivery_log rows older
+than "delivery_log_retention_days" (default 90) are rolled up per day,
+sink and outcome into delivery_rollup and deleted.
+
+`RetentionService` runs a pass every MAINTENANCE_INTERVAL, but only while
+the Dispatcher has nothing due within IDLE_MARGIN, in short transactions
+with a pause in between, so dispatching never waits for it. A pass that
+removed rows then frees pages with incremental VACUUM (an old file is
+converted with one full VACUUM first), and every pass runs PRAGMA optimize.
+`python -m tend maintain` runs one pass in the foreground.
+"""
+import threading
+import time
+import db
+import metrics
+
+RETENTION_DAYS = 30
+DELIVERY_LOG_RETENTION_DAYS = 90
+ARCHIVE_BATCH = 2000
+BATCH_PAUSE = 0.05
+MAINTENANCE_INTERVAL = 15 * 60
+IDLE_MARGIN = 60
+VACUUM_PAGES = 4096
+
+metrics.describe("tend_retention_rows_total", "counter", "Rows archived or pruned by retention.")
+
+
+def _days_setting(key, default):
+    try:
+        return max(0.0, float(db.get_setting(key, str(default))))
+    except ValueError:
+        return default
+
+
+def maintain(is_idle=None, stop=None):
+    """
+    One maintenance pass. `is_idle()` is checked before every batch and
+    `stop` (an Event) between them; the pass ends early when either says so.
+    Returns {"archived": n, "pruned": n, "freed_pages": n}.
+    """
+    def keep_going():
+        return not (stop is not None and stop.is_set()) and (is_idle is None or is_idle())
+
+    def batches(step, before):
+        total = 0
+        while keep_going():
+            n = step(before, ARCHIVE_BATCH)
+            total += n
+            if n < ARCHIVE_BATCH:
+                break
+            time.sleep(BATCH_PAUSE)  # let the Dispatcher and GUI at the write lock
+        return total
+
+    result = {"archived": 0, "pruned": 0, "freed_pages": 0}
+    now = time.time()
+    days = _days_setting("retention_days", RETENTION_DAYS)
+    if days:
+        result["archived"] = batches(db.archive_delivered, now - days * 86400)
+    days = _days_setting("delivery_log_retention_days", DELIVERY_LOG_RETENTION_DAYS)
+    if days:
+        result["pruned"] = batches(db.prune_delivery_log, now - days * 86400)
+    if (result["archived"] or result["pruned"]) and keep_going():
+        result["freed_pages"] = db.compact(VACUUM_PAGES)
+    db.optimize()
+    metrics.inc("tend_retention_rows_total", result["archived"], kind="archived")
+    metrics.inc("tend_retention_rows_total", result["pruned"], kind="pruned")
+    if result["archived"] or result["pruned"]:
+        print(f"[retention] archived {result['archived']} notifications, pruned {result['pruned']} "
+              f"delivery log rows, freed {result['freed_pages']} pages")
+    return result
+
+
+class RetentionService:
+    def __init__(self, dispatcher=None, interval=MAINTENANCE_INTERVAL, idle_margin=IDLE_MARGIN):
+        self.dispatcher = dispatcher
+        self.interval = interval
+        self.idle_margin = idle_margin
+        self._stop = threading.Event()
+        self._thread = None
+
+    def is_idle(self):
+        """True while nothing is due within `idle_margin` seconds."""
+        if self.dispatcher is None:
+            return True
+        head = self.dispatcher.next_due()
+        return head is None or head - time.time() > self.idle_margin
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self.is_idle():
+                continue
+            try:
+                maintain(self.is_idle, self._stop)
+            except Exception as e:
+                print("[retention] error:", e)
+        db.close_conn()
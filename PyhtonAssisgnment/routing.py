@@ -0,0 +1,207 @@
+"""
+Channels, tags and routing rules.
+
+A notification may carry a channel ("ops", "home", ...) and any number of
+tags. Routing rules, stored in the routing_rules table, decide what the
+Dispatcher does with each due alert. Rules are tried in order and the
+first one that matches wins; an alert no rule matches is delivered as
+before (muted by meeting mode unless urgent).
+
+A rule matches on any combination of
+
+    channel=NAME  tag=NAME  urgent=yes|no  quiet=HH:MM-HH:MM
+
+where quiet hours are local time and may wrap midnight, and has one action:
+
+    deliver     - deliver (meeting mode still mutes non-urgent alerts)
+    bypass_dnd  - deliver, even in meeting mode
+    suppress    - do not deliver; logged as suppressed, reason "rule N"
+    digest      - hold, and deliver everything held by the rule as one
+                  summary every N minutes (default 60, aligned to the
+                  local hour). Urgent alerts are never held.
+
+For example "channel=ops" bypass_dnd, "tag=low" digest and
+"quiet=22:00-07:00 urgent=no" suppress.
+
+Rules are compiled into a `Router` once per change (triggers bump
+routing_version on every write). Routing a batch first works out which
+quiet windows are open, then decides once per distinct (channel, tags,
+urgent) combination and remembers the decision, so a burst of 10k alerts
+costs a dict lookup per alert rather than a rule scan.
+"""
+from functools import lru_cache
+import db
+import timezones
+
+ACTIONS = ("deliver", "bypass_dnd", "suppress", "digest")
+DEFAULT_DIGEST_MINUTES = 60
+TRUE_VALUES = {"1", "true", "yes", "y", "on"}
+FALSE_VALUES = {"0", "false", "no", "n", "off"}
+# Decision tables kept per combination of open quiet windows
+MAX_TABLES = 64
+
+
+# ---------- RULE TEXT ----------
+def _parse_clock(text):
+    hours, _, minutes = text.strip().partition(":")
+    hours, minutes = int(hours), int(minutes or 0)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(text)
+    return hours * 60 + minutes
+
+
+def parse_conditions(text):
+    """
+    Parse conditions such as "channel=ops urgent=no quiet=22:00-07:00" (any
+    subset, any order; empty matches everything) into keyword arguments
+    for db.add_routing_rule. Raises ValueError.
+    """
+    rule = {}
+    for part in (text or "").split():
+        key, _, value = part.partition("=")
+        key = key.lower()
+        if not value:
+            raise ValueError(f"expected key=value, got {part!r}")
+        if key == "channel":
+            rule["channel"] = db.normalize_channel(value)
+        elif key == "tag":
+            if "," in value:
+                raise ValueError("a rule matches one tag; add a rule per tag")
+            rule["tag"] = db.normalize_tags(value)
+        elif key == "urgent":
+            if value.lower() not in TRUE_VALUES | FALSE_VALUES:
+                raise ValueError(f"urgent must be yes or no, got {value!r}")
+            rule["urgent"] = value.lower() in TRUE_VALUES
+        elif key == "quiet":
+            start, _, end = value.partition("-")
+            try:
+                rule["quiet_start"], rule["quiet_end"] = _parse_clock(start), _parse_clock(end)
+            except ValueError:
+                raise ValueError(f"quiet hours must look like 22:00-07:00, got {value!r}") from None
+        else:
+            raise ValueError(f"unknown condition {key!r} (channel, tag, urgent or quiet)")
+    return rule
+
+
+def describe(rule):
+    """Rule text for a db.get_routing_rules() row, e.g. "channel=ops urgent=no -> bypass_dnd"."""
+    rid, channel, tag, urgent, quiet_start, quiet_end, action, digest_minutes = rule
+    parts = []
+    if channel:
+        parts.append(f"channel={channel}")
+    if tag:
+        parts.append(f"tag={tag}")
+    if urgent is not None:
+        parts.append(f"urgent={'yes' if urgent else 'no'}")
+    if quiet_start is not None:
+        parts.append(f"quiet={quiet_start // 60:02d}:{quiet_start % 60:02d}-{quiet_end // 60:02d}:{quiet_end % 60:02d}")
+    if action == "digest":
+        action = f"digest every {digest_minutes or DEFAULT_DIGEST_MINUTES} min"
+    return f"{' '.join(parts) or '(every alert)'} -> {action}"
+
+
+# ---------- COMPILED RULES ----------
+class Router:
+    """Rules compiled for fast evaluation; build with `compile_rules()`."""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self._quiet = [(r[0], r[4], r[5]) for r in rules if r[4] is not None]
+        self._tables = {}
+
+    def _open_windows(self, now):
+        if not self._quiet:
+            return frozenset()
+        wall = timezones.wall_time(now)
+        minute = wall.hour * 60 + wall.minute
+        return frozenset(rid for rid, start, end in self._quiet
+                         if (start <= minute < end if start <= end else minute >= start or minute < end))
+
+    def _table(self, open_windows):
+        """
+        The memoized decision function for one set of open quiet windows:
+        rules outside their window are dropped and the rest indexed by
+        channel, so a lookup only tries rules that can match.
+        """
+        table = self._tables.get(open_windows)
+        if table is not None:
+            return table
+        live = [r for r in self.rules if r[4] is None or r[0] in open_windows]
+        any_channel = [r for r in live if r[1] is None]
+        by_channel = {r[1]: [x for x in live if x[1] is None or x[1] == r[1]] for r in live if r[1] is not None}
+        decisions = {}
+
+        def decide(channel, tags, urgent):
+            key = (channel, tags, urgent)
+            hit = decisions.get(key)
+            if hit is None:
+                tag_set = set(tags.split(",")) if tags else ()
+                hit = (None, "deliver")
+                for r in by_channel.get(channel, any_channel):
+                    if (r[2] is None or r[2] in tag_set) and (r[3] is None or bool(r[3]) == urgent):
+                        hit = (r, r[6])
+                        break
+                decisions[key] = hit
+            return hit
+
+        if len(self._tables) >= MAX_TABLES:
+            self._tables.clear()
+        self._tables[open_windows] = decide
+        return decide
+
+    def route(self, alerts, now, meeting=False):
+        """
+        Split alerts into (deliver, suppressed). Alerts held for a digest
+        stay in `deliver` with "digest_rule" (rule id) and "digest_at" (the
+        epoch to deliver the summary) set; `suppressed` is a list of
+        (alert, reason) pairs.
+        """
+        decide = self._table(self._open_windows(now))
+        deliver, suppressed = [], []
+        for n in alerts:
+            urgent = bool(n["urgent"])
+            rule, action = decide(n.get("channel"), n.get("tags") or "", urgent)
+            if action == "suppress":
+                suppressed.append((n, f"rule {rule[0]}"))
+            elif action == "digest" and not urgent:
+                n["digest_rule"] = rule[0]
+                n["digest_at"] = digest_time(now, rule[7] or DEFAULT_DIGEST_MINUTES)
+                deliver.append(n)
+            elif meeting and not urgent and action != "bypass_dnd":
+                suppressed.append((n, "meeting_mode"))
+            else:
+                deliver.append(n)
+        return deliver, suppressed
+
+
+def digest_time(now, minutes):
+    """The next multiple of `minutes` after local midnight that is later than `now`."""
+    wall = timezones.wall_time(now)
+    elapsed = wall.hour * 3600 + wall.minute * 60 + wall.second
+    step = max(1, int(minutes)) * 60
+    return int(now) - elapsed + (elapsed // step + 1) * step
+
+
+@lru_cache(maxsize=8)
+def compile_rules(rules):
+    """A Router for a tuple of db.get_routing_rules() rows (cached, so equal rules share one)."""
+    return Router(tuple(rules))
+
+
+_router_key = None
+_router = None
+
+
+def get_router():
+    """
+    The Router for the current database, or None when it has no rules.
+    Costs one single-row read; the rules are re-read and recompiled only
+    after routing_rules changed.
+    """
+    global _router_key, _router
+    key = (db.DB_PATH, db.routing_version())
+    if key != _router_key:
+        rules = tuple(db.get_routing_rules()) if key[1] is not None else ()
+        _router = compile_rules(rules) if rules else None
+        _router_key = key
+    return _router
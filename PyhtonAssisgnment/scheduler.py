@@ -0,0 +1,434 @@
+import heapq
+import threading
+import time
+import db
+import metrics
+import routing
+
+# Upper bound on a single idle sleep. The dispatcher normally sleeps until the
+# next due time, but wakes at least this often so wall-clock jumps (suspend /
+# resume, manual clock changes) and rows written by other processes (e.g. the
+# bulk importer) are noticed promptly. An idle wake-up costs one PRAGMA read.
+MAX_IDLE_WAIT = 5.0
+
+# DueQueue rebuilds its heap when stale entries exceed the live ones by this many
+COMPACT_MIN_STALE = 1024
+
+# Catch-up: what to do with alerts that are more than CATCHUP_GRACE seconds
+# overdue when they fire (the app was closed, the machine asleep, ...).
+# Setting "catchup_policy":
+#   "all"     - deliver every missed alert (default)
+#   "latest"  - deliver only the most recent missed alert per title
+#   "summary" - replace the missed alerts with one summary alert
+#   "drop"    - drop missed alerts more than "catchup_max_age" seconds old
+# Urgent alerts are always delivered. Suppressed alerts are recorded in the
+# delivery log with the reason.
+CATCHUP_POLICIES = ("all", "latest", "summary", "drop")
+CATCHUP_GRACE = 60
+CATCHUP_MAX_AGE = 3600
+SUMMARY_PREVIEW = 5
+
+
+def apply_catchup(batch, now, policy="all", max_age=CATCHUP_MAX_AGE):
+    """
+    Split a claimed batch into (deliver, suppressed), where `deliver` keeps
+    the batch order and `suppressed` is a list of (notification, reason).
+    The "summary" policy adds a summary alert (no "id") to `deliver`.
+    """
+    if policy == "all":
+        return list(batch), []
+    missed = [n for n in batch if not n["urgent"] and n.get("due_ts") is not None
+              and now - n["due_ts"] > CATCHUP_GRACE]
+    if not missed:
+        return list(batch), []
+    if policy == "latest":
+        latest = {}
+        for n in missed:
+            if n["title"] not in latest or n["due_ts"] >= latest[n["title"]]["due_ts"]:
+                latest[n["title"]] = n
+        dropped = [(n, "catchup_superseded") for n in missed if latest[n["title"]] is not n]
+    elif policy == "summary":
+        if len(missed) < 2:
+            return list(batch), []
+        dropped = [(n, "catchup_summarized") for n in missed]
+    elif policy == "drop":
+        dropped = [(n, "catchup_expired") for n in missed if now - n["due_ts"] > max_age]
+    else:
+        raise ValueError(f"unknown catch-up policy: {policy}")
+    gone = {id(n) for n, _ in dropped}
+    deliver = [n for n in batch if id(n) not in gone]
+    if policy == "summary":
+        deliver.append(_summary_alert(missed, f"{len(missed)} missed notifications"))
+    return deliver, dropped
+
+
+def _summary_alert(alerts, title):
+    """One alert (no "id") listing the first SUMMARY_PREVIEW titles of `alerts`."""
+    titles = [n["title"] or "(untitled)" for n in alerts[:SUMMARY_PREVIEW]]
+    if len(alerts) > SUMMARY_PREVIEW:
+        titles.append(f"and {len(alerts) - SUMMARY_PREVIEW} more")
+    return {"title": title, "message": ", ".join(titles), "urgent": False}
+
+
+def plan_batch(batch, now, meeting=False, policy="all", max_age=CATCHUP_MAX_AGE, router=None):
+    """
+    Apply the catch-up policy, then the routing rules (`router`, see
+    routing.py) or plain meeting mode to a claimed batch. Returns
+    (deliver, records): the alerts to hand to the sinks, where alerts held
+    for a digest carry "digest_at", and delivery_log records for
+    everything suppressed.
+    """
+    deliver, suppressed = apply_catchup(batch, now, policy, max_age)
+    if router is not None:
+        deliver, routed = router.route(deliver, now, meeting)
+        suppressed.extend(routed)
+    elif meeting:
+        suppressed.extend((n, "meeting_mode") for n in deliver if not n['urgent'])
+        deliver = [n for n in deliver if n['urgent']]
+    records = [db.delivery_record(n, "suppressed", reason=reason, now=now) for n, reason in suppressed]
+    return deliver, records
+
+
+def _catchup_settings():
+    policy = db.get_setting("catchup_policy", "all")
+    if policy not in CATCHUP_POLICIES:
+        print(f"[Dispatcher] unknown catchup_policy {policy!r}; delivering all")
+        policy = "all"
+    try:
+        max_age = float(db.get_setting("catchup_max_age", str(CATCHUP_MAX_AGE)))
+    except ValueError:
+        max_age = CATCHUP_MAX_AGE
+    return policy, max_age
+
+
+# ---------- DUE QUEUE ----------
+class DueQueue:
+    """
+    Thread-safe min-heap of (due_epoch, notification_id) pairs, at most one
+    per id. Moving or removing an id is O(log n) / O(1): `_due` holds each
+    id's current due time, and heap entries that no longer match it are
+    stale and skipped when they surface (lazy deletion). The heap is rebuilt
+    once stale entries outnumber live ones.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._due = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._due)
+
+    def __contains__(self, nid):
+        return nid in self._due
+
+    def load(self, items):
+        """Merge an iterable of (due, id) pairs into the queue."""
+        items = list(items)
+        with self._lock:
+            self._due.update((nid, due) for due, nid in items)
+            if len(items) * 8 < len(self._heap):
+                for item in items:
+                    heapq.heappush(self._heap, item)
+            else:
+                self._heap.extend(items)
+                heapq.heapify(self._heap)
+            self._maybe_compact()
+
+    def push(self, due, nid):
+        """Insert or move an entry; returns True if it became the new head."""
+        with self._lock:
+            if self._due.get(nid) == due:
+                return False
+            self._due[nid] = due
+            heapq.heappush(self._heap, (due, nid))
+            self._maybe_compact()
+            self._drop_stale_head()
+            return self._heap[0][1] == nid
+
+    def discard(self, nid):
+        """Remove an entry if present; returns True if it was."""
+        with self._lock:
+            if self._due.pop(nid, None) is None:
+                return False
+            self._drop_stale_head()
+            return True
+
+    def pop_due(self, now):
+        """Remove and return the ids of every entry due at or before `now`."""
+        due_ids = []
+        with self._lock:
+            heap, current = self._heap, self._due
+            while heap and heap[0][0] <= now:
+                due, nid = heapq.heappop(heap)
+                if current.get(nid) == due:
+                    del current[nid]
+                    due_ids.append(nid)
+        return due_ids
+
+    def next_due(self):
+        """Epoch of the earliest entry, or None if the queue is empty."""
+        with self._lock:
+            self._drop_stale_head()
+            return self._heap[0][0] if self._heap else None
+
+    def _drop_stale_head(self):
+        heap, current = self._heap, self._due
+        while heap and current.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+    def _maybe_compact(self):
+        if len(self._heap) > 2 * len(self._due) + COMPACT_MIN_STALE:
+            self._heap = [(due, nid) for nid, due in self._due.items()]
+            heapq.heapify(self._heap)
+
+
+# ---------- DISPATCHER ----------
+class BaseDispatcher(threading.Thread):
+    """
+    What Dispatcher and shards.ShardedDispatcher share: the thread, handing
+    alerts to `deliver(title, message, urgent, source)` (`source` is the
+    claimed row, for the delivery log), calling `on_batch()` after each
+    batch, writing every decision to the delivery log, and digests.
+
+    Alerts a routing rule holds for a digest are logged as "held" and kept
+    in the digest_holds table until the digest is due (or meeting mode
+    ends), then delivered as one summary and logged as "digested". The
+    holds are reloaded on start, so a restart or crash does not lose them.
+    """
+
+    def __init__(self, stop_event, deliver, on_batch=None):
+        super().__init__(daemon=True)
+        self.stop_event = stop_event
+        self.deliver = deliver
+        self.on_batch = on_batch
+        self._wake = threading.Event()
+        self._held = {}  # digest rule id -> [digest epoch, [alerts]]
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self.stop_event.set()
+        self._wake.set()
+
+    def _hand_over(self, alerts, now):
+        """
+        Call `deliver` for each alert, or hold it if it is for a digest;
+        returns a dispatched/failed record per delivered alert.
+        """
+        records, held = [], []
+        for n in alerts:
+            if n.get("digest_at") is not None:
+                held.append(n)
+                continue
+            try:
+                self.deliver(n['title'], n['message'], n['urgent'], n)
+                records.append(db.delivery_record(n, "dispatched", now=now))
+                if n.get("due_ts") is not None:
+                    metrics.observe("tend_dispatch_lateness_seconds", now - n["due_ts"], metrics.LATENESS_BUCKETS)
+            except Exception as e:
+                print("[Dispatcher] deliver error:", e)
+                records.append(db.delivery_record(n, "failed", reason=str(e), now=now))
+        if held:
+            db.hold_for_digest(held, now)
+            self._hold(held)
+        return records
+
+    # --- Digests ---
+    def _hold(self, alerts):
+        for n in alerts:
+            self._held.setdefault(n["digest_rule"], [n["digest_at"], []])[1].append(n)
+
+    def load_digests(self, sharded=False):
+        """Pick up the alerts held for a digest when the last run ended."""
+        self._held = {}
+        held = db.get_digest_holds(sharded)
+        self._hold(held)
+        if held:
+            print(f"[Dispatcher] {len(held)} alert(s) still held for a digest")
+
+    def _digest_head(self):
+        times = [entry[0] for entry in list(self._held.values())]
+        return min(times) if times else None
+
+    def _flush_digests(self, now):
+        """Deliver every digest that is due as one summary alert; meeting mode postpones them."""
+        due = [rid for rid, (at, _) in self._held.items() if at <= now]
+        if not due:
+            return
+        if db.get_meeting_mode():
+            for rid in due:
+                self._held[rid][0] = now + MAX_IDLE_WAIT
+            return
+        records, holds = [], []
+        for rid in due:
+            _, alerts = self._held.pop(rid)
+            (result,) = self._hand_over([_summary_alert(alerts, f"Digest: {len(alerts)} notifications")], now)
+            outcome = "digested" if result["outcome"] == "dispatched" else "failed"
+            records.extend(db.delivery_record(n, outcome, reason=result["reason"] or f"rule {rid}", now=now)
+                           for n in alerts)
+            holds.extend(n["hold_id"] for n in alerts)
+        self._log_records(records)
+        # Written before the holds go, so a crash in between repeats a digest rather than losing it
+        db.flush_delivery_log()
+        db.delete_digest_holds(holds)
+
+    def _log_records(self, records):
+        db.log_deliveries(records)
+        if metrics.enabled():
+            for r in records:
+                metrics.inc("tend_dispatcher_alerts_total", outcome=r["outcome"], reason=r["reason"] or "")
+        if self.on_batch:
+            self.on_batch()
+
+
+class Dispatcher(BaseDispatcher):
+    """
+    Event-driven dispatcher. The pending queue is loaded from the DB once at
+    startup; afterwards new rows are added with `schedule()` and the thread
+    sleeps exactly until the head of the queue is due.
+
+    Recurring notifications live in a second queue holding one entry per
+    rule (its next occurrence); firing an occurrence re-queues the rule at
+    the following one, so the queue size never depends on how often a rule
+    repeats. Delivery, logging and digests are BaseDispatcher's.
+    """
+
+    def __init__(self, stop_event, deliver, on_batch=None):
+        super().__init__(stop_event, deliver, on_batch)
+        self.queue = DueQueue()
+        self.rules = DueQueue()
+        self._max_id = 0
+        self._max_rule_id = 0
+        self._data_version = None
+        metrics.gauge_function("tend_dispatcher_queue_depth", self.queue.__len__,
+                               "Entries waiting in the Dispatcher's due queues.", queue="notifications")
+        metrics.gauge_function("tend_dispatcher_queue_depth", self.rules.__len__, queue="recurring")
+
+    def load_pending(self):
+        """Add undelivered rows not yet seen (all of them on the first call) to the queue."""
+        self._data_version = db.data_version()
+        entries, invalid = [], []
+        max_id = self._max_id
+        for nid, due in db.get_pending_due_times(self._max_id):
+            if nid > max_id:
+                max_id = nid
+            if due is None:
+                invalid.append(nid)
+            else:
+                entries.append((due, nid))
+        self._max_id = max_id
+        if invalid:
+            db.mark_delivered_many(invalid)
+            print(f"[Dispatcher] skipped {len(invalid)} notification(s) with an invalid time")
+            db.log_deliveries(db.delivery_record({"id": nid}, "suppressed", reason="invalid_time") for nid in invalid)
+        if entries:
+            self.queue.load(entries)
+        rules = db.get_recurring_due_times(self._max_rule_id)
+        if rules:
+            self._max_rule_id = max(self._max_rule_id, max(rid for rid, _ in rules))
+            self.rules.load((due, rid) for rid, due in rules)
+
+    def _check_external_writes(self):
+        if db.data_version() != self._data_version:
+            self.load_pending()
+            db.check_settings()
+
+    def schedule(self, nid, when, tz=None):
+        """
+        Add a freshly inserted notification to the queue. `when` is its epoch
+        (as returned by db.normalize_time) or a wall-clock time string in `tz`.
+        """
+        due = when if isinstance(when, int) else db.time_to_epoch(when, tz)
+        if due is None:
+            return
+        if self.queue.push(due, nid):
+            self._wake.set()
+
+    def schedule_rule(self, rule_id):
+        """Queue a new or changed recurrence rule at its next occurrence."""
+        rule = db.get_recurring(rule_id)
+        if rule is None or rule["next_ts"] is None:
+            return
+        if self.rules.push(rule["next_ts"], rule_id):
+            self._wake.set()
+
+    def requeue(self, nids):
+        """
+        Bring the queue in line with the given notifications after they were
+        rescheduled, snoozed or cancelled: O(log n) per id, no rescan.
+        """
+        due = db.get_due_times(nids)
+        woke = False
+        for nid in nids:
+            if due.get(nid) is None:
+                self.queue.discard(nid)
+            elif self.queue.push(due[nid], nid):
+                woke = True
+        if woke:
+            self._wake.set()
+
+    def reload(self):
+        """Ask the thread to pick up rows inserted through another connection."""
+        self._data_version = None
+        self._wake.set()
+
+    def next_due(self):
+        """The earliest due time in either queue or of a held digest, or None."""
+        heads = [h for h in (self.queue.next_due(), self.rules.next_due(), self._digest_head()) if h is not None]
+        return min(heads) if heads else None
+
+    def _fire(self, due_ids):
+        # Claim the whole batch in one transaction, then deliver; a catch-up
+        # burst costs one commit and one on_batch() call regardless of size.
+        batch = db.claim_due(due_ids)
+        if batch:
+            self._deliver_batch(batch)
+
+    def _fire_rules(self, rule_ids):
+        batch, upcoming = db.claim_recurring_due(rule_ids)
+        if upcoming:
+            self.rules.load(upcoming)
+        if batch:
+            self._deliver_batch(batch)
+
+    def _deliver_batch(self, batch):
+        # One version read, so a meeting mode toggled by another process applies immediately
+        db.check_settings()
+        now = time.time()
+        deliver, records = plan_batch(batch, now, db.get_meeting_mode(), *_catchup_settings(),
+                                      router=routing.get_router())
+        records.extend(self._hand_over(deliver, now))
+        self._log_records(records)
+
+    def run(self):
+        try:
+            self.load_pending()
+            self.load_digests()
+        except Exception as e:
+            print("[Dispatcher] load error:", e)
+        while not self.stop_event.is_set():
+            self._wake.clear()
+            metrics.inc("tend_dispatcher_wakeups_total")
+            try:
+                self._check_external_writes()
+                now = time.time()
+                due_ids = self.queue.pop_due(now)
+                if due_ids:
+                    self._fire(due_ids)
+                due_rules = self.rules.pop_due(now)
+                if due_rules:
+                    self._fire_rules(due_rules)
+                self._flush_digests(now)
+            except Exception as e:
+                print("[Dispatcher] error:", e)
+            try:
+                db.flush_delivery_log(max_age=db.DELIVERY_LOG_FLUSH_INTERVAL)
+            except Exception as e:
+                print("[Dispatcher] delivery log error:", e)
+            head = self.next_due()
+            delay = MAX_IDLE_WAIT if head is None else min(max(head - time.time(), 0), MAX_IDLE_WAIT)
+            self._wake.wait(delay)
+        db.flush_delivery_log()
+        db.close_conn()
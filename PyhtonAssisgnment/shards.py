@@ -0,0 +1,250 @@
+"""
+Sharded scheduling for very large reminder volumes.
+
+Notifications are partitioned by a key (an owner, team or channel name)
+over several SQLite files, `tend.shard0.db`, `tend.shard1.db`, ... next to
+tend.db. Each shard is owned by one worker process that keeps its own
+due-time heap and is the only writer of its file, so claims in different
+shards run on different cores and never contend for a SQLite write lock.
+
+The coordinator, `ShardedDispatcher`, keeps the next due time reported by
+every shard, sleeps until the earliest and asks all shards that are due to
+fire (in parallel). A shard claims its batch, applies the catch-up policy
+and meeting mode (`scheduler.plan_batch`) and writes the delivery log into
+its own file, so the coordinator only merges the returned alerts by due
+time and hands them to the sinks. Settings and routing rules stay in
+tend.db (the rules travel with each "fire" request); deliveries that fail
+in the coordinator, digest holds and digests are kept there.
+
+Only one-shot notifications are sharded; recurring rules and calendar
+reminders keep using the regular Dispatcher.
+"""
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+import db
+import metrics
+import routing
+from scheduler import BaseDispatcher, DueQueue, MAX_IDLE_WAIT, plan_batch, _catchup_settings
+
+DEFAULT_SHARDS = os.cpu_count() or 2
+READY_TIMEOUT = 60.0
+
+
+def shard_paths(count, base_path=None):
+    """Database files for `count` shards, derived from tend.db's path."""
+    root, ext = os.path.splitext(base_path or db.DB_PATH)
+    return [f"{root}.shard{i}{ext or '.db'}" for i in range(count)]
+
+
+def shard_for(key, count):
+    """Stable shard index for a partition key (the same in every process and run)."""
+    return zlib.crc32(str(key or "").encode("utf-8")) % count
+
+
+# ---------- WORKER PROCESS ----------
+def _shard_main(path, conn):
+    """
+    Worker loop. Requests are (op, arg) tuples; every reply ends with the
+    shard's next due time so the coordinator never has to ask for it.
+      ("add", rows)  -> ("added", inserted, skipped, next_due)
+      ("fire", (now, meeting, policy, max_age, rules))
+                     -> ("fired", alerts, {(outcome, reason): count}, next_due)
+      ("stop", None) -> exits
+    """
+    db.DB_PATH = path
+    queue = DueQueue()
+    max_id = 0
+
+    def load_new():
+        nonlocal max_id
+        entries = []
+        for nid, due in db.get_pending_due_times(max_id):
+            max_id = max(max_id, nid)
+            if due is not None:
+                entries.append((due, nid))
+        queue.load(entries)
+
+    try:
+        db.init_db()
+        load_new()
+        conn.send(("ready", queue.next_due()))
+        while True:
+            op, arg = conn.recv()
+            if op == "add":
+                inserted, skipped = db.add_notifications_bulk(arg)
+                load_new()
+                conn.send(("added", inserted, skipped, queue.next_due()))
+            elif op == "fire":
+                now, meeting, policy, max_age, rules = arg
+                ids = queue.pop_due(now)
+                deliver, records = plan_batch(db.claim_due(ids) if ids else [], now, meeting, policy, max_age,
+                                              router=routing.compile_rules(rules) if rules else None)
+                # Logged as dispatched once handed to the coordinator; failures and digests are logged there
+                records.extend(db.delivery_record(n, "dispatched", now=now) for n in deliver if "digest_at" not in n)
+                db.log_deliveries(records)
+                db.flush_delivery_log()
+                counts = {}
+                for r in records:
+                    key = (r["outcome"], r["reason"] or "")
+                    counts[key] = counts.get(key, 0) + 1
+                conn.send(("fired", deliver, counts, queue.next_due()))
+            elif op == "stop":
+                break
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        db.close_all()
+        conn.close()
+
+
+# ---------- COORDINATOR ----------
+class ShardedDispatcher(BaseDispatcher):
+    """
+    Dispatches one-shot notifications from `shards` worker processes, with
+    the same `deliver` / `on_batch` callbacks as Dispatcher. It is not a
+    Dispatcher: row ids are only unique within a shard, so there is no
+    schedule() / requeue() by id. Add notifications with `add()` /
+    `add_many()` so they reach the right shard.
+    """
+
+    def __init__(self, stop_event, deliver, on_batch=None, shards=DEFAULT_SHARDS, base_path=None):
+        super().__init__(stop_event, deliver, on_batch)
+        self.paths = shard_paths(shards, base_path)
+        self.heads = [None] * shards
+        self._workers = []
+        self._pipes = []
+        self._pipes_lock = threading.Lock()
+
+    @property
+    def shard_count(self):
+        return len(self.paths)
+
+    def start(self):
+        """Start the worker processes, wait until every shard has loaded its heap, then the coordinator."""
+        # spawn, not fork: forking a process that already runs sink and Tk threads can copy held locks
+        ctx = multiprocessing.get_context("spawn")
+        for index, path in enumerate(self.paths):
+            parent, child = ctx.Pipe()
+            proc = ctx.Process(target=_shard_main, args=(path, child), name=f"tend-shard-{index}", daemon=True)
+            proc.start()
+            child.close()
+            self._workers.append(proc)
+            self._pipes.append(parent)
+        for index, pipe in enumerate(self._pipes):
+            if not pipe.poll(READY_TIMEOUT):
+                raise RuntimeError(f"shard {index} did not start")
+            _, self.heads[index] = pipe.recv()
+        super().start()
+
+    # --- Writes (any thread) ---
+    def add(self, key, title, message, time_str, urgent=False, channel=None, tags=None):
+        """Insert one notification into the shard for `key`. Returns (inserted, skipped)."""
+        return self.add_many([(key, title, message, time_str, urgent, channel, tags)])
+
+    def add_many(self, rows):
+        """
+        Insert (key, title, message, time, urgent[, channel, tags]) rows, each
+        into its key's shard; shards insert in parallel. Returns (inserted, skipped).
+        """
+        groups = {}
+        for key, title, message, time_str, urgent, *extra in rows:
+            channel, tags = (list(extra) + [None, None])[:2]
+            if channel or tags:
+                row = {"title": title, "message": message, "time": time_str, "urgent": urgent,
+                       "channel": channel, "tags": tags}
+            else:
+                row = (title, message, time_str, urgent)
+            groups.setdefault(shard_for(key, self.shard_count), []).append(row)
+        inserted = skipped = 0
+        with self._pipes_lock:
+            for index, group in groups.items():
+                self._pipes[index].send(("add", group))
+            for index in groups:
+                _, n, bad, self.heads[index] = self._pipes[index].recv()
+                inserted += n
+                skipped += bad
+        self._wake.set()
+        return inserted, skipped
+
+    def next_due(self):
+        """The earliest next due time over all shards and held digests, or None."""
+        heads = [h for h in self.heads + [self._digest_head()] if h is not None]
+        return min(heads) if heads else None
+
+    # --- Coordinator loop ---
+    def _fire_shards(self, now):
+        due = [i for i, head in enumerate(self.heads) if head is not None and head <= now]
+        if not due:
+            return
+        db.check_settings()
+        router = routing.get_router()
+        request = ("fire", (now, db.get_meeting_mode(), *_catchup_settings(), router.rules if router else ()))
+        batch = []
+        counts = {}
+        with self._pipes_lock:
+            for index in due:
+                self._pipes[index].send(request)
+            for index in due:
+                _, alerts, shard_counts, self.heads[index] = self._pipes[index].recv()
+                for n in alerts:
+                    n["shard"] = index
+                batch.extend(alerts)
+                for key, count in shard_counts.items():
+                    counts[key] = counts.get(key, 0) + count
+        if not batch and not counts:
+            return
+        # Catch-up summaries have no due_ts; keep them after the alerts they summarize
+        batch.sort(key=lambda n: n.get("due_ts") or now)
+        failed = [r for r in self._hand_over(batch, now) if r["outcome"] == "failed"]
+        db.log_deliveries(failed)
+        if metrics.enabled():
+            for r in failed:
+                counts[("dispatched", "")] -= 1
+                counts[("failed", r["reason"] or "")] = counts.get(("failed", r["reason"] or ""), 0) + 1
+            for (outcome, reason), count in counts.items():
+                metrics.inc("tend_dispatcher_alerts_total", count, outcome=outcome, reason=reason)
+        if self.on_batch:
+            self.on_batch()
+
+    def run(self):
+        try:
+            try:
+                self.load_digests(sharded=True)
+            except Exception as e:
+                print("[shards] load error:", e)
+            while not self.stop_event.is_set():
+                self._wake.clear()
+                try:
+                    now = time.time()
+                    self._fire_shards(now)
+                    self._flush_digests(now)
+                except Exception as e:
+                    print("[shards] error:", e)
+                try:
+                    db.flush_delivery_log(max_age=db.DELIVERY_LOG_FLUSH_INTERVAL)
+                except Exception as e:
+                    print("[shards] delivery log error:", e)
+                head = self.next_due()
+                delay = MAX_IDLE_WAIT if head is None else min(max(head - time.time(), 0), MAX_IDLE_WAIT)
+                self._wake.wait(delay)
+        finally:
+            self._shutdown_workers()
+            db.flush_delivery_log()
+            db.close_conn()
+
+    def _shutdown_workers(self):
+        with self._pipes_lock:
+            for pipe in self._pipes:
+                try:
+                    pipe.send(("stop", None))
+                except (OSError, ValueError):
+                    pass
+        for proc in self._workers:
+            proc.join(5)
+            if proc.is_alive():
+                proc.terminate()
+        for pipe in self._pipes:
+            pipe.close()
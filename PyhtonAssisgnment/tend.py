@@ -0,0 +1,333 @@
+"""
+Headless command-line entry point for TEND.
+
+    python -m tend import reminders.csv
+    python -m tend import --format jsonl - < reminders.ndjson
+    python -m tend import calendar.ics --remind 15
+    python -m tend daemon
+    python -m tend add "Stand-up" "Room 4" "2025-01-01 09:30:00"
+    python -m tend add "Stand-up" "Room 4" "2025-01-06 09:30:00" --repeat "FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR"
+    python -m tend list
+    python -m tend cancel 42
+    python -m tend skip 3 "2025-01-08 09:30:00"
+    python -m tend snooze 42 10
+    python -m tend shift 60 --query standup
+    python -m tend add "Disk 90% full" "db-2" "2025-01-01 03:00:00" --channel ops --tags disk,paging
+    python -m tend rules add "channel=ops" bypass_dnd
+    python -m tend rules add "tag=low" digest --every 60
+    python -m tend rules add "quiet=22:00-07:00 urgent=no" suppress
+    python -m tend rules
+    python -m tend maintain
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import db
+import daemon
+import ical
+import retention
+import routing
+
+TRUE_VALUES = {"1", "true", "yes", "y", "on"}
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".json": "jsonl", ".ics": "ics"}
+DEFAULT_REMIND_MINUTES = "10"
+
+
+# ---------- READERS ----------
+def _is_urgent(value):
+    if isinstance(value, str):
+        return value.strip().lower() in TRUE_VALUES
+    return bool(value)
+
+
+def _row(rec):
+    # Plain tuples unless the record has a channel or tags (the common case stays cheap)
+    if rec.get("channel") or rec.get("tags"):
+        return {"title": rec.get("title"), "message": rec.get("message"), "time": rec.get("time"),
+                "urgent": _is_urgent(rec.get("urgent")), "channel": rec.get("channel"), "tags": rec.get("tags")}
+    return rec.get("title"), rec.get("message"), rec.get("time"), _is_urgent(rec.get("urgent"))
+
+
+def read_csv(fh):
+    """Yield notification rows from a CSV file with a header row (optional channel and tags columns)."""
+    for rec in csv.DictReader(fh):
+        yield _row(rec)
+
+
+def read_jsonl(fh):
+    """Yield notification rows from JSON Lines / NDJSON."""
+    for line_no, line in enumerate(fh, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            rec = json.loads(line)
+        except ValueError as e:
+            print(f"[import] line {line_no}: invalid JSON ({e})", file=sys.stderr)
+            continue
+        yield _row(rec)
+
+
+READERS = {"csv": read_csv, "jsonl": read_jsonl}
+
+
+# ---------- COMMANDS ----------
+def cmd_import(args):
+    fmt = args.format
+    if fmt is None:
+        ext = os.path.splitext(args.file)[1].lower()
+        fmt = FORMATS.get(ext, "jsonl")
+    if fmt == "ics":
+        return import_calendar(args)
+    reader = READERS[fmt]
+
+    db.init_db()
+    fh = sys.stdin if args.file == "-" else open(args.file, newline="", encoding="utf-8")
+    try:
+        start = time.perf_counter()
+        inserted, skipped = db.add_notifications_bulk(reader(fh), chunk_size=args.batch_size)
+        elapsed = time.perf_counter() - start
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+
+    rate = inserted / elapsed if elapsed > 0 else float(inserted)
+    print(f"Imported {inserted:,} notifications in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+    if skipped:
+        print(f"Skipped {skipped:,} rows with an invalid time")
+    return 0
+
+
+def import_calendar(args):
+    db.init_db()
+    remind = args.remind
+    if remind is None:
+        remind = int(db.get_setting("calendar_reminder_minutes", DEFAULT_REMIND_MINUTES))
+    errors = []
+    fh = sys.stdin if args.file == "-" else open(args.file, encoding="utf-8", errors="replace")
+    try:
+        start = time.perf_counter()
+        upserted, cancelled, reminders = db.upsert_calendar_events(
+            ical.read_events(fh, errors), remind_minutes=remind if remind >= 0 else None,
+            chunk_size=min(args.batch_size, db.CALENDAR_CHUNK_SIZE),
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+
+    rate = upserted / elapsed if elapsed > 0 else float(upserted)
+    print(f"Imported {upserted:,} calendar events in {elapsed:.2f}s ({rate:,.0f} events/sec)")
+    if reminders:
+        print(f"Scheduled {reminders:,} reminders {remind} minutes before their events")
+    if cancelled:
+        print(f"Removed {cancelled:,} cancelled events")
+    for message in errors:
+        print(f"[import] skipped event {message}", file=sys.stderr)
+    return 0
+
+
+def cmd_daemon(args):
+    daemon.DaemonServer(args.address).run()
+    return 0
+
+
+def cmd_add(args):
+    nid = daemon.Client(args.address).add(args.title, args.message, args.time, args.urgent, args.repeat, args.tz,
+                                          args.channel, args.tags)
+    if args.repeat:
+        print(f"Scheduled recurring notification {nid}")
+    else:
+        print(f"Scheduled notification {nid}")
+    return 0
+
+
+def cmd_list(args):
+    for e in daemon.Client(args.address).list(args.limit):
+        tag = "[URGENT] " if e["urgent"] else ""
+        print(f"{e['id']:>8}  {e['time']}  {tag}{e['title']}")
+    return 0
+
+
+def cmd_cancel(args):
+    kind = "recurring notification" if args.rule else "notification"
+    if daemon.Client(args.address).cancel(args.id, args.rule):
+        print(f"Cancelled {kind} {args.id}")
+        return 0
+    print(f"No {kind} with id {args.id}", file=sys.stderr)
+    return 1
+
+
+def cmd_skip(args):
+    if daemon.Client(args.address).skip(args.id, args.time):
+        print(f"Skipping the {args.time} occurrence of {args.id}")
+        return 0
+    print(f"No recurring notification with id {args.id}", file=sys.stderr)
+    return 1
+
+
+def cmd_reschedule(args):
+    if daemon.Client(args.address).reschedule(args.id, args.time):
+        print(f"Rescheduled notification {args.id} to {args.time}")
+        return 0
+    print(f"No pending notification with id {args.id}", file=sys.stderr)
+    return 1
+
+
+def cmd_snooze(args):
+    nid = daemon.Client(args.address).snooze(args.id, args.minutes, args.rule)
+    if nid is None:
+        print(f"No {'recurring ' if args.rule else ''}notification with id {args.id}", file=sys.stderr)
+        return 1
+    print(f"Snoozed for {args.minutes:g} minutes (notification {nid})")
+    return 0
+
+
+def cmd_shift(args):
+    if not (args.id or args.query or args.channel or args.tag):
+        print("shift needs --id, --query, --channel or --tag", file=sys.stderr)
+        return 2
+    moved = daemon.Client(args.address).shift(round(args.minutes * 60), ids=args.id, query=args.query,
+                                              channel=args.channel, tag=args.tag)
+    print(f"Shifted {moved:,} notifications by {args.minutes:+g} minutes")
+    return 0
+
+
+def cmd_rules(args):
+    db.init_db()
+    if args.rules_command == "add":
+        if args.action not in routing.ACTIONS:
+            print(f"unknown action {args.action!r}; one of {', '.join(routing.ACTIONS)}", file=sys.stderr)
+            return 2
+        try:
+            conditions = routing.parse_conditions(args.conditions)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+        rid = db.add_routing_rule(args.action, digest_minutes=args.every, position=args.position, **conditions)
+        print(f"Added routing rule {rid}")
+    elif args.rules_command == "delete":
+        if not db.delete_routing_rule(args.id):
+            print(f"No routing rule with id {args.id}", file=sys.stderr)
+            return 1
+        print(f"Deleted routing rule {args.id}")
+    else:
+        rules = db.get_routing_rules()
+        if not rules:
+            print("No routing rules; every alert is delivered (non-urgent ones muted in meeting mode)")
+        for rule in rules:
+            print(f"{rule[0]:>6}  {routing.describe(rule)}")
+    return 0
+
+
+def cmd_maintain(args):
+    db.init_db()
+    result = retention.maintain()
+    print(f"Archived {result['archived']:,} notifications, pruned {result['pruned']:,} delivery log rows, "
+          f"freed {result['freed_pages']:,} pages")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="tend", description="TEND — Temporal Event Notification Dispatcher")
+    parser.add_argument("--db", help="path to the SQLite database (default: tend.db next to db.py)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import", help="bulk-import notifications from CSV or JSONL/NDJSON, or an .ics calendar")
+    p_import.add_argument("file", help="input file, or '-' for stdin")
+    p_import.add_argument("--format", choices=sorted(READERS) + ["ics"], help="input format (default: from file extension)")
+    p_import.add_argument("--batch-size", type=int, default=db.BULK_CHUNK_SIZE, help="rows per transaction")
+    p_import.add_argument("--remind", type=int, metavar="MINUTES",
+                          help="ics: remind this many minutes before each event, -1 for none "
+                               "(default: the calendar_reminder_minutes setting, or 10)")
+    p_import.set_defaults(func=cmd_import)
+
+    p_daemon = sub.add_parser("daemon", help="run the headless dispatcher and local API")
+    p_daemon.set_defaults(func=cmd_daemon)
+
+    p_add = sub.add_parser("add", help="schedule a notification through the daemon")
+    p_add.add_argument("title")
+    p_add.add_argument("message")
+    p_add.add_argument("time", help="YYYY-MM-DD HH:MM:SS")
+    p_add.add_argument("--urgent", action="store_true")
+    p_add.add_argument("--tz", metavar="ZONE", help='IANA time zone of TIME, e.g. "Europe/Berlin" (default: local)')
+    p_add.add_argument("--repeat", metavar="RULE", help='recurrence rule, e.g. "FREQ=DAILY" or "FREQ=WEEKLY;BYDAY=MO,FR"')
+    p_add.add_argument("--channel", help='channel for the routing rules, e.g. "ops"')
+    p_add.add_argument("--tags", help='comma-separated tags, e.g. "low,home"')
+    p_add.set_defaults(func=cmd_add)
+
+    p_list = sub.add_parser("list", help="list upcoming notifications from the daemon")
+    p_list.add_argument("--limit", type=int, default=50)
+    p_list.set_defaults(func=cmd_list)
+
+    p_cancel = sub.add_parser("cancel", help="cancel a scheduled notification")
+    p_cancel.add_argument("id", type=int)
+    p_cancel.add_argument("--rule", action="store_true", help="the id is a recurring notification")
+    p_cancel.set_defaults(func=cmd_cancel)
+
+    p_skip = sub.add_parser("skip", help="skip one occurrence of a recurring notification")
+    p_skip.add_argument("id", type=int)
+    p_skip.add_argument("time", help="the occurrence to skip, YYYY-MM-DD HH:MM:SS")
+    p_skip.set_defaults(func=cmd_skip)
+
+    p_reschedule = sub.add_parser("reschedule", help="move a pending notification to another time")
+    p_reschedule.add_argument("id", type=int)
+    p_reschedule.add_argument("time", help="YYYY-MM-DD HH:MM:SS, in the notification's time zone")
+    p_reschedule.set_defaults(func=cmd_reschedule)
+
+    p_snooze = sub.add_parser("snooze", help="deliver a notification again in a few minutes")
+    p_snooze.add_argument("id", type=int)
+    p_snooze.add_argument("minutes", type=float, nargs="?", default=10)
+    p_snooze.add_argument("--rule", action="store_true", help="the id is a recurring notification")
+    p_snooze.set_defaults(func=cmd_snooze)
+
+    p_shift = sub.add_parser("shift", help="move many pending notifications by the same amount")
+    p_shift.add_argument("minutes", type=float, help="e.g. 60, or -15 to move earlier")
+    target = p_shift.add_mutually_exclusive_group()
+    target.add_argument("--id", type=int, nargs="+", help="notification ids")
+    target.add_argument("--query", help="all pending notifications matching this full-text search")
+    p_shift.add_argument("--channel", help="all pending notifications in this channel")
+    p_shift.add_argument("--tag", help="all pending notifications with this tag")
+    p_shift.set_defaults(func=cmd_shift)
+
+    p_rules = sub.add_parser("rules", help="list, add or delete routing rules (see routing.py)")
+    p_rules.set_defaults(func=cmd_rules, rules_command="list")
+    rules_sub = p_rules.add_subparsers(dest="rules_command")
+    rules_sub.add_parser("list", help="list the rules in evaluation order")
+    p_rule_add = rules_sub.add_parser("add", help="add a rule")
+    p_rule_add.add_argument("conditions", help='e.g. "channel=ops", "tag=low" or "quiet=22:00-07:00 urgent=no"; '
+                                               '"" matches every alert')
+    p_rule_add.add_argument("action", help=", ".join(routing.ACTIONS))
+    p_rule_add.add_argument("--every", type=int, metavar="MINUTES",
+                            help=f"digest: deliver the summary every MINUTES (default {routing.DEFAULT_DIGEST_MINUTES})")
+    p_rule_add.add_argument("--position", type=int, help="1 = tried first (default: after the existing rules)")
+    p_rule_delete = rules_sub.add_parser("delete", help="delete a rule")
+    p_rule_delete.add_argument("id", type=int)
+
+    p_maintain = sub.add_parser("maintain", help="archive old delivered notifications and compact the database now")
+    p_maintain.set_defaults(func=cmd_maintain)
+
+    for p in (p_daemon, p_add, p_list, p_cancel, p_skip, p_reschedule, p_snooze, p_shift):
+        p.add_argument("--address", default=daemon.DEFAULT_ADDRESS,
+                       help="daemon address, host:port or Unix socket path (env: TEND_DAEMON)")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.db:
+        db.DB_PATH = os.path.abspath(args.db)
+    try:
+        return args.func(args)
+    except (OSError, daemon.DaemonError) as e:
+        print(f"[tend] {e}", file=sys.stderr)
+        return 1
+    finally:
+        db.close_all()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""
+Time zones for scheduling and display.
+
+A notification is stored as a UTC epoch (`due_ts`, the only thing the
+Dispatcher compares) plus the IANA zone its wall-clock time was entered in
+(`tz`). The local zone is looked up once and cached; `refresh()` looks
+again at most every ZONE_RECHECK_INTERVAL seconds, so a laptop moved to
+another time zone picks it up within a minute without a lookup per tick.
+
+Wall-clock times around a DST change are resolved explicitly (the
+"compatible" rules of RFC 5545 / RFC 9557):
+
+    gap  - a time skipped by a forward transition (02:30 on a spring-forward
+           night) moves forward by the length of the gap (03:30)
+    fold - a time repeated by a backward transition resolves to its first
+           (earlier) occurrence
+
+Display code converts epochs lazily with `format_ts`, which caches the
+formatted text per (epoch, zone).
+"""
+import os
+import time
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:  # Python < 3.9: naive local time only
+    ZoneInfo = None
+try:
+    import tzlocal
+except ImportError:
+    tzlocal = None
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+ZONE_RECHECK_INTERVAL = 60.0
+FORMAT_CACHE_SIZE = 4096
+OFFSET_CACHE_SIZE = 16384  # (zone, wall-clock hour) pairs, ~2 years of hours
+
+_EPOCH_DAY = datetime(1970, 1, 1).toordinal()
+_LAST_SECOND = timedelta(minutes=59, seconds=59)
+
+_zone_name = None
+_zone = None
+_checked = None
+
+
+@lru_cache(maxsize=None)
+def get_zone(name):
+    """ZoneInfo for an IANA name, or None if it is unknown (or zoneinfo is unavailable)."""
+    if not name or ZoneInfo is None:
+        return None
+    try:
+        return ZoneInfo(name)
+    except Exception:
+        return None
+
+
+def _lookup_local_name():
+    if tzlocal is not None:
+        try:
+            return tzlocal.get_localzone_name()
+        except Exception:
+            pass
+    return os.environ.get("TZ") or None
+
+
+def refresh(force=False):
+    """Re-read the local zone if the cached one is older than ZONE_RECHECK_INTERVAL."""
+    global _zone_name, _zone, _checked
+    now = time.monotonic()
+    if not force and _checked is not None and now - _checked < ZONE_RECHECK_INTERVAL:
+        return
+    name = _lookup_local_name()
+    if name != _zone_name:
+        if _checked is not None:
+            print(f"[tz] local time zone changed: {_zone_name} -> {name}")
+            if hasattr(time, "tzset"):
+                time.tzset()  # so naive fromtimestamp()/timestamp() follow it too
+        _zone_name, _zone = name, get_zone(name)
+        _format.cache_clear()
+    _checked = now
+
+
+def local_zone_name():
+    """The cached IANA name of the local zone, or None if it cannot be determined."""
+    refresh()
+    return _zone_name
+
+
+def local_zone():
+    refresh()
+    return _zone
+
+
+# ---------- CONVERSION ----------
+def resolve(dt, zone):
+    """
+    (epoch, kind) for the naive wall-clock time `dt` in `zone`, where kind
+    is "ok", "gap" or "fold" (see the module docstring for the rules).
+    """
+    first = int(dt.replace(tzinfo=zone, fold=0).timestamp())
+    second = int(dt.replace(tzinfo=zone, fold=1).timestamp())
+    if first == second:
+        return first, "ok"
+    if first < second:
+        # Repeated hour: fold=0 is the earlier of the two instants
+        return first, "fold"
+    # Skipped hour: fold=0 applies the offset from before the transition,
+    # which is the wall time moved forward by the gap
+    return first, "gap"
+
+
+@lru_cache(maxsize=OFFSET_CACHE_SIZE)
+def _hour_offset(zone, day, hour):
+    """
+    The UTC offset in seconds of every wall time in hour `hour` of ordinal
+    day `day`, or None if a transition touches that hour.
+    """
+    start = datetime.fromordinal(day).replace(hour=hour)
+    offsets = {int(t.replace(tzinfo=zone, fold=fold).utcoffset().total_seconds())
+               for t in (start, start + _LAST_SECOND) for fold in (0, 1)}
+    return offsets.pop() if len(offsets) == 1 else None
+
+
+def to_epoch(dt, zone_name=None):
+    """
+    Epoch seconds for a datetime. A naive `dt` is a wall-clock time in
+    `zone_name` (default: the local zone).
+    """
+    if dt.tzinfo is not None:
+        return int(dt.timestamp())
+    return _wall_to_epoch(dt, get_zone(zone_name) if zone_name else local_zone())
+
+
+def _wall_to_epoch(dt, zone):
+    if zone is None:
+        return int(dt.timestamp())  # system local time
+    # Bulk inserts convert many times in the same few hours; only hours with a
+    # DST transition need the full gap/fold resolution
+    day = dt.toordinal()
+    offset = _hour_offset(zone, day, dt.hour)
+    if offset is None:
+        return resolve(dt, zone)[0]
+    return (day - _EPOCH_DAY) * 86400 + dt.hour * 3600 + dt.minute * 60 + dt.second - offset
+
+
+def wall_time(ts, zone_name=None):
+    """The naive wall-clock datetime of epoch `ts` in `zone_name` (default: local)."""
+    zone = get_zone(zone_name) if zone_name else local_zone()
+    if zone is None:
+        return datetime.fromtimestamp(ts)
+    return datetime.fromtimestamp(ts, zone).replace(tzinfo=None)
+
+
+def parse(time_str, zone_name=None):
+    """
+    Parse an ISO-8601 style timestamp entered in `zone_name` (default: the
+    local zone). Returns (wall-clock text in TIME_FORMAT, epoch, zone name),
+    or None if it is invalid. Offset-aware inputs are converted to the zone.
+    """
+    try:
+        dt = datetime.fromisoformat(time_str.strip())
+    except (AttributeError, ValueError):
+        return None
+    zone_name = zone_name or local_zone_name()
+    if dt.tzinfo is not None:
+        ts = int(dt.timestamp())
+        return wall_time(ts, zone_name).strftime(TIME_FORMAT), ts, zone_name
+    ts = _wall_to_epoch(dt, get_zone(zone_name))
+    if len(time_str) == 19 and time_str[10] == " ":
+        # Already in the stored form; skip the (comparatively slow) strftime
+        return time_str, ts, zone_name
+    return dt.strftime(TIME_FORMAT), ts, zone_name
+
+
+# ---------- DISPLAY ----------
+def format_ts(ts, fmt=TIME_FORMAT, zone_name=None):
+    """Display text for epoch `ts` in `zone_name` (default: local), cached."""
+    if zone_name is None:
+        refresh()
+        zone_name = _zone_name
+    return _format(int(ts), fmt, zone_name)
+
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def _format(ts, fmt, zone_name):
+    dt = wall_time(ts, zone_name)
+    # isoformat gives TIME_FORMAT for whole seconds and is much cheaper than strftime
+    return dt.isoformat(" ") if fmt == TIME_FORMAT else dt.strftime(fmt)
@@ -0,0 +1,187 @@
+"""
+Background weather service.
+
+The GUI only ever reads `current()`, which returns immediately from an
+in-memory cache (seeded from the DB cache). Fetching happens on a worker
+thread: weather is refreshed after WEATHER_TTL, the IP geolocation is cached
+separately for GEO_TTL, stale values keep being served while a refresh is in
+flight, and failures back off exponentially up to BACKOFF_MAX.
+"""
+import json
+import threading
+import time
+import db
+import metrics
+
+WEATHER_URL = "https://api.open-meteo.com/v1/forecast"
+GEO_URL = "https://ipinfo.io/json"
+WEATHER_TTL = 15 * 60
+GEO_TTL = 24 * 60 * 60
+REQUEST_TIMEOUT = 5
+BACKOFF_BASE = 30
+BACKOFF_MAX = 30 * 60
+
+OFFLINE = ("Offline", "N/A", "Unknown")
+
+
+class WeatherService:
+    def __init__(self, weather_url=WEATHER_URL, geo_url=GEO_URL, ttl=WEATHER_TTL, geo_ttl=GEO_TTL,
+                 timeout=REQUEST_TIMEOUT):
+        self.weather_url = weather_url
+        self.geo_url = geo_url
+        self.ttl = ttl
+        self.geo_ttl = geo_ttl
+        self.timeout = timeout
+        self._session = None
+        self._lock = threading.Lock()
+        self._weather = None
+        self._fetched_at = 0.0
+        self._geo = None
+        self._geo_at = 0.0
+        self._failures = 0
+        self._retry_at = 0.0
+        self._refreshing = False
+        self._listeners = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    # --- Cache ---
+    def _load_persisted(self):
+        if self._weather is None:
+            self._weather = db.load_weather_cache()
+            self._fetched_at = float(db.get_setting("weather_cache_fetched", "0") or 0)
+        if self._geo is None:
+            raw = db.get_setting("geo_cache", "")
+            if raw:
+                try:
+                    geo = json.loads(raw)
+                    self._geo = (geo["lat"], geo["lon"], geo["city"])
+                    self._geo_at = float(geo["at"])
+                except (ValueError, KeyError, TypeError):
+                    pass
+
+    def current(self):
+        """Return (city, temp, condition) without blocking; schedules a refresh if stale."""
+        with self._lock:
+            if self._weather is None:
+                try:
+                    self._load_persisted()
+                except Exception as e:
+                    print("[weather] cache load error:", e)
+                    self._weather = OFFLINE
+            weather = self._weather
+        if self.is_stale():
+            self._wake.set()
+        return weather
+
+    def is_stale(self):
+        return time.time() - self._fetched_at >= self.ttl
+
+    def subscribe(self, callback):
+        """`callback(city, temp, condition)` runs on the worker thread after each successful fetch."""
+        self._listeners.append(callback)
+
+    # --- Fetching ---
+    @property
+    def session(self):
+        # requests is imported on the worker thread, not while the GUI starts up
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+        return self._session
+
+    def _locate(self):
+        now = time.time()
+        if self._geo is not None and now - self._geo_at < self.geo_ttl:
+            return self._geo
+        r = self.session.get(self.geo_url, timeout=self.timeout)
+        r.raise_for_status()
+        info = r.json()
+        lat, lon = (float(x) for x in info["loc"].split(","))
+        self._geo = (lat, lon, info.get("city") or "Your Location")
+        self._geo_at = now
+        db.set_setting("geo_cache", json.dumps({"lat": lat, "lon": lon, "city": self._geo[2], "at": now}))
+        return self._geo
+
+    def refresh(self):
+        """Fetch now (blocking) unless backing off. Returns True on success."""
+        with self._lock:
+            if self._refreshing or time.time() < self._retry_at:
+                return False
+            self._refreshing = True
+            self._load_persisted()
+        started = time.perf_counter()
+        try:
+            lat, lon, city = self._locate()
+            r = self.session.get(
+                self.weather_url,
+                params={"latitude": lat, "longitude": lon, "current_weather": "true"},
+                timeout=self.timeout,
+            )
+            r.raise_for_status()
+            cw = r.json().get("current_weather", {})
+            temp = cw.get("temperature")
+            condition = "Clear" if cw.get("weathercode", 0) == 0 else "Cloudy"
+            db.save_weather_cache(city, temp, condition)
+            now = time.time()
+            db.set_setting("weather_cache_fetched", str(now))
+            with self._lock:
+                self._weather = (city, temp, condition)
+                self._fetched_at = now
+                self._failures = 0
+                self._retry_at = 0.0
+        except Exception as e:
+            with self._lock:
+                self._failures += 1
+                delay = min(BACKOFF_BASE * 2 ** (self._failures - 1), BACKOFF_MAX)
+                self._retry_at = time.time() + delay
+            print(f"[weather] fetch failed ({e}); retrying in {delay}s")
+            metrics.inc("tend_weather_fetches_total", result="error")
+            return False
+        finally:
+            with self._lock:
+                self._refreshing = False
+            metrics.observe("tend_weather_fetch_seconds", time.perf_counter() - started)
+        metrics.inc("tend_weather_fetches_total", result="ok")
+        for callback in list(self._listeners):
+            try:
+                callback(*self._weather)
+            except Exception as e:
+                print("[weather] listener error:", e)
+        return True
+
+    # --- Background worker ---
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="weather", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.is_stale():
+                self.refresh()
+            now = time.time()
+            next_due = self._fetched_at + self.ttl
+            if self._retry_at > now:
+                next_due = max(next_due, self._retry_at)
+            self._wake.wait(max(1.0, next_due - now))
+            self._wake.clear()
+        db.close_conn()
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service():
+    """Process-wide WeatherService shared by the splash preload and the GUI."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = WeatherService()
+        return _service
@@ -0,0 +1,164 @@
+"""
+Incremental / virtualized list widgets used by the GUI.
+
+Both helpers diff the new rows against what is already on screen and only
+touch the Tk items that changed, keyed by a stable row key (the
+notification id), instead of deleting and re-inserting everything.
+"""
+import difflib
+import ttkbootstrap as ttk
+
+DEFAULT_ROW_HEIGHT = 20
+
+
+def sync_treeview(tree, rows):
+    """
+    Make `tree`'s top-level items match `rows`, a sequence of (key, values).
+    Items are keyed by str(key); only added, removed, changed or moved rows
+    cause Tk calls.
+    """
+    wanted = {str(key): tuple(values) for key, values in rows}
+    current = tree.get_children()
+    stale = [iid for iid in current if iid not in wanted]
+    if stale:
+        tree.delete(*stale)
+    current = set(current).difference(stale)
+
+    for index, (key, values) in enumerate(rows):
+        iid = str(key)
+        values = wanted[iid]
+        if iid not in current:
+            tree.insert("", index, iid=iid, values=values)
+        else:
+            if tuple(tree.item(iid, "values")) != tuple(str(v) for v in values):
+                tree.item(iid, values=values)
+            if tree.index(iid) != index:
+                tree.move(iid, "", index)
+
+
+def sync_listbox(listbox, old_lines, new_lines):
+    """Apply the minimal insert/delete edits turning `old_lines` into `new_lines`."""
+    matcher = difflib.SequenceMatcher(a=old_lines, b=new_lines, autojunk=False)
+    # Apply from the end so earlier indexes stay valid
+    for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+        if tag == "equal":
+            continue
+        if i2 > i1:
+            listbox.delete(i1, i2 - 1)
+        for offset, line in enumerate(new_lines[j1:j2]):
+            listbox.insert(i1 + offset, line)
+    return list(new_lines)
+
+
+class VirtualTreeview(ttk.Frame):
+    """
+    A Treeview that only materializes the rows currently in view. The full
+    row list lives in Python (`set_rows`); scrolling moves a window over it
+    and re-syncs the visible slice with `sync_treeview`.
+
+    Rows scrolled out of view are deleted from Tk, which drops them from
+    its selection, so the selection is kept in `selected` (a set of keys)
+    and re-applied to the visible slice on every render.
+    """
+
+    def __init__(self, parent, columns, headings, widths, anchors=None, **kw):
+        super().__init__(parent, **kw)
+        self.rows = []
+        self.offset = 0
+        self.visible = 15
+        self.selected = set()
+        self._replace_selection = False
+        self.tree = ttk.Treeview(self, columns=columns, show="headings", height=self.visible)
+        for col in columns:
+            self.tree.heading(col, text=headings.get(col, col))
+            self.tree.column(col, width=widths.get(col, 100), anchor=(anchors or {}).get(col, "w"))
+        self.vsb = ttk.Scrollbar(self, orient="vertical", command=self._on_scrollbar)
+        self.vsb.pack(side="right", fill="y")
+        self.tree.pack(side="left", fill="both", expand=True)
+
+        self.tree.bind("<Configure>", self._on_configure)
+        self.tree.bind("<MouseWheel>", self._on_wheel)
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(3))
+        self.tree.bind("<Prior>", lambda e: self._on_key(-self.visible))
+        self.tree.bind("<Next>", lambda e: self._on_key(self.visible))
+        self.tree.bind("<<TreeviewSelect>>", self._on_select)
+        for sequence in ("<ButtonPress-1>", "<KeyPress-Up>", "<KeyPress-Down>"):
+            self.tree.bind(sequence, self._on_press, add="+")
+
+    # --- Data ---
+    def set_rows(self, rows):
+        """Replace the backing rows: a list of (key, values) tuples."""
+        self.rows = rows
+        if self.selected:
+            self.selected &= {str(key) for key, _ in rows}
+        self._render()
+
+    def selection_keys(self):
+        """Keys of all selected rows, visible or not, in row order."""
+        if not self.selected:
+            return []
+        return [str(key) for key, _ in self.rows if str(key) in self.selected]
+
+    # --- Selection ---
+    def _on_press(self, event):
+        # A plain click or arrow key replaces the selection; with Shift or Control it extends it.
+        # Only the selection event this press causes counts, so the flag is cleared once idle.
+        if event.num == 1 and self.tree.identify_region(event.x, event.y) not in ("cell", "tree"):
+            return
+        self._replace_selection = not event.state & 0x5
+        self.after_idle(self._end_press)
+
+    def _end_press(self):
+        self._replace_selection = False
+
+    def _on_select(self, event=None):
+        in_view = set(self.tree.selection())
+        if self._replace_selection:
+            self.selected = in_view
+            self._replace_selection = False
+        else:
+            # Renders and Ctrl/Shift-clicks only change the rows in view
+            self.selected = (self.selected - set(self.tree.get_children())) | in_view
+
+    # --- Scrolling ---
+    def scroll(self, delta):
+        self.offset += delta
+        self._render()
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.offset = int(float(amount) * len(self.rows))
+        elif action == "scroll":
+            step = self.visible if unit == "pages" else 1
+            self.offset += int(amount) * step
+        self._render()
+
+    def _on_wheel(self, event):
+        self.scroll(-3 if event.delta > 0 else 3)
+        return "break"
+
+    def _on_key(self, delta):
+        self.scroll(delta)
+        return "break"
+
+    def _on_configure(self, event):
+        style = ttk.Style()
+        row_height = int(style.lookup("Treeview", "rowheight") or DEFAULT_ROW_HEIGHT)
+        # Leave room for the heading row
+        visible = max(1, event.height // row_height - 1)
+        if visible != self.visible:
+            self.visible = visible
+            self._render()
+
+    def _render(self):
+        total = len(self.rows)
+        self.offset = max(0, min(self.offset, total - self.visible))
+        window = self.rows[self.offset:self.offset + self.visible]
+        sync_treeview(self.tree, window)
+        if self.selected or self.tree.selection():
+            self.tree.selection_set([iid for iid in self.tree.get_children() if iid in self.selected])
+        if total:
+            self.vsb.set(self.offset / total, min(1.0, (self.offset + len(window)) / total))
+        else:
+            self.vsb.set(0.0, 1.0)